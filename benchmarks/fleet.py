@@ -0,0 +1,178 @@
+#!/usr/bin/env python2
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+"""
+Measures the driver operations against simulated inventories of growing
+size: wall time, SOAP round trips, bytes sent and received and the growth
+of the peak RSS of the process, per operation.
+
+    benchmarks/fleet.py -o results.json
+    benchmarks/fleet.py -s 100,1000 -c results.json
+
+The results saved with -o can be given back with -c, to compare a run
+with the one of another commit.
+
+The simulator serves the calls in process, without suds or HTTP: the
+SOAP round trips are counted, but the bytes sent and received are
+estimates of the envelope sizes, not measured on the wire, and the costs
+of the marshalling and of the transport are left out.
+"""
+
+import argparse
+import json
+import platform
+import resource
+import sys
+import time
+
+from pyvmwareapi import metrics
+from pyvmwareapi import simulator
+
+SIZES = "100,1000,10000,50000"
+DISK_SIZE = 1024 * 1024 * 1024
+NETWORK_INFO = [{'pg': simulator.NETWORK_NAME,
+                 'address': "00:50:56:00:00:01",
+                 'vlan': 0}]
+# Slowdown ratio flagged when comparing with a previous run
+REGRESSION_RATIO = 1.5
+
+
+def new_instance(index):
+    return {'name': "bench-%06d" % index,
+            'uuid': "bench-uuid-%06d" % index,
+            'vcpus': 1,
+            'memory_mb': 512}
+
+
+def run_operations(conn, num_vms, count):
+    """Yields (operation, calls, function running them) to measure."""
+    existing = [{'name': "vm-%06d" % (index * num_vms / count)}
+                for index in range(count)]
+    instances = [new_instance(index) for index in range(count)]
+
+    def _each(func, items):
+        return lambda: [func(item) for item in items]
+
+    yield "list_instances", 1, conn.list_instances
+    yield "get_info", count, _each(conn.get_info, existing)
+    yield "spawn", count, _each(lambda instance: conn.spawn(instance,
+                                        DISK_SIZE, NETWORK_INFO), instances)
+    yield "reboot", count, _each(conn.reboot, instances)
+    yield "destroy", count, _each(conn.destroy, instances)
+
+
+def get_peak_rss():
+    # Kilobytes on Linux, bytes on Mac OS X
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def measure(func):
+    """
+    Runs func, returning its wall time, SOAP call metrics and how much it
+    raised the peak RSS of the process. The peak never goes down: an
+    operation staying under the peak of the ones before it reports 0.
+    """
+    metrics.REGISTRY.reset()
+    peak_rss = get_peak_rss()
+    start = time.time()
+    func()
+    wall_time = time.time() - start
+    snapshot = metrics.REGISTRY.snapshot()
+    return {'wall_time': wall_time,
+            'soap_calls': sum([method['calls']
+                               for method in snapshot.values()]),
+            'request_bytes': sum([method['request_bytes']
+                                  for method in snapshot.values()]),
+            'response_bytes': sum([method['response_bytes']
+                                   for method in snapshot.values()]),
+            'peak_rss_growth': get_peak_rss() - peak_rss}
+
+
+def run(sizes, count, latency, baseline=None, inline_disk=False):
+    """
+    Measures the operations for each inventory size, printing each
+    result against its baseline one, if any.
+    """
+    previous = {}
+    if baseline:
+        previous = dict(((result['vms'], result['operation']), result)
+                        for result in baseline['results'])
+    results = []
+    for num_vms in sizes:
+        start = time.time()
+        sim = simulator.Simulator(num_vms=num_vms, latency=latency)
+        conn = sim.driver(inline_disk=inline_disk)
+        print >> sys.stderr, "%d VMs simulated in %.1fs" % (
+                                            num_vms, time.time() - start)
+        for operation, calls, func in run_operations(conn, num_vms, count):
+            result = measure(func)
+            result.update({'vms': num_vms,
+                           'operation': operation,
+                           'calls': calls})
+            result['wall_time_per_call'] = result['wall_time'] / calls
+            results.append(result)
+            print_result(result, previous.get((num_vms, operation)))
+        conn.close()
+        del conn, sim
+    return results
+
+
+def print_result(result, baseline=None):
+    line = ("%(vms)7d %(operation)-15s %(calls)4d calls "
+            "%(wall_time_per_call)9.4fs/call %(soap_calls)7d soap "
+            "%(request_bytes)11d B out %(response_bytes)12d B in "
+            "%(peak_rss_growth)9d rss+" % result)
+    if baseline:
+        ratio = (result['wall_time_per_call'] /
+                 max(baseline['wall_time_per_call'], 1e-9))
+        line += " %5.2fx" % ratio
+        if ratio > REGRESSION_RATIO:
+            line += " SLOWER"
+    print line
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Driver operations at '
+                                                 'fleet scale')
+    parser.add_argument('-s', '--sizes', help='Comma separated VM counts',
+                        default=SIZES)
+    parser.add_argument('-n', '--count', help='Calls per operation',
+                        type=int, default=10)
+    parser.add_argument('-l', '--latency', help='Seconds per SOAP call',
+                        type=float, default=0.0)
+    parser.add_argument('-o', '--output', help='JSON file to save to',
+                        default=None)
+    parser.add_argument('-c', '--compare', help='JSON file of a previous '
+                                                'run to compare with',
+                        default=None)
+    parser.add_argument('-i', '--inline-disk', help='Spawn the VMs with '
+                        'their disk in the CreateVM spec',
+                        action='store_true', default=False)
+    parser.add_argument('-L', '--label', help='Label of the run, e.g. '
+                                              'the commit', default=None)
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(",")]
+    print ("In-process simulator, without suds or HTTP: the bytes are "
+           "estimated, not measured")
+    baseline = None
+    if args.compare:
+        baseline = json.load(open(args.compare))
+        print "Compared with %s (%s)" % (args.compare, baseline['label'])
+    results = run(sizes, args.count, args.latency, baseline,
+                  args.inline_disk)
+    if args.output:
+        output = {'label': args.label,
+                  'time': time.time(),
+                  'python': platform.python_version(),
+                  'platform': platform.platform(),
+                  'count': args.count,
+                  'latency': args.latency,
+                  'inline_disk': args.inline_disk,
+                  'bytes_estimated': True,
+                  'results': results}
+        json.dump(output, open(args.output, "w"), indent=1, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main()
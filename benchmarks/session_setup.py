@@ -0,0 +1,96 @@
+#!/usr/bin/env python2
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+"""
+Measures VMwareAPISession construction time with a cold and a warm
+WSDL/schema cache. The "new process" case runs each session in a fresh
+interpreter, as a new CLI invocation would, so that it only gains from
+the schema pickled on disk.
+
+    benchmarks/session_setup.py -H host -U root -P password [-W wsdl]
+"""
+
+import argparse
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from pyvmwareapi import driver
+from pyvmwareapi import vim
+
+
+def time_session(args, cache_dir):
+    start = time.time()
+    session = driver.VMwareAPISession(args.host, args.user, args.password,
+                                      driver.API_RETRY_COUNT,
+                                      wsdl_loc=args.wsdl,
+                                      wsdl_cache_dir=cache_dir)
+    elapsed = time.time() - start
+    del session
+    return elapsed
+
+
+def time_new_process(args, cache_dir):
+    command = [sys.executable, __file__, '-H', args.host, '-U', args.user,
+               '-P', args.password, '--child', cache_dir]
+    if args.wsdl:
+        command += ['-W', args.wsdl]
+    return float(subprocess.check_output(command))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='VMwareAPISession setup '
+                                                 'time, cold versus warm')
+    parser.add_argument('-H', '--host', help='VMWare host', required=True)
+    parser.add_argument('-U', '--user', help='VMWare username', required=True)
+    parser.add_argument('-P', '--password', help='VMWare password',
+                        required=True)
+    parser.add_argument('-W', '--wsdl', help='Local WSDL location',
+                        default=None)
+    parser.add_argument('-r', '--runs', help='Warm runs', type=int, default=5)
+    parser.add_argument('--child', help=argparse.SUPPRESS, default=None)
+    args = parser.parse_args()
+
+    if args.child:
+        # One session in this new process, with the cache of the parent
+        print "%f" % time_session(args, args.child)
+        return
+
+    cache_dir = tempfile.mkdtemp(prefix='pyvmwareapi-bench-')
+    try:
+        # Nothing parsed yet, neither in this process nor on disk
+        vim._CLIENTS.clear()
+        vim._VERSION_KEYS.clear()
+        cold = time_session(args, cache_dir)
+
+        # Schema pickled on disk only, in a new interpreter
+        new_process = []
+        for run in range(args.runs):
+            new_process.append(time_new_process(args, cache_dir))
+
+        # Schema pickled on disk only, but the modules already imported
+        warm_disk = []
+        for run in range(args.runs):
+            vim._CLIENTS.clear()
+            vim._VERSION_KEYS.clear()
+            warm_disk.append(time_session(args, cache_dir))
+
+        # Schema already parsed by this process
+        warm_process = []
+        for run in range(args.runs):
+            warm_process.append(time_session(args, cache_dir))
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+    print "cold:                   %8.3f s" % cold
+    print "new process, warm disk: %8.3f s (best of %d)" % (
+                                                min(new_process), args.runs)
+    print "warm (disk):            %8.3f s (best of %d)" % (min(warm_disk),
+                                                          args.runs)
+    print "warm (in process):      %8.3f s (best of %d)" % (
+                                                min(warm_process), args.runs)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python2
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+"""
+Measures the CPU time spent building the property collector specs of a
+get_objects and a get_dynamic_property call, with the specs built from
+scratch and taken from the vim_util spec cache.
+
+    benchmarks/spec_construction.py -W file:///path/to/vimService.wsdl
+"""
+
+import argparse
+import time
+
+import suds.client
+
+from pyvmwareapi import vim_util
+
+
+def build_get_objects_specs(client_factory, root_folder):
+    """The specs of a get_objects call, built from scratch."""
+    object_spec = vim_util.build_object_spec(client_factory, root_folder,
+                    [vim_util.build_recursive_traversal_spec(client_factory)])
+    property_spec = vim_util.build_property_spec(client_factory,
+                    type="VirtualMachine", properties_to_collect=["name"])
+    return vim_util.build_property_filter_spec(client_factory,
+                    [property_spec], [object_spec])
+
+
+def cached_get_objects_specs(client_factory, root_folder):
+    """The specs of a get_objects call, from the spec cache."""
+    return vim_util.get_spec_cache(client_factory).get_objects_filter_spec(
+                    root_folder, "VirtualMachine", ["name"])
+
+
+def build_get_dynamic_property_specs(client_factory, mobj):
+    """The specs of a get_dynamic_property call, built from scratch."""
+    property_spec = vim_util.build_property_spec(client_factory,
+                    type="VirtualMachine",
+                    properties_to_collect=["runtime.powerState"])
+    return vim_util.get_prop_filter_spec(client_factory,
+                    [vim_util.get_obj_spec(client_factory, mobj)],
+                    [property_spec])
+
+
+def cached_get_dynamic_property_specs(client_factory, mobj):
+    """The specs of a get_dynamic_property call, with the cache."""
+    property_spec = vim_util.get_spec_cache(client_factory).get_property_spec(
+                    "VirtualMachine", ["runtime.powerState"])
+    return vim_util.get_prop_filter_spec(client_factory,
+                    [vim_util.get_obj_spec(client_factory, mobj)],
+                    [property_spec])
+
+
+def cpu_per_call(func, client_factory, mobj, calls):
+    """Gets the CPU time of a call of func, in microseconds."""
+    # Warm up, filling the cache in the cached case
+    func(client_factory, mobj)
+    start = time.clock()
+    for call in range(calls):
+        func(client_factory, mobj)
+    return (time.clock() - start) / calls * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Property collector spec '
+                                                 'construction CPU time')
+    parser.add_argument('-W', '--wsdl', help='WSDL location', required=True)
+    parser.add_argument('-n', '--calls', help='Calls per measure', type=int,
+                        default=1000)
+    args = parser.parse_args()
+
+    client = suds.client.Client(args.wsdl)
+    client_factory = client.factory
+    root_folder = client_factory.create('ns0:ManagedObjectReference')
+    root_folder._type = "Folder"
+    root_folder.value = "group-d1"
+    vm = client_factory.create('ns0:ManagedObjectReference')
+    vm._type = "VirtualMachine"
+    vm.value = "vm-1"
+
+    for name, built, cached, mobj in [
+            ("get_objects", build_get_objects_specs,
+             cached_get_objects_specs, root_folder),
+            ("get_dynamic_property", build_get_dynamic_property_specs,
+             cached_get_dynamic_property_specs, vm)]:
+        before = cpu_per_call(built, client_factory, mobj, args.calls)
+        after = cpu_per_call(cached, client_factory, mobj, args.calls)
+        print "%-22s built: %8.1f us/call  cached: %8.1f us/call" % (
+                                                    name, before, after)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,283 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+"""
+Record and replay of the HTTP exchanges of VIM Objects, to run the
+package against the payloads of a real host without the host. The
+exchanges, with their latencies, are recorded to a cassette file:
+
+    recorder = cassette.Recorder("esx1.cassette")
+    conn = driver.VMwareESXDriver(host, user, password,
+                                  transport_factory=recorder.transport)
+    conn.list_instances()
+    recorder.close()
+
+and replayed from it, with the latencies scaled, e.g. not waited for:
+
+    player = cassette.Player("esx1.cassette", latency_scale=0.0)
+    conn = driver.VMwareESXDriver(host, user, password,
+                                  transport_factory=player.transport)
+    conn.list_instances()
+
+The WSDL and schemas are only fetched from the host with a cold WSDL
+cache: record with an empty wsdl_cache_dir to replay on a machine that
+never talked to the host. The passwords of the requests and the session
+cookies of the replies are not recorded.
+"""
+
+import json
+import re
+import StringIO
+import threading
+import time
+
+import executor
+import vim
+
+try:
+    import suds.transport
+except ImportError:
+    suds = None
+
+# The method called, the first element of the SOAP body
+SOAP_METHOD_RE = re.compile(r"<(?:[\w.-]+:)?Body[^>]*>\s*<(?:[\w.-]+:)?"
+                            r"([\w.-]+)")
+
+
+# The password elements of a request, e.g. the one of Login
+PASSWORD_RE = re.compile(r"(<(?:[\w.-]+:)?password(?:\s[^>]*)?>).*?"
+                         r"(</(?:[\w.-]+:)?password>)", re.DOTALL)
+REDACTED = "REDACTED"
+# Headers of the replies that are not recorded
+SESSION_HEADERS = ["set-cookie", "cookie"]
+
+
+def redact(message):
+    """Replaces the passwords of a SOAP request."""
+    if message is None:
+        return None
+    return PASSWORD_RE.sub(r"\1%s\2" % REDACTED, message)
+
+
+def _redact_headers(headers):
+    return dict((name, value) for name, value in headers.items()
+                if name.lower() not in SESSION_HEADERS)
+
+
+def get_soap_method(message):
+    """Gets the name of the method called by a SOAP request."""
+    match = SOAP_METHOD_RE.search(message or "")
+    return match and match.group(1) or None
+
+
+def _decode(text):
+    if text is None:
+        return None
+    return text.decode("utf-8")
+
+
+def _encode(text):
+    if text is None:
+        return None
+    return text.encode("utf-8")
+
+
+if suds:
+
+    class RecordingTransport(suds.transport.Transport):
+        """Records the exchanges made over another transport."""
+
+        def __init__(self, recorder):
+            suds.transport.Transport.__init__(self)
+            self._recorder = recorder
+            self._transport = recorder.transport_factory()
+            # Replaced by the VIM Objects sharing a session, handed over
+            # to the recorded transport on each exchange
+            self.cookiejar = getattr(self._transport, "cookiejar", None)
+
+        def __deepcopy__(self, memo={}):
+            return RecordingTransport(self._recorder)
+
+        def open(self, request):
+            self._transport.cookiejar = self.cookiejar
+            start = time.time()
+            try:
+                reply = self._transport.open(request).read()
+            except suds.transport.TransportError, excep:
+                self._recorder.record("open", request, time.time() - start,
+                                      excep.httpcode, {},
+                                      excep.fp and excep.fp.read())
+                raise
+            self._recorder.record("open", request, time.time() - start,
+                                  200, {}, reply)
+            return StringIO.StringIO(reply)
+
+        def send(self, request):
+            self._transport.cookiejar = self.cookiejar
+            start = time.time()
+            try:
+                reply = self._transport.send(request)
+            except suds.transport.TransportError, excep:
+                message = excep.fp and excep.fp.read()
+                self._recorder.record("send", request, time.time() - start,
+                                      excep.httpcode, {}, message,
+                                      str(excep))
+                # The reply was read for the record, a copy goes on
+                excep.fp = StringIO.StringIO(message or "")
+                raise
+            if reply is None:
+                self._recorder.record("send", request, time.time() - start,
+                                      204, {}, None)
+            else:
+                self._recorder.record("send", request, time.time() - start,
+                                      reply.code, dict(reply.headers),
+                                      reply.message)
+            return reply
+
+    class ReplayTransport(suds.transport.Transport):
+        """Replays the exchanges of a Player."""
+
+        def __init__(self, player):
+            suds.transport.Transport.__init__(self)
+            self._player = player
+            self.cookiejar = None
+
+        def __deepcopy__(self, memo={}):
+            return ReplayTransport(self._player)
+
+        def open(self, request):
+            exchange = self._player.replay("open", request)
+            if exchange['code'] != 200:
+                raise suds.transport.TransportError(exchange['reason'],
+                        exchange['code'],
+                        StringIO.StringIO(_encode(exchange['reply']) or ""))
+            return StringIO.StringIO(_encode(exchange['reply']))
+
+        def send(self, request):
+            exchange = self._player.replay("send", request)
+            if exchange['code'] == 204:
+                return None
+            if exchange['code'] != 200:
+                raise suds.transport.TransportError(exchange['reason'],
+                        exchange['code'],
+                        StringIO.StringIO(_encode(exchange['reply']) or ""))
+            return suds.transport.Reply(exchange['code'],
+                                        exchange['headers'],
+                                        _encode(exchange['reply']))
+
+
+class Recorder(object):
+    """
+    Records the exchanges of the transports it makes to a cassette, one
+    JSON object per line.
+
+    transport_factory : Returns a new transport to record the exchanges
+                        of, defaults to the one of the VIM Objects
+    """
+
+    def __init__(self, path, transport_factory=None):
+        if not suds:
+            raise Exception("Unable to import suds.")
+        self.transport_factory = (transport_factory or
+                                  vim.get_transport_factory())
+        self._file = open(path, "w")
+        self._lock = threading.Lock()
+
+    def transport(self):
+        """Makes a recording transport, a transport_factory for Vim."""
+        return RecordingTransport(self)
+
+    def record(self, kind, request, latency, code, headers, reply,
+               reason=None):
+        exchange = {'kind': kind,
+                    'url': request.url,
+                    'method': get_soap_method(request.message),
+                    'request': _decode(redact(request.message)),
+                    'latency': latency,
+                    'code': code,
+                    'reason': reason,
+                    'headers': _redact_headers(headers),
+                    'reply': _decode(reply)}
+        line = json.dumps(exchange, sort_keys=True) + "\n"
+        self._lock.acquire()
+        try:
+            self._file.write(line)
+            self._file.flush()
+        finally:
+            self._lock.release()
+
+    def close(self):
+        self._file.close()
+
+
+class Player(object):
+    """
+    Replays the exchanges of a cassette. A request gets the reply of the
+    first exchange left, recorded for the same method, with the same
+    request, passwords aside, if there is one. Login, whose credentials
+    differ from a machine to the other, is matched by its method only.
+    The recorded latency is waited for, scaled by latency_scale.
+    """
+
+    def __init__(self, path, latency_scale=1.0):
+        if not suds:
+            raise Exception("Unable to import suds.")
+        self.latency_scale = latency_scale
+        self._lock = threading.Lock()
+        # url -> exchange, for the documents fetched
+        self._documents = {}
+        # SOAP method -> exchanges left to replay, in order
+        self._exchanges = {}
+        for line in open(path):
+            exchange = json.loads(line)
+            if exchange['kind'] == "open":
+                self._documents[exchange['url']] = exchange
+            else:
+                self._exchanges.setdefault(exchange['method'],
+                                           []).append(exchange)
+
+    def transport(self):
+        """Makes a replaying transport, a transport_factory for Vim."""
+        return ReplayTransport(self)
+
+    def remaining(self):
+        """Gets the number of exchanges not replayed yet, by method."""
+        self._lock.acquire()
+        try:
+            return dict((method, len(exchanges))
+                        for method, exchanges in self._exchanges.items()
+                        if exchanges)
+        finally:
+            self._lock.release()
+
+    def replay(self, kind, request):
+        """Gets the exchange replaying the request."""
+        if kind == "open":
+            exchange = self._documents.get(request.url)
+            if exchange is None:
+                return {'code': 404, 'reason': "Not recorded",
+                        'reply': None}
+        else:
+            exchange = self._take(request)
+        if self.latency_scale and exchange.get('latency'):
+            executor.get_backend().sleep(exchange['latency'] *
+                                         self.latency_scale)
+        return exchange
+
+    def _take(self, request):
+        method = get_soap_method(request.message)
+        message = _decode(redact(request.message))
+        self._lock.acquire()
+        try:
+            exchanges = self._exchanges.get(method)
+            if not exchanges:
+                raise Exception("No recorded %s exchange left" % method)
+            index = 0
+            if method != "Login":
+                for index, exchange in enumerate(exchanges):
+                    if exchange['request'] == message:
+                        break
+                else:
+                    index = 0
+            return exchanges.pop(index)
+        finally:
+            self._lock.release()
@@ -5,11 +5,21 @@ A connection to the VMware ESX platform.
 
 """
 
+import sys
 import time
 import logging
+import weakref
 
-from eventlet import event
-
+import error_util
+import executor
+import inventory
+import limiter
+import metrics
+import read_write_util
+import session_pool
+import task_watcher
+import topology
+import trace
 import vim
 import vim_util
 import vm_util
@@ -19,14 +29,76 @@ import volumeops
 
 LOG = logging.getLogger()
 
+# Base of the exponential backoff between the retries of a call
 TIME_BETWEEN_API_CALL_RETRIES = 2.0
 API_RETRY_COUNT = 10
 TASK_POLL_INTERVAL = 5.0
+# Operations of an AsyncVMwareESXDriver running at once
+MAX_IN_FLIGHT = 1000
+
+
+def _weak_method(method):
+    """
+    Wraps a bound method without keeping its object alive, so that the
+    helpers of a VMwareAPISession do not make a reference cycle with it,
+    which Python 2 never collects because of its __del__.
+    """
+    obj_ref = weakref.ref(method.im_self)
+    func = method.im_func
+
+    def _call(*args, **kwargs):
+        obj = obj_ref()
+        if obj is None:
+            raise Exception("The session is closed.")
+        return func(obj, *args, **kwargs)
+    return _call
+
+
+def _logout(vim_obj):
+    """Logs-out the session of the VIM Object."""
+    # Logout to avoid un-necessary increase in session count at the
+    # ESX host
+    try:
+        vim_obj.Logout(vim_obj.get_service_content().sessionManager)
+    except Exception, excep:
+        # The session may have been cleared already.
+        LOG.debug(excep)
+
+
+def _is_session_active(vim_obj):
+    """Checks if the session of the VIM Object is still usable."""
+    try:
+        current_session = vim_util.get_dynamic_property(vim_obj,
+                            vim_obj.get_service_content().sessionManager,
+                            "SessionManager", "currentSession")
+        return current_session is not None
+    except Exception, excep:
+        LOG.debug(excep)
+        return False
+
 
 class VMwareESXDriver:
-    """The ESX host connection object."""
+    """
+    The ESX host connection object.
+
+    Instances are dicts with a 'name'. Instances that also have a 'uuid'
+    are created with it as their instance UUID and are looked up by it,
+    which takes one SearchIndex call instead of a scan of all the VMs.
+
+    Instances with an 'image', the path of a local flat disk image, are
+    spawned with the image uploaded as their disk, over HTTP.
 
-    def __init__(self, host, user, password, read_only=False, scheme="https"):
+    With inline_disk, spawn creates the VM and its disk with a single
+    CreateVM_Task, instead of creating the disk and attaching it to the
+    VM after it is created.
+    """
+
+    def __init__(self, host, user, password, read_only=False, scheme="https",
+                 wsdl_loc=None, wsdl_cache_dir=None,
+                 session_pool_size=session_pool.POOL_SIZE,
+                 inventory_cache=False, watch_tasks=True,
+                 topology_ttl=topology.TOPOLOGY_TTL, transport_factory=None,
+                 vim_factory=None, inline_disk=False):
 
         self._host_ip = host
         host_username = user
@@ -35,18 +107,69 @@ class VMwareESXDriver:
 
         self._session = VMwareAPISession(self._host_ip,
                                          host_username, host_password,
-                                         api_retry_count, scheme=scheme)
+                                         api_retry_count, scheme=scheme,
+                                         wsdl_loc=wsdl_loc,
+                                         wsdl_cache_dir=wsdl_cache_dir,
+                                         pool_size=session_pool_size,
+                                         inventory_cache=inventory_cache,
+                                         watch_tasks=watch_tasks,
+                                         topology_ttl=topology_ttl,
+                                         transport_factory=transport_factory,
+                                         vim_factory=vim_factory)
         self._volumeops = volumeops.VMwareVolumeOps(self._session) 
-        self._vmops = vmops.VMwareVMOps(self._session, self._volumeops)
+        self._vmops = vmops.VMwareVMOps(self._session, self._volumeops,
+                                        inline_disk=inline_disk)
 
     def list_instances(self):
         """List VM instances."""
         return self._vmops.list_instances()
 
+    def iter_instances(self):
+        """Yield VM instances, as the pages of the inventory arrive."""
+        return self._vmops.iter_instances()
+
     def spawn(self, instance, disk_size, network_info=None):
         """Create VM instance."""
         self._vmops.spawn(instance, disk_size, network_info)
 
+    def upload_image(self, local_path, datastore_path, progress=None,
+                     skip_existing=False):
+        """
+        Upload a local file to the "[datastore] path" path, in chunks,
+        sending the file again from its start when the upload is
+        interrupted. With skip_existing, a file of the same size already
+        there is kept. Returns the TransferStats, with the throughput.
+        """
+        dc_name = self._session._topology.get_datacenter_ref_and_name()[1]
+        return self._session._upload_file(local_path, datastore_path,
+                                          dc_name, progress, skip_existing)
+
+    def export_disk(self, instance, local_path,
+                    streams=read_write_util.DOWNLOAD_STREAMS, progress=None):
+        """
+        Download the flat file of the disk of VM instance, with parallel
+        ranged GETs. Returns the TransferStats, with the throughput.
+        """
+        return self._vmops.export_disk(instance, local_path, streams,
+                                       progress)
+
+    def spawn_from_template(self, template, instance, linked=True,
+                            network_info=None):
+        """
+        Create VM instance as a clone of the template VM, by default a
+        linked clone of its current snapshot.
+        """
+        self._vmops.spawn_from_template(template, instance, linked,
+                                        network_info)
+
+    def spawn_many(self, instances, concurrency=vmops.SPAWN_CONCURRENCY):
+        """
+        Create VM instances in parallel. instances is a list of
+        (instance, disk_size, network_info). Returns the per instance
+        results and timings, in order.
+        """
+        return self._vmops.spawn_many(instances, concurrency)
+
     def reboot(self, instance):
         """Reboot VM instance."""
         self._vmops.reboot(instance)
@@ -59,115 +182,384 @@ class VMwareESXDriver:
         """Return info about the VM instance."""
         return self._vmops.get_info(instance)
 
+    def get_info_many(self, instances):
+        """
+        Return info about the VM instances, by instance name, collected
+        in one round trip once the VMs are looked up.
+        """
+        return self._vmops.get_info_many(instances)
+
+    def get_info_all(self):
+        """
+        Return info about all the VMs, by VM name, in one retrieval of the
+        whole inventory.
+        """
+        return self._vmops.get_info_all()
+
+    def invalidate_topology(self):
+        """
+        Drop the cached datacenter, VM folder, resource pool, host and
+        cluster references, e.g. after the inventory was reorganized.
+        """
+        self._session._topology.invalidate()
+
+    def close(self):
+        """Log out the sessions with the ESX host."""
+        self._session.close()
+
+
+class AsyncVMwareESXDriver(VMwareESXDriver):
+    """
+    The ESX host connection object, with the operations run in the
+    background by the executor backend. The operations return at once
+    with a handle whose wait() returns the result of the operation or
+    raises its exception. With the eventlet backend, the SOAP calls go
+    through a green transport and the task waits through the task
+    watcher, so up to max_in_flight operations share one process without
+    blocking each other.
+
+    iter_instances stays synchronous: the pages of its iterator are
+    fetched in the caller as it iterates.
+    """
+
+    def __init__(self, host, user, password, max_in_flight=MAX_IN_FLIGHT,
+                 **kwargs):
+        VMwareESXDriver.__init__(self, host, user, password, **kwargs)
+        self._pool = executor.get_backend().pool(max_in_flight)
+
+    def list_instances(self):
+        """List VM instances."""
+        return self._pool.spawn(VMwareESXDriver.list_instances, self)
+
+    def spawn(self, instance, disk_size, network_info=None):
+        """Create VM instance."""
+        return self._pool.spawn(VMwareESXDriver.spawn, self, instance,
+                                disk_size, network_info)
+
+    def spawn_from_template(self, template, instance, linked=True,
+                            network_info=None):
+        """Create VM instance as a clone of the template VM."""
+        return self._pool.spawn(VMwareESXDriver.spawn_from_template, self,
+                                template, instance, linked, network_info)
+
+    def spawn_many(self, instances, concurrency=vmops.SPAWN_CONCURRENCY):
+        """Create VM instances in parallel."""
+        return self._pool.spawn(VMwareESXDriver.spawn_many, self, instances,
+                                concurrency)
+
+    def upload_image(self, local_path, datastore_path, progress=None,
+                     skip_existing=False):
+        """Upload a local file to the "[datastore] path" path."""
+        return self._pool.spawn(VMwareESXDriver.upload_image, self,
+                                local_path, datastore_path, progress,
+                                skip_existing)
+
+    def export_disk(self, instance, local_path,
+                    streams=read_write_util.DOWNLOAD_STREAMS, progress=None):
+        """Download the flat file of the disk of VM instance."""
+        return self._pool.spawn(VMwareESXDriver.export_disk, self, instance,
+                                local_path, streams, progress)
+
+    def reboot(self, instance):
+        """Reboot VM instance."""
+        return self._pool.spawn(VMwareESXDriver.reboot, self, instance)
+
+    def destroy(self, instance, destroy_disks=True):
+        """Destroy VM instance."""
+        return self._pool.spawn(VMwareESXDriver.destroy, self, instance,
+                                destroy_disks)
+
+    def get_info(self, instance):
+        """Return info about the VM instance."""
+        return self._pool.spawn(VMwareESXDriver.get_info, self, instance)
+
+    def get_info_many(self, instances):
+        """Return info about the VM instances, by instance name."""
+        return self._pool.spawn(VMwareESXDriver.get_info_many, self,
+                                instances)
+
+    def get_info_all(self):
+        """Return info about all the VMs, by VM name."""
+        return self._pool.spawn(VMwareESXDriver.get_info_all, self)
+
+    def waitall(self):
+        """Wait for all the operations in flight to end."""
+        self._pool.waitall()
+
+    def close(self):
+        """
+        Wait for the operations in flight, then log out the sessions with
+        the ESX host.
+        """
+        self.waitall()
+        VMwareESXDriver.close(self)
+
 
 class VMwareAPISession(object):
     """
-    Sets up a session with the ESX host and handles all
+    Sets up sessions with the ESX host and handles all
     the calls made to the host.
     """
 
     def __init__(self, host_ip, host_username, host_password,
-                 api_retry_count, scheme="https"):
+                 api_retry_count, scheme="https", wsdl_loc=None,
+                 wsdl_cache_dir=None, pool_size=session_pool.POOL_SIZE,
+                 inventory_cache=False, watch_tasks=True,
+                 topology_ttl=topology.TOPOLOGY_TTL, transport_factory=None,
+                 vim_factory=None):
+        """
+        transport_factory : Returns a new suds transport for a VIM Object,
+                            by default the green one with the eventlet
+                            backend, see vim.get_transport_factory
+        vim_factory       : Returns a new VIM Object, not logged in, in
+                            place of vim.Vim, e.g. a simulator FakeVim
+        """
         self._host_ip = host_ip
         self._host_username = host_username
         self._host_password = host_password
         self.api_retry_count = api_retry_count
         self._scheme = scheme
-        self._session_id = None
+        self._wsdl_loc = wsdl_loc
+        self._wsdl_cache_dir = wsdl_cache_dir
+        self._transport_factory = transport_factory
+        self._vim_factory = vim_factory
         self.vim = None
+        # The helpers get weak references to the session, so that it is
+        # collected, and closed, once the driver drops it
+        login = _weak_method(self._login)
+        self._pool = session_pool.VimSessionPool(login, _logout,
+                                                 _is_session_active,
+                                                 max_size=pool_size)
+        self._limiter = limiter.get_limiter(host_ip)
+        self._topology = topology.TopologyCache(weakref.proxy(self),
+                                                topology_ttl)
+        self._inventory = None
+        if inventory_cache:
+            self._inventory = inventory.InventoryCache(login, _logout)
+        self._task_watcher = None
+        # The watcher needs its updates waited for in the background
+        if watch_tasks and executor.get_backend().name != "inline":
+            self._task_watcher = task_watcher.TaskWatcher(login, _logout,
+                                        _weak_method(self._get_vim_object))
         self._create_session()
 
     def _get_vim_object(self):
         """Create the VIM Object instance."""
-        return vim.Vim(protocol=self._scheme, host=self._host_ip)
+        if self._vim_factory is not None:
+            return self._vim_factory()
+        return vim.Vim(protocol=self._scheme, host=self._host_ip,
+                       wsdl_loc=self._wsdl_loc,
+                       cache_dir=self._wsdl_cache_dir,
+                       transport_factory=self._transport_factory)
+
+    def _login(self):
+        """Creates a VIM Object with a new session with the ESX host."""
+        try:
+            # Login and setup the session with the ESX host for making
+            # API calls
+            vim_obj = self._get_vim_object()
+            vim_obj.Login(vim_obj.get_service_content().sessionManager,
+                          userName=self._host_username,
+                          password=self._host_password)
+            return vim_obj
+        except Exception, excep:
+            LOG.critical("In vmwareapi:_login, "
+                         "got this exception: %s" % excep)
+            raise Exception(excep)
 
     def _create_session(self):
         """Creates a session with the ESX host."""
-        while True:
-            try:
-                # Login and setup the session with the ESX host for making
-                # API calls
-                self.vim = self._get_vim_object()
-                session = self.vim.Login(
-                               self.vim.get_service_content().sessionManager,
-                               userName=self._host_username,
-                               password=self._host_password)
-                # Terminate the earlier session, if possible ( For the sake of
-                # preserving sessions as there is a limit to the number of
-                # sessions we can have )
-                if self._session_id:
-                    try:
-                        self.vim.TerminateSession(
-                                self.vim.get_service_content().sessionManager,
-                                sessionId=[self._session_id])
-                    except Exception, excep:
-                        # This exception is something we can live with. It is
-                        # just an extra caution on our side. The session may
-                        # have been cleared. We could have made a call to
-                        # SessionIsActive, but that is an overhead because we
-                        # anyway would have to call TerminateSession.
-                        LOG.debug(excep)
-                self._session_id = session.key
-                return
-            except Exception, excep:
-                LOG.critical("In vmwareapi:_create_session, "
-                             "got this exception: %s" % excep)
-                raise Exception(excep)
+        # The VIM Object kept here is only used for its client factory
+        # and service content, the calls go through the session pool.
+        self.vim = self._pool.get()
+        self._pool.put(self.vim)
+
+    def close(self):
+        """
+        Logs-out the sessions of the pool, the inventory cache and the
+        task watcher. The session is still usable, sessions are created
+        again as they are needed.
+        """
+        if self._inventory is not None:
+            self._inventory.close()
+        if self._task_watcher is not None:
+            self._task_watcher.close()
+        self._pool.close()
 
     def __del__(self):
-        """Logs-out the session."""
-        # Logout to avoid un-necessary increase in session count at the
-        # ESX host
-        try:
-            self.vim.Logout(self.vim.get_service_content().sessionManager)
-        except Exception, excep:
-            # It is just cautionary on our part to do a logout in del just
-            # to ensure that the session is not left active.
-            LOG.debug(excep)
+        """Logs-out the sessions, if close was not called."""
+        self.close()
 
     def _is_vim_object(self, module):
         """Check if the module is a VIM Object instance."""
         return isinstance(module, vim.Vim)
 
+    def _is_session_fault(self, excep):
+        """
+        Check if the exception leaves the session it was raised on
+        unusable. An overload does not, the session is kept.
+        """
+        return (isinstance(excep, error_util.VimFaultException) and
+                error_util.FAULT_NOT_AUTHENTICATED in excep.fault_list)
+
     def _call_method(self, module, method, *args, **kwargs):
         """
         Calls a method within the module specified with
-        args provided.
+        args provided, over a session checked out from the pool.
+        """
+        if (self._inventory is not None and module is vim_util and
+                method == "get_objects"):
+            # Served from memory when the inventory keeps the objects
+            try:
+                objects = self._inventory.get_objects(*args, **kwargs)
+                if objects is not None:
+                    return objects
+            except Exception, excep:
+                LOG.warn("In vmwareapi:_call_method, inventory update "
+                         "failed, retrieving the objects: %s" % excep)
+        return self._call_on(None, module, method, args, kwargs)[0]
+
+    def _call_on(self, preferred, module, method, args, kwargs):
+        """
+        Makes the call of _call_method, on the preferred VIM Object of
+        the pool if any. Returns the result and the VIM Object used.
         """
-        args = list(args)
         retry_count = 0
-        exc = None
-        last_fault_list = []
         while True:
+            exc = None
+            exc_info = None
+            self._limiter.acquire()
+            start = None
+            vim_obj = None
+            overloaded = False
+            discard = False
             try:
-                if not self._is_vim_object(module):
-                    # If it is not the first try, then get the latest
-                    # vim object
-                    if retry_count > 0:
-                        args = args[1:]
-                    args = [self.vim] + args
+                vim_obj = self._pool.get(preferred)
+                # The latency of the call, not of the wait for a session
+                start = time.time()
+                if self._is_vim_object(module):
+                    temp_module = vim_obj
+                    call_args = args
+                else:
+                    temp_module = module
+                    call_args = (vim_obj,) + args
                 retry_count += 1
-                temp_module = module
 
                 for method_elem in method.split("."):
                     temp_module = getattr(temp_module, method_elem)
 
-                return temp_module(*args, **kwargs)
+                return temp_module(*call_args, **kwargs), vim_obj
             except Exception, excep:
-                # If it is a proper exception, say not having furnished
-                # proper data in the SOAP call or the retry limit having
-                # exceeded, we raise the exception
                 exc = excep
+                # Re-raised with its traceback once the retries are over
+                exc_info = sys.exc_info()
+                overloaded = isinstance(excep,
+                                        error_util.SessionOverLoadException)
+                discard = self._is_session_fault(excep)
+                if (isinstance(excep, error_util.VimFaultException) and
+                        error_util.FAULT_MANAGED_OBJECT_NOT_FOUND in
+                        excep.fault_list):
+                    # A cached topology reference may be the one gone
+                    self._topology.invalidate()
+            finally:
+                if vim_obj is not None:
+                    self._pool.put(vim_obj, discard)
+                latency = None
+                if start is not None:
+                    latency = time.time() - start
+                self._limiter.release(latency, overloaded)
+            # If it is a proper exception, say not having furnished
+            # proper data in the SOAP call or the retry limit having
+            # exceeded, we raise the exception. Overloaded calls are
+            # retried after a backoff, calls on expired sessions on
+            # another session, unless the call needs the session, which
+            # is logged out.
+            if (not (overloaded or discard) or
+                    (discard and preferred is not None) or
+                    retry_count > self.api_retry_count):
                 break
-            # If retry count has been reached then break and
-            # raise the exception
-            if retry_count > self.api_retry_count:
-                break
-            time.sleep(TIME_BETWEEN_API_CALL_RETRIES)
+            # Recorded for the SOAP method that failed, like its calls
+            metrics.REGISTRY.record_retry(getattr(exc, "soap_method",
+                                                  method))
+            executor.get_backend().sleep(limiter.backoff(retry_count,
+                                              TIME_BETWEEN_API_CALL_RETRIES))
 
         LOG.critical("In vmwareapi:_call_method, "
                      "got this exception: %s" % exc)
-        raise
+        raise exc_info[0], exc_info[1], exc_info[2]
+
+    def _iter_objects(self, method, *args, **kwargs):
+        """
+        Yields the objects of a paged retrieval, whose first page the
+        vim_util method gets. Each page is fetched by a call of its own,
+        so that no session stays checked out between the pages, on the
+        session holding the retrieval. Abandoning the iteration cancels
+        the retrieval.
+        """
+        result, vim_obj = self._call_on(None, vim_util, method, args,
+                                        kwargs)
+        token = None
+        try:
+            while result:
+                token = getattr(result, "token", None)
+                for obj_content in result.objects:
+                    yield obj_content
+                if not token:
+                    break
+                result, vim_obj = self._call_on(vim_obj, vim_util,
+                                    "continue_retrieve_properties", (token,),
+                                    {})
+                token = None
+        finally:
+            if token:
+                try:
+                    self._call_on(vim_obj, vim_util,
+                                  "cancel_retrieve_properties", (token,), {})
+                except Exception, excep:
+                    # The server drops the result after a while anyway
+                    LOG.debug(excep)
+
+    def _get_session_cookie(self):
+        """
+        Gets the cookie of a session of the pool, for the HTTP transfers.
+        The session goes back to the pool at once, as the transfers only
+        need its cookie.
+        """
+        vim_obj = self._pool.get()
+        try:
+            return read_write_util.get_session_cookie(vim_obj)
+        finally:
+            self._pool.put(vim_obj)
+
+    def _upload_file(self, local_path, datastore_path, datacenter_name,
+                     progress=None, skip_existing=False):
+        """
+        Uploads a local file to the "[datastore] path" path over HTTP,
+        with the cookie of a session of the pool. Returns the
+        TransferStats.
+        """
+        url = read_write_util.get_datastore_file_url(self._host_ip,
+                                                     datacenter_name,
+                                                     datastore_path,
+                                                     self._scheme)
+        return read_write_util.upload_file(url, self._get_session_cookie(),
+                                           local_path, progress=progress,
+                                           skip_existing=skip_existing)
+
+    def _download_file(self, datastore_path, datacenter_name, local_path,
+                       streams=read_write_util.DOWNLOAD_STREAMS,
+                       progress=None):
+        """
+        Downloads the "[datastore] path" file over HTTP, with the cookie
+        of a session of the pool. Returns the TransferStats.
+        """
+        url = read_write_util.get_datastore_file_url(self._host_ip,
+                                                     datacenter_name,
+                                                     datastore_path,
+                                                     self._scheme)
+        return read_write_util.download_file(url, self._get_session_cookie(),
+                                             local_path, streams=streams,
+                                             progress=progress)
 
     def _get_vim(self):
         """Gets the VIM object reference."""
@@ -177,16 +569,39 @@ class VMwareAPISession(object):
 
     def _wait_for_task(self, instance_uuid, task_ref):
         """
-        Return a Deferred that will give the result of the given task.
-        The task is polled until it completes.
+        Waits for the given task to complete. Returns "success", or
+        raises an Exception with the task error.
+        """
+        self._wait_for_task_result(instance_uuid, task_ref)
+        return "success"
+
+    def _wait_for_task_result(self, instance_uuid, task_ref):
+        """
+        Waits for the given task to complete and returns its result. The
+        task watcher wakes us up as soon as the task completes, the task
+        is polled when the watcher is disabled or fails.
         """
-        done = event.Event()
-        loop = utils.FixedIntervalLoopingCall(self._poll_task, instance_uuid,
-                                              task_ref, done)
-        loop.start(TASK_POLL_INTERVAL)
-        ret_val = done.wait()
-        loop.stop()
-        return ret_val
+        trace.annotate(task=task_ref.value)
+        with trace.span("wait_for_task", task=task_ref.value):
+            if self._task_watcher is not None:
+                try:
+                    return self._task_watcher.wait(task_ref)
+                except error_util.TaskWatcherException, excep:
+                    LOG.warn("In vmwareapi:_wait_for_task_result, polling "
+                             "the task after this exception: %s" % excep)
+            done = executor.get_backend().event()
+
+            def _poll():
+                self._poll_task(instance_uuid, task_ref, done)
+                # Ends the loop right away, which the inline backend runs
+                # to its end before start returns
+                if done.ready():
+                    raise utils.LoopingCallDone()
+            loop = utils.FixedIntervalLoopingCall(trace.bind(_poll))
+            loop.start(TASK_POLL_INTERVAL)
+            ret_val = done.wait()
+            loop.stop()
+            return ret_val
 
     def _poll_task(self, instance_uuid, task_ref, done):
         """
@@ -200,7 +615,7 @@ class VMwareAPISession(object):
             if task_info.state in ['queued', 'running']:
                 return
             elif task_info.state == 'success':
-                done.send("success")
+                done.send(getattr(task_info, "result", None))
             else:
                 error_info = str(task_info.error.localizedMessage)
                 LOG.warn("Task [%(task_name)s] %(task_ref)s "
@@ -6,6 +6,7 @@ Exception classes and SOAP response error checking module.
 
 FAULT_NOT_AUTHENTICATED = "NotAuthenticated"
 FAULT_ALREADY_EXISTS = "AlreadyExists"
+FAULT_MANAGED_OBJECT_NOT_FOUND = "ManagedObjectNotFound"
 
 
 class VimException(Exception):
@@ -30,6 +31,29 @@ class VimAttributeError(VimException):
     pass
 
 
+class TaskWatcherException(VimException):
+    """Task Watcher Exception."""
+    pass
+
+
+class CallBudgetExceeded(Exception):
+    """More SOAP calls were made than budgeted."""
+    pass
+
+
+class HTTPStatusException(Exception):
+    """An HTTP transfer got an error status."""
+
+    def __init__(self, status, message):
+        Exception.__init__(self, message)
+        self.status = status
+
+
+class FileChangedException(Exception):
+    """A remote file changed while it was being transferred."""
+    pass
+
+
 class VimFaultException(Exception):
     """The VIM Fault exception class."""
 
@@ -0,0 +1,279 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+"""
+Concurrency backends. The package waits, sleeps and runs things in
+parallel through the backend set here: eventlet greenthreads, native
+threads or inline calls.
+
+    executor.set_backend("threads")
+
+is to be called before the driver is created. eventlet is only imported
+when the eventlet backend is used.
+"""
+
+import sys
+import threading
+import time
+
+try:
+    from concurrent import futures
+except ImportError:
+    futures = None
+
+# The backend in use, chosen by the first get_backend if not set before
+_BACKEND = None
+
+
+class EventletBackend(object):
+    """
+    Greenthreads of eventlet. The SOAP calls only wait concurrently
+    over vim.GreenHttpsTransport, which the VIM Objects use by default
+    with this backend, or in a monkey patched process.
+    """
+
+    name = "eventlet"
+
+    def __init__(self):
+        from eventlet import corolocal
+        from eventlet import event
+        from eventlet import greenpool
+        from eventlet import greenthread
+        from eventlet import semaphore
+        self._corolocal = corolocal
+        self._event = event
+        self._greenpool = greenpool
+        self._greenthread = greenthread
+        self._semaphore = semaphore
+
+    def spawn(self, func, *args, **kwargs):
+        """Runs func in the background. The handle has a wait()."""
+        return self._greenthread.spawn(func, *args, **kwargs)
+
+    def sleep(self, seconds):
+        self._greenthread.sleep(seconds)
+
+    def event(self):
+        """Gets an event, with send, send_exception and wait."""
+        return self._event.Event()
+
+    def semaphore(self, value=1):
+        return self._semaphore.Semaphore(value)
+
+    def pool(self, size):
+        """Gets a pool of size workers, with spawn, imap and waitall."""
+        return self._greenpool.GreenPool(size)
+
+    def local(self):
+        """Gets a storage whose attributes are per greenthread."""
+        return self._corolocal.local()
+
+
+class Event(object):
+    """An event that native threads can wait for."""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._sent = False
+        self._result = None
+        self._exc_info = None
+
+    def send(self, result=None):
+        self._cond.acquire()
+        try:
+            self._sent = True
+            self._result = result
+            self._cond.notify_all()
+        finally:
+            self._cond.release()
+
+    def send_exception(self, *args):
+        """Sends an exception, or the (type, value, traceback) triple."""
+        if len(args) == 1:
+            args = (type(args[0]), args[0], None)
+        self._cond.acquire()
+        try:
+            self._sent = True
+            self._exc_info = args
+            self._cond.notify_all()
+        finally:
+            self._cond.release()
+
+    def ready(self):
+        return self._sent
+
+    def wait(self):
+        """Waits for the event to be sent, and returns or raises it."""
+        self._cond.acquire()
+        try:
+            while not self._sent:
+                # A timeout keeps the wait interruptible
+                self._cond.wait(60)
+        finally:
+            self._cond.release()
+        if self._exc_info is not None:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return self._result
+
+
+def _run_into(done, func, args, kwargs):
+    """Calls func and sends its result or exception to done."""
+    try:
+        done.send(func(*args, **kwargs))
+    except Exception:
+        done.send_exception(*sys.exc_info())
+
+
+class ThreadPool(object):
+    """A pool of native threads, over a ThreadPoolExecutor."""
+
+    def __init__(self, size):
+        self._executor = futures.ThreadPoolExecutor(max_workers=size)
+        self._futures = []
+
+    def spawn(self, func, *args, **kwargs):
+        done = Event()
+        self._futures.append(self._executor.submit(_run_into, done, func,
+                                                   args, kwargs))
+        return done
+
+    def imap(self, func, *iterables):
+        return self._executor.map(func, *iterables)
+
+    def waitall(self):
+        futures.wait(self._futures)
+        self._futures = []
+
+
+class ThreadBackend(object):
+    """
+    Native threads. The blocking SOAP calls run in parallel and the
+    process needs no monkey patching.
+    """
+
+    name = "threads"
+
+    def __init__(self):
+        if not futures:
+            raise Exception("Unable to import concurrent.futures.")
+
+    def spawn(self, func, *args, **kwargs):
+        done = Event()
+        thread = threading.Thread(target=_run_into,
+                                  args=(done, func, args, kwargs))
+        thread.daemon = True
+        thread.start()
+        return done
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+    def event(self):
+        return Event()
+
+    def semaphore(self, value=1):
+        return threading.Semaphore(value)
+
+    def pool(self, size):
+        return ThreadPool(size)
+
+    def local(self):
+        return threading.local()
+
+
+class InlineSemaphore(object):
+    """
+    A semaphore of the inline backend, where nobody could release it
+    while we wait for it.
+    """
+
+    def __init__(self, value=1):
+        self._value = value
+
+    def acquire(self):
+        if self._value <= 0:
+            raise Exception("Semaphore would block forever")
+        self._value -= 1
+        return True
+
+    def release(self):
+        self._value += 1
+
+
+class InlinePool(object):
+    """A pool running the calls right away, one after the other."""
+
+    def __init__(self, size):
+        pass
+
+    def spawn(self, func, *args, **kwargs):
+        done = Event()
+        _run_into(done, func, args, kwargs)
+        return done
+
+    def imap(self, func, *iterables):
+        return map(func, *iterables)
+
+    def waitall(self):
+        pass
+
+
+class InlineBackend(object):
+    """
+    Everything runs in the calling thread: spawned calls run to their
+    end before spawn returns. For scripts and debugging.
+    """
+
+    name = "inline"
+
+    def spawn(self, func, *args, **kwargs):
+        done = Event()
+        _run_into(done, func, args, kwargs)
+        return done
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+    def event(self):
+        return Event()
+
+    def semaphore(self, value=1):
+        return InlineSemaphore(value)
+
+    def pool(self, size):
+        return InlinePool(size)
+
+    def local(self):
+        return threading.local()
+
+
+BACKENDS = {
+    "eventlet": EventletBackend,
+    "threads": ThreadBackend,
+    "inline": InlineBackend,
+}
+
+
+def set_backend(backend):
+    """Sets the backend, by name or as a backend object."""
+    global _BACKEND
+    if isinstance(backend, basestring):
+        if backend not in BACKENDS:
+            raise Exception("Unknown executor backend %s" % backend)
+        backend = BACKENDS[backend]()
+    _BACKEND = backend
+
+
+def get_backend():
+    """
+    Gets the backend in use. Defaults to eventlet when it is installed,
+    else to native threads, else to inline calls.
+    """
+    if _BACKEND is None:
+        try:
+            set_backend("eventlet")
+        except ImportError:
+            if futures:
+                set_backend("threads")
+            else:
+                set_backend("inline")
+    return _BACKEND
@@ -0,0 +1,195 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+"""
+In-memory inventory of the ESX host, loaded once and then kept current
+with the updates of a property collector filter.
+"""
+
+import logging
+import time
+
+import executor
+import vim_util
+
+LOG = logging.getLogger()
+
+# Properties kept in the inventory, per managed object type. These cover
+# the get_objects calls made by vmops, vm_util and network_util.
+INVENTORY_PROPERTIES = {
+    "Datacenter": ["name", "vmFolder"],
+    "Datastore": ["summary.type", "summary.name", "summary.capacity",
+                  "summary.freeSpace"],
+    "HostSystem": ["name"],
+    "ClusterComputeResource": ["name"],
+    "ResourcePool": ["name"],
+    "VirtualMachine": ["name", "runtime.connectionState"],
+}
+
+# Number of object updates fetched per WaitForUpdatesEx call
+MAX_OBJECT_UPDATES = 1000
+
+
+class DynamicProperty(object):
+    """A property of an inventory object, as in the SOAP responses."""
+
+    def __init__(self, name, val):
+        self.name = name
+        self.val = val
+
+
+class ObjectContent(object):
+    """An inventory object, as in the RetrieveProperties responses."""
+
+    def __init__(self, obj, prop_set):
+        self.obj = obj
+        self.propSet = prop_set
+
+
+class InventoryCache(object):
+    """
+    Keeps the properties of the inventory objects in memory. The objects
+    are loaded by the first read, later reads only fetch the changes made
+    since the previous one, using the WaitForUpdatesEx version token.
+    """
+
+    def __init__(self, login_func, logout_func, properties=None,
+                 max_staleness=0.0):
+        """
+        login_func    : Returns a new logged in VIM Object. Property
+                        collector filters belong to a session, so the
+                        inventory uses a session of its own.
+        logout_func   : Logs out the VIM Object passed
+        properties    : Properties to keep, per managed object type
+        max_staleness : Seconds during which the inventory is read
+                        without checking for updates. With 0, reads
+                        always see the changes made by previous calls.
+        """
+        self._login_func = login_func
+        self._logout_func = logout_func
+        self._properties = properties or INVENTORY_PROPERTIES
+        self._max_staleness = max_staleness
+        self._vim = None
+        self._collector = None
+        self._version = ""
+        self._last_update = None
+        # type -> {MoRef value -> (load order, MoRef, {path: value})}
+        self._objects = {}
+        self._seq = 0
+        self._lock = executor.get_backend().semaphore()
+
+    def get_objects(self, type, properties_to_collect=None, all=False):
+        """
+        Gets the objects of the type specified, in the format returned by
+        vim_util.get_objects. Returns None if the inventory does not keep
+        the properties asked for.
+        """
+        if not properties_to_collect:
+            properties_to_collect = ["name"]
+        kept = self._properties.get(type)
+        if all or kept is None:
+            return None
+        for prop_name in properties_to_collect:
+            if prop_name not in kept:
+                return None
+
+        self._lock.acquire()
+        try:
+            if (self._last_update is None or
+                    time.time() - self._last_update >= self._max_staleness):
+                self._update()
+            objects = sorted(self._objects.get(type, {}).values())
+        finally:
+            self._lock.release()
+
+        result = []
+        for seq, obj, props in objects:
+            prop_set = [DynamicProperty(prop_name, props[prop_name])
+                        for prop_name in properties_to_collect
+                        if prop_name in props]
+            result.append(ObjectContent(obj, prop_set))
+        return result
+
+    def close(self):
+        """Drops the inventory and logs out its session."""
+        self._lock.acquire()
+        try:
+            self._reset()
+        finally:
+            self._lock.release()
+
+    def _update(self):
+        """Applies the changes made since the last update."""
+        try:
+            if self._collector is None:
+                self._create_filter()
+            client_factory = self._vim.client.factory
+            wait_options = client_factory.create('ns0:WaitOptions')
+            wait_options.maxWaitSeconds = 0
+            wait_options.maxObjectUpdates = MAX_OBJECT_UPDATES
+            while True:
+                update_set = self._vim.WaitForUpdatesEx(self._collector,
+                                                        version=self._version,
+                                                        options=wait_options)
+                if not update_set:
+                    break
+                self._apply(update_set)
+                self._version = update_set.version
+                if not getattr(update_set, "truncated", False):
+                    break
+            self._last_update = time.time()
+        except Exception:
+            # Start over with a new session and a full load next time
+            self._reset()
+            raise
+
+    def _create_filter(self):
+        """Creates the property collector and filter of the inventory."""
+        self._vim = self._login_func()
+        client_factory = self._vim.client.factory
+        service_content = self._vim.get_service_content()
+        self._collector = self._vim.CreatePropertyCollector(
+                                    service_content.propertyCollector)
+        spec_cache = vim_util.get_spec_cache(client_factory)
+        object_spec = vim_util.build_object_spec(client_factory,
+                        service_content.rootFolder,
+                        [spec_cache.get_recursive_traversal_spec()])
+        property_specs = []
+        for type, properties in self._properties.items():
+            property_specs.append(spec_cache.get_property_spec(type,
+                                                               properties))
+        property_filter_spec = vim_util.build_property_filter_spec(
+                                    client_factory, property_specs,
+                                    [object_spec])
+        self._vim.CreateFilter(self._collector, spec=property_filter_spec,
+                               partialUpdates=False)
+
+    def _apply(self, update_set):
+        """Applies the object updates of an UpdateSet."""
+        for filter_update in getattr(update_set, "filterSet", []):
+            for object_update in getattr(filter_update, "objectSet", []):
+                obj = object_update.obj
+                objects = self._objects.setdefault(obj._type, {})
+                if object_update.kind == "leave":
+                    # By type and value, the values of the objects of
+                    # different types may be the same
+                    objects.pop(obj.value, None)
+                    continue
+                if object_update.kind == "enter" or obj.value not in objects:
+                    self._seq += 1
+                    objects[obj.value] = (self._seq, obj, {})
+                props = objects[obj.value][2]
+                for change in getattr(object_update, "changeSet", []):
+                    if change.op in ["remove", "indirectRemove"]:
+                        props.pop(change.name, None)
+                    else:
+                        props[change.name] = getattr(change, "val", None)
+
+    def _reset(self):
+        """Drops the inventory and its session."""
+        if self._vim is not None:
+            self._logout_func(self._vim)
+        self._vim = None
+        self._collector = None
+        self._version = ""
+        self._last_update = None
+        self._objects = {}
@@ -0,0 +1,116 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+"""
+Adaptive limit of the concurrent SOAP calls made to an ESX host, and
+the backoff of the calls retried after an overload.
+"""
+
+import collections
+import random
+import threading
+import time
+
+import executor
+
+INITIAL_LIMIT = 4
+MIN_LIMIT = 1
+MAX_LIMIT = 32
+# Calls slower than this, in seconds, are taken as an overload signal
+LATENCY_THRESHOLD = 10.0
+DECREASE_FACTOR = 0.5
+# The limit is decreased at most once per interval, in seconds, so that
+# the calls failing together do not collapse it to MIN_LIMIT
+DECREASE_INTERVAL = 1.0
+
+BACKOFF_MAX = 30.0
+
+# (host, backend name) -> AdaptiveLimiter shared by all the sessions with
+# the host. Its primitives belong to the executor backend in use when it
+# was created, so the sessions created under another backend get their own.
+_LIMITERS = {}
+# Held briefly, without waiting for anything, so whatever the backend
+_LIMITERS_LOCK = threading.Lock()
+
+
+def get_limiter(host):
+    """
+    Gets the limiter of the host for the executor backend in use, the
+    same one for the sessions created at the same time.
+    """
+    key = (host, executor.get_backend().name)
+    _LIMITERS_LOCK.acquire()
+    try:
+        if key not in _LIMITERS:
+            _LIMITERS[key] = AdaptiveLimiter()
+        return _LIMITERS[key]
+    finally:
+        _LIMITERS_LOCK.release()
+
+
+def backoff(retry_count, base, cap=BACKOFF_MAX):
+    """
+    Gets the delay before the retry of a call, exponential with the
+    number of retries and fully jittered so that the callers do not
+    retry in lockstep.
+    """
+    return random.uniform(0, min(cap, base * 2 ** retry_count))
+
+
+class AdaptiveLimiter(object):
+    """
+    Limits the number of calls in flight with AIMD: the limit grows by
+    one per limit's worth of successful calls, and is halved when a call
+    fails with an overload or is slower than LATENCY_THRESHOLD.
+    """
+
+    def __init__(self, initial_limit=INITIAL_LIMIT, min_limit=MIN_LIMIT,
+                 max_limit=MAX_LIMIT, latency_threshold=LATENCY_THRESHOLD):
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_threshold = latency_threshold
+        self.in_flight = 0
+        self._last_decrease = 0
+        self._waiters = collections.deque()
+        self._backend = executor.get_backend()
+        self._lock = self._backend.semaphore()
+
+    def acquire(self):
+        """Waits until a call can be made."""
+        self._lock.acquire()
+        try:
+            if not self._waiters and self.in_flight < int(self.limit):
+                self.in_flight += 1
+                return
+            done = self._backend.event()
+            self._waiters.append(done)
+        finally:
+            self._lock.release()
+        # The slot is taken for us by release
+        done.wait()
+
+    def release(self, latency, overloaded=False):
+        """
+        Ends a call, adjusting the limit with its latency in seconds and
+        whether it failed because of an overload. A latency of None, for
+        a call that was not made, leaves the limit as it is.
+        """
+        self._lock.acquire()
+        try:
+            self.in_flight -= 1
+            if latency is None:
+                pass
+            elif overloaded or latency > self.latency_threshold:
+                now = time.time()
+                if now - self._last_decrease > DECREASE_INTERVAL:
+                    self._last_decrease = now
+                    self.limit = max(self.min_limit,
+                                     self.limit * DECREASE_FACTOR)
+            else:
+                self.limit = min(self.max_limit,
+                                 self.limit + 1.0 / self.limit)
+            while self._waiters and self.in_flight < int(self.limit):
+                self.in_flight += 1
+                self._waiters.popleft().send(True)
+        finally:
+            self._lock.release()
@@ -0,0 +1,128 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+"""
+In-process metrics of the SOAP calls: per method call counts, latency
+histograms, request and response sizes, retries and faults.
+
+    snapshot = metrics.REGISTRY.snapshot()
+    metrics.REGISTRY.reset()
+"""
+
+import threading
+
+# Upper bounds, in seconds, of the latency histogram buckets. The last
+# bucket counts the calls slower than the last bound.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5,
+                   5.0, 10.0, 30.0)
+
+
+class MethodMetrics(object):
+    """The metrics of one SOAP method."""
+
+    __slots__ = ("calls", "latency_sum", "latency_max", "buckets",
+                 "request_bytes", "response_bytes", "retries", "faults")
+
+    def __init__(self):
+        self.calls = 0
+        self.latency_sum = 0.0
+        self.latency_max = 0.0
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.request_bytes = 0
+        self.response_bytes = 0
+        self.retries = 0
+        # fault type -> count
+        self.faults = {}
+
+    def to_dict(self):
+        buckets = []
+        for bound, count in zip(LATENCY_BUCKETS + (None,), self.buckets):
+            buckets.append((bound, count))
+        return {'calls': self.calls,
+                'latency_sum': self.latency_sum,
+                'latency_max': self.latency_max,
+                'latency_buckets': buckets,
+                'request_bytes': self.request_bytes,
+                'response_bytes': self.response_bytes,
+                'retries': self.retries,
+                'faults': dict(self.faults)}
+
+
+class MetricsRegistry(object):
+    """
+    Keeps the metrics of the SOAP methods called by this process. Every
+    record is a few dict and list updates under a lock, cheap enough to
+    stay enabled; setting enabled to False skips them altogether.
+    """
+
+    def __init__(self):
+        self.enabled = True
+        self._lock = threading.Lock()
+        # method name -> MethodMetrics
+        self._methods = {}
+
+    def _get(self, method):
+        method_metrics = self._methods.get(method)
+        if method_metrics is None:
+            method_metrics = MethodMetrics()
+            self._methods[method] = method_metrics
+        return method_metrics
+
+    def record_call(self, method, latency, request_bytes=0,
+                    response_bytes=0, faults=None):
+        """
+        Records a SOAP call of the method: its latency in seconds, the
+        sizes of its messages and the types of the faults it raised.
+        """
+        if not self.enabled:
+            return
+        bucket = 0
+        for bound in LATENCY_BUCKETS:
+            if latency <= bound:
+                break
+            bucket += 1
+        self._lock.acquire()
+        try:
+            method_metrics = self._get(method)
+            method_metrics.calls += 1
+            method_metrics.latency_sum += latency
+            if latency > method_metrics.latency_max:
+                method_metrics.latency_max = latency
+            method_metrics.buckets[bucket] += 1
+            method_metrics.request_bytes += request_bytes
+            method_metrics.response_bytes += response_bytes
+            for fault in faults or []:
+                method_metrics.faults[fault] = (
+                                    method_metrics.faults.get(fault, 0) + 1)
+        finally:
+            self._lock.release()
+
+    def record_retry(self, method):
+        """Records a retry of a call of the method."""
+        if not self.enabled:
+            return
+        self._lock.acquire()
+        try:
+            self._get(method).retries += 1
+        finally:
+            self._lock.release()
+
+    def snapshot(self):
+        """Gets the metrics recorded so far, as dicts by method name."""
+        self._lock.acquire()
+        try:
+            return dict((method, method_metrics.to_dict())
+                        for method, method_metrics in self._methods.items())
+        finally:
+            self._lock.release()
+
+    def reset(self):
+        """Drops the metrics recorded so far."""
+        self._lock.acquire()
+        try:
+            self._methods = {}
+        finally:
+            self._lock.release()
+
+
+# The registry of the process
+REGISTRY = MetricsRegistry()
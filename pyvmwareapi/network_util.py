@@ -11,60 +11,107 @@ import vm_util
 
 LOG = logging.getLogger()
 
+# Host properties of a HostNetworkSnapshot
+HOST_NETWORK_PROPERTIES = ["config.network.pnic",
+                           "config.network.vswitch",
+                           "config.network.portgroup",
+                           "configManager.networkSystem"]
+
 
 def get_network_with_the_name(session, network_name="vmnet0", cluster=None):
     """
     Gets reference to the network whose name is passed as the
     argument.
     """
-    host = vm_util.get_host_ref(session, cluster)
+    return get_networks_with_the_names(session, [network_name],
+                                       cluster).get(network_name)
+
+
+def get_networks_with_the_names(session, network_names, cluster=None):
+    """
+    Gets references to the networks whose names are passed as the
+    argument, by name. The networks of the cluster, else of the host,
+    with their names and the config of the distributed port groups, are
+    fetched with one RetrieveProperties call, traversing to them from
+    the cluster or the root folder, and the uuids of their distributed
+    switches with one more.
+    """
+    vim = session._get_vim()
+    client_factory = vim.client.factory
+    spec_cache = vim_util.get_spec_cache(client_factory)
+    property_specs = [spec_cache.get_property_spec("Network", ["name"]),
+                      spec_cache.get_property_spec(
+                                "DistributedVirtualPortgroup",
+                                ["config.key",
+                                 "config.distributedVirtualSwitch"])]
     if cluster is not None:
-        vm_networks_ret = session._call_method(vim_util,
-                                               "get_dynamic_property", cluster,
-                                               "ClusterComputeResource",
-                                               "network")
+        cluster_to_network = vim_util.build_traversal_spec(client_factory,
+                                "cluster_to_network", "ComputeResource",
+                                "network", False, [])
+        obj_spec = vim_util.get_obj_spec(client_factory, cluster,
+                                         [cluster_to_network])
     else:
-        vm_networks_ret = session._call_method(vim_util,
-                                               "get_dynamic_property", host,
-                                               "HostSystem", "network")
-
-    # Meaning there are no networks on the host. suds responds with a ""
-    # in the parent property field rather than a [] in the
-    # ManagedObjectReference property field of the parent
-    if not vm_networks_ret:
-        return None
-    vm_networks = vm_networks_ret.ManagedObjectReference
-    networks = session._call_method(vim_util,
-                       "get_properties_for_a_collection_of_objects",
-                       "Network", vm_networks, ["summary.name"])
-    network_obj = {}
-    for network in vm_networks:
-        # Get network properties
-        if network._type == 'DistributedVirtualPortgroup':
-            props = session._call_method(vim_util,
-                        "get_dynamic_property", network,
-                        "DistributedVirtualPortgroup", "config")
+        # The networks of all the hosts, with the network list of each
+        # host to keep those of the first one only, as get_host_ref does
+        obj_spec = vim_util.get_obj_spec(client_factory,
+                        vim.get_service_content().rootFolder,
+                        [spec_cache.get_host_network_traversal_spec()])
+        property_specs.append(spec_cache.get_property_spec("HostSystem",
+                                                           ["network"]))
+    prop_filter_spec = vim_util.get_prop_filter_spec(client_factory,
+                                                     [obj_spec],
+                                                     property_specs)
+    objects = session._call_method(vim_util,
+                                   "get_properties_for_filter_spec",
+                                   prop_filter_spec)
+    host_networks = None
+    networks = []
+    for elem in objects:
+        if elem.obj._type != "HostSystem":
+            networks.append(elem)
+        elif host_networks is None:
+            host_networks = set()
+            for prop in elem.propSet:
+                # suds responds with a "" when the host has no networks
+                for network in (prop.val and
+                                prop.val.ManagedObjectReference or []):
+                    host_networks.add(network.value)
+    if cluster is None:
+        networks = [network for network in networks
+                    if network.obj.value in (host_networks or set())]
+
+    network_objs = {}
+    dvs_of_dvpg = {}
+    for network in networks:
+        props = {}
+        for prop in network.propSet:
+            props[prop.name] = prop.val
+        network_name = props.get("name")
+        if network_name not in network_names or network_name in network_objs:
+            continue
+        if network.obj._type == 'DistributedVirtualPortgroup':
             # NOTE(asomya): This only works on ESXi if the port binding is
             # set to ephemeral
-            if props.name == network_name:
-                network_obj['type'] = 'DistributedVirtualPortgroup'
-                network_obj['dvpg'] = props.key
-                dvs_props = session._call_method(vim_util,
-                                "get_dynamic_property",
-                                props.distributedVirtualSwitch,
-                                "VmwareDistributedVirtualSwitch", "uuid")
-                network_obj['dvsw'] = dvs_props
+            network_objs[network_name] = {
+                        'type': 'DistributedVirtualPortgroup',
+                        'dvpg': props["config.key"]}
+            dvs_of_dvpg[network_name] = props[
+                                        "config.distributedVirtualSwitch"]
         else:
-            props = session._call_method(vim_util,
-                        "get_dynamic_property", network,
-                        "Network", "summary.name")
-            if props == network_name:
-                network_obj['type'] = 'Network'
-                network_obj['name'] = network_name
-    if (len(network_obj) > 0):
-        return network_obj
-    else:
-        return None
+            network_objs[network_name] = {'type': 'Network',
+                                          'name': network_name}
+
+    if dvs_of_dvpg:
+        dvs_objs = session._call_method(vim_util,
+                        "get_properties_for_a_collection_of_objects",
+                        "DistributedVirtualSwitch", dvs_of_dvpg.values(),
+                        ["uuid"])
+        dvs_uuids = {}
+        for dvs in dvs_objs:
+            dvs_uuids[dvs.obj.value] = dvs.propSet[0].val
+        for network_name, dvs in dvs_of_dvpg.items():
+            network_objs[network_name]['dvsw'] = dvs_uuids.get(dvs.value)
+    return network_objs
 
 
 def get_vswitch_for_vlan_interface(session, vlan_interface, cluster=None):
@@ -128,7 +175,8 @@ def get_vlanid_and_vswitch_for_portgroup(session, pg_name, cluster=None):
 
 
 def create_port_group(session, pg_name, vswitch_name, vlan_id=0,
-                      cluster=None, promiscuous_mode=None):
+                      cluster=None, promiscuous_mode=None,
+                      network_system_mor=None):
     """
     Creates a port group on the host system with the vlan tags
     supplied. VLAN id 0 means no vlan id association.
@@ -140,10 +188,11 @@ def create_port_group(session, pg_name, vswitch_name, vlan_id=0,
                     pg_name,
                     vlan_id,
                     promiscuous_mode)
-    host_mor = vm_util.get_host_ref(session, cluster)
-    network_system_mor = session._call_method(vim_util,
-        "get_dynamic_property", host_mor,
-        "HostSystem", "configManager.networkSystem")
+    if network_system_mor is None:
+        host_mor = vm_util.get_host_ref(session, cluster)
+        network_system_mor = session._call_method(vim_util,
+            "get_dynamic_property", host_mor,
+            "HostSystem", "configManager.networkSystem")
     try:
         session._call_method(session._get_vim(),
                 "AddPortGroup", network_system_mor,
@@ -156,3 +205,86 @@ def create_port_group(session, pg_name, vswitch_name, vlan_id=0,
         # by the other call, we can ignore the exception.
         if error_util.FAULT_ALREADY_EXISTS not in exc.fault_list:
             raise Exception(exc)
+
+
+class HostNetworkSnapshot(object):
+    """
+    The network configuration of a host: physical NICs, vSwitches, port
+    groups and networks. They are all fetched with one RetrieveProperties
+    call, and indexed for the lookups made when plugging VIFs.
+    """
+
+    def __init__(self, session, cluster=None):
+        self._session = session
+        self._cluster = cluster
+        self.refresh()
+
+    def refresh(self):
+        """Fetches the network configuration of the host again."""
+        host_mor = vm_util.get_host_ref(self._session, self._cluster)
+        client_factory = self._session._get_vim().client.factory
+        spec_cache = vim_util.get_spec_cache(client_factory)
+        # Select the networks of the host along with the host
+        host_to_network = vim_util.build_traversal_spec(client_factory,
+                                "host_to_network", "HostSystem", "network",
+                                False, [])
+        prop_filter_spec = vim_util.get_prop_filter_spec(client_factory,
+                    [vim_util.get_obj_spec(client_factory, host_mor,
+                                           [host_to_network])],
+                    [spec_cache.get_property_spec("HostSystem",
+                                                  HOST_NETWORK_PROPERTIES),
+                     spec_cache.get_property_spec("Network", ["name"])])
+        objects = self._session._call_method(vim_util,
+                            "get_properties_for_filter_spec",
+                            prop_filter_spec)
+
+        host_props = {}
+        self._networks = {}
+        for elem in objects:
+            if elem.obj._type == "HostSystem":
+                for prop in elem.propSet:
+                    host_props[prop.name] = prop.val
+            else:
+                for prop in elem.propSet:
+                    self._networks[prop.val] = elem.obj
+
+        self.network_system = host_props.get("configManager.networkSystem")
+        # suds responds with a "" rather than an empty array
+        self._pnics = {}
+        pnics_ret = host_props.get("config.network.pnic")
+        for pnic in pnics_ret and pnics_ret.PhysicalNic or []:
+            self._pnics[pnic.device] = pnic
+        self._vswitch_by_pnic = {}
+        vswitches_ret = host_props.get("config.network.vswitch")
+        for vswitch in vswitches_ret and vswitches_ret.HostVirtualSwitch or []:
+            # A vSwitch may not be associated with a physical NIC
+            for pnic_key in getattr(vswitch, "pnic", []):
+                self._vswitch_by_pnic[str(pnic_key).split('-')[-1]] = (
+                                                            vswitch.name)
+        self._portgroups = {}
+        self._portgroups_by_vlan = {}
+        port_grps_ret = host_props.get("config.network.portgroup")
+        for p_gp in port_grps_ret and port_grps_ret.HostPortGroup or []:
+            self._portgroups[p_gp.spec.name] = p_gp
+            self._portgroups_by_vlan.setdefault(int(p_gp.spec.vlanId),
+                                                []).append(p_gp)
+
+    def has_pnic(self, device):
+        """Checks if the physical NIC exists on the host."""
+        return device in self._pnics
+
+    def get_vswitch_for_pnic(self, device):
+        """Gets the name of the vSwitch of the physical NIC."""
+        return self._vswitch_by_pnic.get(device)
+
+    def get_portgroup(self, pg_name):
+        """Gets the port group with the name supplied."""
+        return self._portgroups.get(pg_name)
+
+    def get_portgroups_for_vlan(self, vlan_id):
+        """Gets the port groups tagged with the vlan id."""
+        return self._portgroups_by_vlan.get(int(vlan_id), [])
+
+    def get_network(self, network_name):
+        """Gets reference to the network with the name supplied."""
+        return self._networks.get(network_name)
@@ -0,0 +1,429 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+"""
+Transfers of datastore files over the HTTP file access of the host,
+https://<host>/folder/<path>?dcPath=<datacenter>&dsName=<datastore>,
+authenticated with the cookie of a VIM session.
+"""
+
+import httplib
+import logging
+import os
+import re
+import socket
+import sys
+import time
+import urllib
+
+import error_util
+import executor
+import metrics
+import vm_util
+
+LOG = logging.getLogger()
+
+# Bytes read from the local file and sent at a time
+CHUNK_SIZE = 1024 * 1024
+UPLOAD_RETRIES = 5
+# Base of the exponential backoff between the attempts of a transfer
+TIME_BETWEEN_RETRIES = 2.0
+USER_AGENT = "pyvmwareapi"
+# Ranged GETs of a download running at once
+DOWNLOAD_STREAMS = 4
+# Bytes fetched by a ranged GET of a download
+RANGE_SIZE = 64 * 1024 * 1024
+DOWNLOAD_RETRIES = 5
+# Seconds a connection waits on the network before the transfer fails,
+# so that a stalled transfer is retried instead of blocking forever
+SOCKET_TIMEOUT = 300
+
+CONTENT_RANGE_RE = re.compile(r"bytes (\d+)-(\d+)/(\d+|\*)")
+
+
+class TransferStats(object):
+    """
+    The progress of a transfer, updated as its chunks go. bytes_sent
+    counts the bytes sent by an upload or received by a download, once:
+    the bytes of an attempt that failed are not counted.
+    """
+
+    def __init__(self, total_bytes):
+        self.total_bytes = total_bytes
+        self.bytes_sent = 0
+        self.attempts = 0
+        self.skipped = False
+        self.start = time.time()
+        self.end = None
+
+    def elapsed(self):
+        return (self.end or time.time()) - self.start
+
+    def throughput(self):
+        """Gets the bytes transferred per second."""
+        elapsed = self.elapsed()
+        if not elapsed:
+            return 0.0
+        return self.bytes_sent / elapsed
+
+    def to_dict(self):
+        return {'total_bytes': self.total_bytes,
+                'bytes_sent': self.bytes_sent,
+                'attempts': self.attempts,
+                'skipped': self.skipped,
+                'elapsed': self.elapsed(),
+                'throughput': self.throughput()}
+
+
+def get_datastore_file_url(host, datacenter_name, datastore_path,
+                           scheme="https"):
+    """Builds the URL of the file at a "[datastore] path" path."""
+    datastore_name, file_path = vm_util.split_datastore_path(datastore_path)
+    query = urllib.urlencode([("dcPath", datacenter_name),
+                              ("dsName", datastore_name)])
+    return "%s://%s/folder/%s?%s" % (scheme, host,
+                                     urllib.quote(file_path.lstrip("/")),
+                                     query)
+
+
+def get_session_cookie(vim_obj):
+    """Gets the Cookie header value of the session of a VIM Object."""
+    cookiejar = vim_obj.client.options.transport.cookiejar
+    return "; ".join(["%s=%s" % (cookie.name, cookie.value)
+                      for cookie in cookiejar])
+
+
+def _get_httplib():
+    """
+    Gets the httplib to connect with: the green one of eventlet with the
+    eventlet backend, so that transfers do not block the greenthreads.
+    """
+    if executor.get_backend().name == "eventlet":
+        from eventlet.green import httplib as green_httplib
+        return green_httplib
+    return httplib
+
+
+def _connect(url):
+    """Connects to the host of the URL. Returns the connection and path."""
+    scheme, rest = urllib.splittype(url)
+    netloc, path = urllib.splithost(rest)
+    httplib_module = _get_httplib()
+    if scheme == "https":
+        return httplib_module.HTTPSConnection(netloc,
+                                              timeout=SOCKET_TIMEOUT), path
+    return httplib_module.HTTPConnection(netloc,
+                                         timeout=SOCKET_TIMEOUT), path
+
+
+def _is_retriable(excep):
+    """
+    Whether a transfer that failed with the exception is worth another
+    attempt: the network errors and timeouts, and the server errors. The
+    client errors, e.g. 401 or 404, and the local file errors are not.
+    """
+    if isinstance(excep, error_util.HTTPStatusException):
+        return excep.status >= 500
+    return isinstance(excep, (socket.error, httplib.HTTPException,
+                              _get_httplib().HTTPException))
+
+
+def get_file_info(url, cookie):
+    """
+    Gets the size and the validators of the file at the URL, as a dict
+    with the size, etag and last_modified keys, or None if there is none.
+    """
+    conn, path = _connect(url)
+    try:
+        conn.request("HEAD", path, headers={"Cookie": cookie,
+                                            "User-Agent": USER_AGENT})
+        response = conn.getresponse()
+        response.read()
+        if response.status != httplib.OK:
+            return None
+        length = response.getheader("Content-Length")
+        if length is None:
+            return None
+        return {'size': int(length),
+                'etag': response.getheader("ETag"),
+                'last_modified': response.getheader("Last-Modified")}
+    finally:
+        conn.close()
+
+
+def get_file_size(url, cookie):
+    """Gets the size of the file at the URL, or None if there is none."""
+    info = get_file_info(url, cookie)
+    if info is None:
+        return None
+    return info['size']
+
+
+def _get_validator_headers(info):
+    """
+    Gets the headers that make a ranged GET fail if the file is no longer
+    the one of info: If-Range with the ETag, or else the Last-Modified
+    date, and If-Match with the ETag.
+    """
+    headers = {}
+    if info['etag'] is not None:
+        headers["If-Range"] = info['etag']
+        headers["If-Match"] = info['etag']
+    elif info['last_modified'] is not None:
+        headers["If-Range"] = info['last_modified']
+    return headers
+
+
+def _put_file(url, cookie, local_file, stats, chunk_size, progress):
+    """PUTs the local file to the URL, one chunk in memory at a time."""
+    conn, path = _connect(url)
+    try:
+        conn.putrequest("PUT", path)
+        conn.putheader("User-Agent", USER_AGENT)
+        conn.putheader("Content-Type", "application/octet-stream")
+        conn.putheader("Content-Length", str(stats.total_bytes))
+        conn.putheader("Cookie", cookie)
+        conn.endheaders()
+        local_file.seek(0)
+        while True:
+            chunk = local_file.read(chunk_size)
+            if not chunk:
+                break
+            conn.send(chunk)
+            stats.bytes_sent += len(chunk)
+            if progress is not None:
+                progress(stats)
+        response = conn.getresponse()
+        body = response.read()
+        if response.status not in (httplib.OK, httplib.CREATED,
+                                   httplib.NO_CONTENT):
+            raise error_util.HTTPStatusException(response.status,
+                    "PUT %s failed: %s %s %s" % (url, response.status,
+                                                 response.reason, body[:200]))
+    finally:
+        conn.close()
+
+
+def upload_file(url, cookie, local_path, chunk_size=CHUNK_SIZE,
+                retries=UPLOAD_RETRIES, progress=None, skip_existing=False):
+    """
+    Uploads a local file to the datastore file URL, streaming it in
+    chunks of chunk_size bytes, so that memory use does not grow with
+    the file.
+
+    An upload interrupted by a network error, a timeout or a server
+    error is restarted, not resumed: the file is sent again from its
+    start, up to retries times, with an exponential backoff. The
+    datastore file access has no ranged PUT, each PUT replaces the whole
+    file. The client errors, e.g. an expired session or a missing
+    datastore, and the errors reading the local file fail at once.
+
+    progress      : Called with the TransferStats after each chunk sent
+    skip_existing : Does not send the file if the datastore has a file
+                    of the same size at the URL, e.g. uploaded by a run
+                    that was interrupted before it could record it. The
+                    contents are not compared.
+
+    Returns the TransferStats, with the throughput of the upload.
+    """
+    stats = TransferStats(os.path.getsize(local_path))
+    if skip_existing and get_file_size(url, cookie) == stats.total_bytes:
+        LOG.info("%s is already uploaded to %s" % (local_path, url))
+        stats.skipped = True
+        stats.end = time.time()
+        return stats
+    local_file = open(local_path, "rb")
+    try:
+        while True:
+            stats.attempts += 1
+            # Each attempt sends the file from its start
+            stats.bytes_sent = 0
+            try:
+                _put_file(url, cookie, local_file, stats, chunk_size,
+                          progress)
+                break
+            except Exception, excep:
+                if stats.attempts > retries or not _is_retriable(excep):
+                    raise
+                LOG.warn("Upload of %s to %s interrupted after %d bytes, "
+                         "restarting: %s" % (local_path, url,
+                                             stats.bytes_sent, excep))
+                metrics.REGISTRY.record_retry("upload_file")
+                executor.get_backend().sleep(TIME_BETWEEN_RETRIES *
+                                             2 ** (stats.attempts - 1))
+    finally:
+        local_file.close()
+    stats.end = time.time()
+    LOG.info("Uploaded %s to %s: %d bytes in %.1fs, %.1f MB/s" % (
+             local_path, url, stats.total_bytes, stats.elapsed(),
+             stats.throughput() / (1024 * 1024)))
+    return stats
+
+
+def _add_bytes(stats, lock, count):
+    lock.acquire()
+    try:
+        stats.bytes_sent += count
+    finally:
+        lock.release()
+
+
+def _get_range(url, cookie, local_path, start, end, stats, lock,
+               chunk_size, progress, info, cancelled):
+    """
+    GETs the bytes start to end, inclusive, of the file at the URL into
+    the local file, at the same offset. Each range writes through a file
+    of its own, so that the ranges are written in parallel. The GET is
+    conditional on the file still being the one of info, and stops early
+    once cancelled() is true.
+    """
+    conn, path = _connect(url)
+    try:
+        headers = _get_validator_headers(info)
+        headers.update({"Cookie": cookie, "User-Agent": USER_AGENT,
+                        "Range": "bytes=%d-%d" % (start, end)})
+        conn.request("GET", path, headers=headers)
+        response = conn.getresponse()
+        if (response.status == httplib.PRECONDITION_FAILED or
+                (response.status == httplib.OK and
+                 "If-Range" in headers)):
+            # If-Match failed, or If-Range sent the whole new file
+            raise error_util.FileChangedException(
+                    "%s changed while it was downloaded" % url)
+        if response.status != httplib.PARTIAL_CONTENT:
+            # The body may be the whole file, it is not read
+            raise Exception("GET %s of bytes %d-%d failed: %s %s" % (url,
+                            start, end, response.status, response.reason))
+        match = CONTENT_RANGE_RE.match(response.getheader("Content-Range",
+                                                          ""))
+        if (not match or int(match.group(1)) != start or
+                int(match.group(2)) != end or
+                match.group(3) not in ("*", str(stats.total_bytes))):
+            raise Exception("GET %s of bytes %d-%d got the range %s" % (
+                            url, start, end,
+                            response.getheader("Content-Range")))
+        length = end - start + 1
+        received = 0
+        local_file = open(local_path, "r+b")
+        try:
+            local_file.seek(start)
+            while received < length:
+                if cancelled():
+                    raise Exception("GET %s of bytes %d-%d cancelled" % (
+                                    url, start, end))
+                chunk = response.read(min(chunk_size, length - received))
+                if not chunk:
+                    break
+                local_file.write(chunk)
+                received += len(chunk)
+                _add_bytes(stats, lock, len(chunk))
+                if progress is not None:
+                    progress(stats)
+            if received != length:
+                raise Exception("GET %s of bytes %d-%d ended after %d "
+                                "bytes" % (url, start, end, received))
+        except Exception:
+            # The range is fetched again from its start
+            _add_bytes(stats, lock, -received)
+            raise
+        finally:
+            local_file.close()
+    finally:
+        conn.close()
+
+
+def download_file(url, cookie, local_path, streams=DOWNLOAD_STREAMS,
+                  range_size=RANGE_SIZE, chunk_size=CHUNK_SIZE,
+                  retries=DOWNLOAD_RETRIES, progress=None):
+    """
+    Downloads the file at the datastore file URL to a local file, with
+    up to streams ranged GETs of range_size bytes running at once. The
+    local file is preallocated and each range is written in place, so
+    they can complete in any order.
+
+    A range that fails is fetched again, up to retries times, with an
+    exponential backoff. Each range is verified to be the one asked for
+    and complete, and the download to have the size of the remote file.
+    The ETag or Last-Modified date of the file, from its first HEAD, is
+    sent as If-Range and If-Match with each ranged GET and checked again
+    at the end, so that a file changed meanwhile is not stitched together
+    from two versions.
+
+    Once a range fails for good, or the file changed, the other ranges
+    are cancelled and waited for, and the partial local file is deleted
+    before the error is raised.
+
+    progress : Called with the TransferStats after each chunk received
+
+    Returns the TransferStats, with the throughput of the download.
+    """
+    info = get_file_info(url, cookie)
+    if info is None:
+        raise Exception("%s not found" % url)
+    total_bytes = info['size']
+    stats = TransferStats(total_bytes)
+    local_file = open(local_path, "wb")
+    try:
+        local_file.truncate(total_bytes)
+    finally:
+        local_file.close()
+    lock = executor.get_backend().semaphore()
+    # The exc_info of the first range that failed for good
+    failures = []
+
+    def _cancelled():
+        return bool(failures)
+
+    def _fetch(start):
+        end = min(start + range_size, total_bytes) - 1
+        attempts = 0
+        while not failures:
+            attempts += 1
+            lock.acquire()
+            try:
+                stats.attempts += 1
+            finally:
+                lock.release()
+            try:
+                _get_range(url, cookie, local_path, start, end, stats, lock,
+                           chunk_size, progress, info, _cancelled)
+                return
+            except Exception, excep:
+                if failures:
+                    # Cancelled by the failure of another range
+                    return
+                if (attempts > retries or
+                        isinstance(excep, error_util.FileChangedException)):
+                    failures.append(sys.exc_info())
+                    return
+                LOG.warn("Download of bytes %d-%d of %s interrupted, "
+                         "resuming: %s" % (start, end, url, excep))
+                metrics.REGISTRY.record_retry("download_file")
+                executor.get_backend().sleep(TIME_BETWEEN_RETRIES *
+                                             2 ** (attempts - 1))
+
+    pool = executor.get_backend().pool(streams)
+    # Each range returns once done, failed for good, or cancelled
+    for result in pool.imap(_fetch, range(0, total_bytes, range_size)):
+        pass
+    try:
+        if failures:
+            raise failures[0][0], failures[0][1], failures[0][2]
+        if os.path.getsize(local_path) != total_bytes:
+            raise Exception("%s has %d bytes, %s has %d" % (local_path,
+                            os.path.getsize(local_path), url, total_bytes))
+        if get_file_info(url, cookie) != info:
+            raise error_util.FileChangedException(
+                    "%s changed while it was downloaded" % url)
+    except Exception:
+        exc_info = sys.exc_info()
+        LOG.warn("Download of %s failed, deleting %s" % (url, local_path))
+        try:
+            os.remove(local_path)
+        except OSError:
+            pass
+        raise exc_info[0], exc_info[1], exc_info[2]
+    stats.end = time.time()
+    LOG.info("Downloaded %s to %s: %d bytes in %.1fs, %.1f MB/s over %d "
+             "streams" % (url, local_path, total_bytes, stats.elapsed(),
+                          stats.throughput() / (1024 * 1024), streams))
+    return stats
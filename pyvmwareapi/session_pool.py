@@ -0,0 +1,166 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+"""
+Pool of sessions with the ESX host, so that concurrent callers do not
+share one SOAP connection.
+"""
+
+import logging
+import time
+
+import executor
+
+LOG = logging.getLogger()
+
+POOL_SIZE = 5
+IDLE_TIMEOUT = 600.0
+HEALTH_CHECK_INTERVAL = 60.0
+
+
+class VimSessionPool(object):
+    """
+    A bounded pool of authenticated VIM Objects. Sessions are created on
+    demand up to max_size, sessions idle for more than idle_timeout are
+    logged out, and sessions idle for more than check_interval are checked
+    before being handed out again.
+    """
+
+    def __init__(self, create_func, destroy_func, check_func,
+                 max_size=POOL_SIZE, idle_timeout=IDLE_TIMEOUT,
+                 check_interval=HEALTH_CHECK_INTERVAL):
+        """
+        create_func  : Returns a new logged in VIM Object
+        destroy_func : Logs out the VIM Object passed
+        check_func   : Returns whether the session of the VIM Object
+                       passed is still active
+        """
+        self._create_func = create_func
+        self._destroy_func = destroy_func
+        self._check_func = check_func
+        self.max_size = max_size
+        self._idle_timeout = idle_timeout
+        self._check_interval = check_interval
+        # (vim, time it was returned), the most recently used last
+        self._idle = []
+        # ids of the VIM Objects checked out, which may not be hashable
+        self._checked_out = set()
+        # id of a VIM Object checked out -> events of the callers waiting
+        # for it to be returned
+        self._preferred_waiters = {}
+        backend = executor.get_backend()
+        self._semaphore = backend.semaphore(max_size)
+        self._lock = backend.semaphore()
+
+    def get(self, preferred=None):
+        """
+        Checks out a VIM Object, waiting for one to be returned if
+        max_size of them are already checked out.
+
+        preferred : A VIM Object of the pool to check out again, e.g. the
+                    one whose session holds a paged retrieval, waited for
+                    if another caller has it checked out
+        """
+        self._semaphore.acquire()
+        try:
+            if preferred is not None:
+                vim = self._take(preferred)
+            else:
+                vim = self._get_any()
+            self._lock.acquire()
+            try:
+                self._checked_out.add(id(vim))
+            finally:
+                self._lock.release()
+            return vim
+        except Exception:
+            self._semaphore.release()
+            raise
+
+    def _get_any(self):
+        """Gets an idle session that is still active, or a new one."""
+        while True:
+            vim, last_used = self._pop_idle()
+            if vim is None:
+                break
+            if (time.time() - last_used < self._check_interval or
+                    self._check_func(vim)):
+                return vim
+            LOG.debug("Dropping the inactive session %s" % vim)
+            self._destroy_func(vim)
+        return self._create_func()
+
+    def _take(self, preferred):
+        """Takes the preferred session, once it is idle."""
+        while True:
+            self._lock.acquire()
+            try:
+                for index, (vim, last_used) in enumerate(self._idle):
+                    if vim is preferred:
+                        del self._idle[index]
+                        return vim
+                if id(preferred) not in self._checked_out:
+                    raise Exception("The session %s was logged out" %
+                                    preferred)
+                # Sent by put, when the session is returned
+                returned = executor.get_backend().event()
+                self._preferred_waiters.setdefault(id(preferred),
+                                                   []).append(returned)
+            finally:
+                self._lock.release()
+            returned.wait()
+
+    def put(self, vim, discard=False):
+        """
+        Returns a VIM Object checked out with get. A discarded VIM Object,
+        e.g. one whose session is overloaded or not authenticated any
+        more, is logged out instead of being reused.
+        """
+        try:
+            self._lock.acquire()
+            try:
+                self._checked_out.discard(id(vim))
+                if not discard:
+                    self._idle.append((vim, time.time()))
+                waiters = self._preferred_waiters.pop(id(vim), [])
+            finally:
+                self._lock.release()
+            if discard:
+                self._destroy_func(vim)
+            for returned in waiters:
+                returned.send(True)
+        finally:
+            self._semaphore.release()
+
+    def close(self):
+        """Logs out the idle sessions."""
+        self._lock.acquire()
+        try:
+            idle = self._idle
+            self._idle = []
+        finally:
+            self._lock.release()
+        for vim, last_used in idle:
+            self._destroy_func(vim)
+
+    def _pop_idle(self):
+        """
+        Takes the most recently used idle session, logging out the
+        sessions idle for longer than idle_timeout on the way. Returns
+        (None, None) if no session is idle.
+        """
+        expired = []
+        self._lock.acquire()
+        try:
+            now = time.time()
+            while (len(self._idle) > 1 and
+                   now - self._idle[0][1] > self._idle_timeout):
+                expired.append(self._idle.pop(0))
+            if self._idle:
+                idle = self._idle.pop()
+            else:
+                idle = (None, None)
+        finally:
+            self._lock.release()
+        for vim, last_used in expired:
+            self._destroy_func(vim)
+        return idle
@@ -0,0 +1,1375 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+"""
+In-process simulator of an ESX host, to drive the package end to end
+without a host, e.g. in benchmarks. FakeVim objects stand in for the
+VIM Objects: the SOAP methods used by the package are served from an
+in-memory inventory instead of going through suds, after a configurable
+latency per call.
+
+    sim = simulator.Simulator(num_vms=1000, latency=0.002)
+    conn = sim.driver()
+    conn.list_instances()
+
+The inventory is a standalone host: one datacenter, compute resource,
+host, resource pool and datastore, a vSwitch with one physical NIC and
+num_vms VMs. The data objects returned mimic the suds ones: their class
+is named after their type, and array properties are wrapped in ArrayOf
+objects, or "" when empty.
+
+It is not a SOAP endpoint: the suds marshalling and the HTTP transport
+are bypassed, so their regressions do not show up against it, and the
+message sizes it reports for the metrics are estimates.
+"""
+
+import collections
+import copy
+import fnmatch
+import itertools
+import threading
+import time
+import urllib
+import uuid
+
+import error_util
+import executor
+import vim
+import vm_util
+
+USER = "root"
+PASSWORD = "password"
+HOST = "simulator"
+
+DATACENTER_NAME = "ha-datacenter"
+HOST_NAME = "esx.simulator"
+DATASTORE_NAME = "datastore1"
+DATASTORE_CAPACITY = 2 * 1024 ** 4
+NETWORK_NAME = "VM Network"
+VSWITCH_NAME = "vSwitch0"
+PNIC_NAME = "vmnic0"
+
+# Seconds a completed task is kept for
+TASK_RETENTION = 600.0
+# Seconds between the checks for updates of a waiting WaitForUpdatesEx
+WAIT_POLL_INTERVAL = 0.05
+# Versions of a property collector that WaitForUpdatesEx can resume from
+COLLECTOR_VERSIONS_KEPT = 8
+FAULT_INVALID_COLLECTOR_VERSION = "InvalidCollectorVersion"
+# Bytes of the SOAP envelope around a request or a response, for the
+# message size estimates
+ENVELOPE_BYTES = 400
+
+# Types whose objects are also instances of another type
+TYPE_PARENTS = {
+    "ClusterComputeResource": "ComputeResource",
+    "DistributedVirtualPortgroup": "Network",
+    "VmwareDistributedVirtualSwitch": "DistributedVirtualSwitch",
+}
+
+# Methods that can be called without a session
+NO_SESSION_METHODS = ["RetrieveServiceContent", "Login"]
+
+_MISSING = object()
+
+
+class DataObject(object):
+    """A data object, like the ones suds builds from the schema."""
+
+    def __init__(self, **attributes):
+        self.__dict__.update(attributes)
+
+    def __repr__(self):
+        return "(%s)%r" % (self.__class__.__name__, self.__dict__)
+
+
+# type name -> DataObject subclass
+_CLASSES = {}
+
+
+def data_object(type_name, **attributes):
+    """Builds a data object whose class is named after its type."""
+    cls = _CLASSES.get(type_name)
+    if cls is None:
+        cls = type(str(type_name), (DataObject,), {})
+        _CLASSES[type_name] = cls
+    return cls(**attributes)
+
+
+class ManagedObjectReference(object):
+    """A managed object reference."""
+
+    def __init__(self, type=None, value=None):
+        self._type = type
+        self.value = value
+
+    def __eq__(self, other):
+        return (isinstance(other, ManagedObjectReference) and
+                self._type == other._type and self.value == other.value)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((self._type, self.value))
+
+    def __repr__(self):
+        return "%s:%s" % (self._type, self.value)
+
+    def __str__(self):
+        return str(self.value)
+
+
+class Array(list):
+    """An array property, of the items of the type given."""
+
+    def __init__(self, item_type, items=()):
+        list.__init__(self, items)
+        self.item_type = item_type
+
+
+class SimulatorFault(Exception):
+    """A fault of a simulated call or task."""
+
+    def __init__(self, fault, message):
+        Exception.__init__(self, message)
+        self.fault = fault
+        self.message = message
+
+
+class ManagedObject(object):
+    """A managed object of the inventory, with its properties."""
+
+    def __init__(self, type, value, props):
+        self.ref = ManagedObjectReference(type, value)
+        self.type = type
+        self.value = value
+        self.props = props
+        # Bumped by every change, for the property collector updates
+        self.version = 0
+
+
+class MessageSizes(object):
+    """Estimated sizes of the messages of the last call of a FakeVim."""
+
+    def __init__(self):
+        self.request_bytes = 0
+        self.response_bytes = 0
+
+
+class FakeFactory(object):
+    """Stands in for the suds client factory."""
+
+    def create(self, type_name):
+        type_name = type_name.split(":")[-1]
+        if type_name == "ManagedObjectReference":
+            return ManagedObjectReference()
+        return data_object(type_name)
+
+
+class FakeService(object):
+    """Stands in for the suds service, forwarding to the simulator."""
+
+    def __init__(self, vim_obj):
+        self._vim_obj = vim_obj
+
+    def __getattr__(self, method):
+        simulator = self._vim_obj._simulator
+        if not simulator.has_method(method):
+            raise AttributeError(method)
+
+        def _call(managed_object, **kwargs):
+            return simulator.invoke(self._vim_obj, method, managed_object,
+                                    kwargs)
+        return _call
+
+
+class FakeTransport(object):
+    """
+    Stands in for the suds transport of a VIM Object, whose cookie jar
+    holds the session cookie, for the HTTP transfers.
+    """
+
+    def __init__(self, vim_obj):
+        self._vim_obj = vim_obj
+
+    @property
+    def cookiejar(self):
+        if self._vim_obj._session_key is None:
+            return []
+        return [data_object("Cookie", name="vmware_soap_session",
+                            value=self._vim_obj._session_key)]
+
+
+class FakeClient(object):
+    """Stands in for the suds client of a VIM Object."""
+
+    def __init__(self, vim_obj):
+        self.factory = FakeFactory()
+        self.service = FakeService(vim_obj)
+        self.options = data_object("Options",
+                                   transport=FakeTransport(vim_obj))
+
+
+class FakeVim(vim.Vim):
+    """A VIM Object whose calls are served by a Simulator."""
+
+    def __init__(self, simulator):
+        self._simulator = simulator
+        self._session_key = None
+        self._plugin = MessageSizes()
+        self.client = FakeClient(self)
+        self._service_content = self.RetrieveServiceContent("ServiceInstance")
+
+    def share_session(self, other):
+        self._session_key = other._session_key
+
+    def _request_managed_object_builder(self, managed_object):
+        if isinstance(managed_object, str):
+            return ManagedObjectReference(managed_object, managed_object)
+        return managed_object
+
+    def __repr__(self):
+        return "Fake VIM Object"
+
+    def __str__(self):
+        return "Fake VIM Object"
+
+
+def estimate_size(value):
+    """Estimates the size of the XML encoding of the value, in bytes."""
+    if value is None or value is _MISSING:
+        return 0
+    if isinstance(value, basestring):
+        return len(value)
+    if isinstance(value, (bool, int, long, float)):
+        return len(str(value))
+    if isinstance(value, ManagedObjectReference):
+        return 30 + len(str(value._type)) + len(str(value.value))
+    if isinstance(value, (list, tuple)):
+        return sum([estimate_size(item) for item in value])
+    if isinstance(value, dict):
+        items = value.items()
+    else:
+        items = getattr(value, "__dict__", {}).items()
+    size = 0
+    for name, item in items:
+        # <name>item</name>
+        size += 2 * len(name) + 5 + estimate_size(item)
+    return size
+
+
+def is_a(type, base):
+    """Checks if the objects of the type are instances of base."""
+    while type is not None:
+        if type == base:
+            return True
+        type = TYPE_PARENTS.get(type)
+    return False
+
+
+class Simulator(object):
+    """
+    An ESX host in memory.
+
+    num_vms       : VMs in the inventory at the start
+    latency       : Seconds each call takes, or a function of the method
+                    name returning them
+    task_duration : Seconds a task runs before it completes
+    """
+
+    def __init__(self, num_vms=0, latency=0.0, task_duration=0.0,
+                 user=USER, password=PASSWORD):
+        self.user = user
+        self.password = password
+        self.latency = latency
+        self.task_duration = task_duration
+        # method name -> calls
+        self.call_counts = {}
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        # MoRef value -> ManagedObject
+        self._objects = {}
+        # session key -> UserSession
+        self._sessions = {}
+        # collector value -> (session key, {filter value: filter spec},
+        #                     {version: {filter value: objects reported}})
+        self._collectors = {}
+        # token -> remaining ObjectContents of a RetrievePropertiesEx
+        self._results = {}
+        # (datastore, directory) -> {file name: size in bytes}
+        self._dirs = {}
+        # running Task ManagedObjects, by completion time
+        self._running_tasks = []
+        # (completion time, Task value) of the completed tasks
+        self._completed_tasks = []
+        # instance uuid -> VM ManagedObject
+        self._vms_by_uuid = {}
+        # method name -> [exception, calls left to fail]
+        self._faults = {}
+        self._build_inventory(num_vms)
+
+    # Client side
+
+    def create_vim(self):
+        """Creates a VIM Object served by this simulator."""
+        return FakeVim(self)
+
+    def driver(self, **kwargs):
+        """Creates a VMwareESXDriver connected to this simulator."""
+        import driver
+        return driver.VMwareESXDriver(HOST, self.user, self.password,
+                                      vim_factory=self.create_vim, **kwargs)
+
+    def async_driver(self, **kwargs):
+        """Creates an AsyncVMwareESXDriver connected to this simulator."""
+        import driver
+        return driver.AsyncVMwareESXDriver(HOST, self.user, self.password,
+                                           vim_factory=self.create_vim,
+                                           **kwargs)
+
+    def reset_call_counts(self):
+        self.call_counts = {}
+
+    def inject_fault(self, method, exception=None, count=1):
+        """
+        Makes the next count calls of the method raise the exception,
+        NotAuthenticated by default, before they are served. Exceptions
+        other than SimulatorFaults are raised as they are, like the
+        errors of the transport.
+        """
+        if exception is None:
+            exception = SimulatorFault(error_util.FAULT_NOT_AUTHENTICATED,
+                                       "The session is not authenticated.")
+        self._faults[method] = [exception, count]
+
+    # Inventory
+
+    def _new_value(self, prefix):
+        return "%s-%d" % (prefix, self._ids.next())
+
+    def _add(self, type, value, **props):
+        managed_object = ManagedObject(type, value, props)
+        self._objects[value] = managed_object
+        return managed_object
+
+    def _changed(self, *managed_objects):
+        for managed_object in managed_objects:
+            managed_object.version += 1
+
+    def _get(self, mobj, type=None):
+        """Gets the managed object of the MoRef, raising if it is gone."""
+        managed_object = self._objects.get(getattr(mobj, "value", None))
+        if managed_object is None or (type is not None and
+                                      not is_a(managed_object.type, type)):
+            raise SimulatorFault(error_util.FAULT_MANAGED_OBJECT_NOT_FOUND,
+                                 "The object has already been deleted or "
+                                 "has not been completely created")
+        return managed_object
+
+    def _build_inventory(self, num_vms):
+        """Builds the objects of a standalone host."""
+        self._add("ServiceInstance", "ServiceInstance")
+        self._add("SessionManager", "SessionManager")
+        self._add("PropertyCollector", "propertyCollector")
+        self._add("SearchIndex", "SearchIndex")
+        self._add("VirtualDiskManager", "virtualDiskManager")
+        self._add("FileManager", "FileManager")
+
+        self.root_folder = self._add("Folder", "group-d1", name="Datacenters",
+                                     childEntity=Array(
+                                            "ManagedObjectReference"))
+        self.vm_folder = self._add("Folder", "group-v3", name="vm",
+                                   childEntity=Array(
+                                            "ManagedObjectReference"))
+        self.host_folder = self._add("Folder", "group-h4", name="host",
+                                     childEntity=Array(
+                                            "ManagedObjectReference"))
+        self.datastore = self._add("Datastore", "datastore-1",
+                name=DATASTORE_NAME,
+                browser=ManagedObjectReference("HostDatastoreBrowser",
+                                               "datastoreBrowser-datastore-1"),
+                summary=data_object("DatastoreSummary",
+                                    name=DATASTORE_NAME, type="VMFS",
+                                    capacity=DATASTORE_CAPACITY,
+                                    freeSpace=DATASTORE_CAPACITY,
+                                    accessible=True))
+        self._add("HostDatastoreBrowser", "datastoreBrowser-datastore-1")
+        self.network = self._add("Network", "network-1", name=NETWORK_NAME,
+                                 host=Array("ManagedObjectReference"))
+        self.network_system = self._add("HostNetworkSystem",
+                                        "networkSystem-1")
+        self.res_pool = self._add("ResourcePool", "resgroup-1",
+                                  name="Resources",
+                                  vm=Array("ManagedObjectReference"),
+                                  resourcePool=Array(
+                                            "ManagedObjectReference"))
+        pnic_key = "key-vim.host.PhysicalNic-%s" % PNIC_NAME
+        vswitch_key = "key-vim.host.VirtualSwitch-%s" % VSWITCH_NAME
+        host_network = data_object("HostNetworkInfo",
+            pnic=Array("PhysicalNic",
+                       [data_object("PhysicalNic", device=PNIC_NAME,
+                                    key=pnic_key)]),
+            vswitch=Array("HostVirtualSwitch",
+                          [data_object("HostVirtualSwitch",
+                                       name=VSWITCH_NAME, key=vswitch_key,
+                                       pnic=[pnic_key], portgroup=[])]),
+            portgroup=Array("HostPortGroup"))
+        self.host = self._add("HostSystem", "host-1", name=HOST_NAME,
+                vm=Array("ManagedObjectReference"),
+                datastore=Array("ManagedObjectReference",
+                                [self.datastore.ref]),
+                network=Array("ManagedObjectReference"),
+                configManager=data_object("HostConfigManager",
+                                networkSystem=self.network_system.ref),
+                config=data_object("HostConfigInfo", network=host_network))
+        self.compute_resource = self._add("ComputeResource", "ha-compute-res",
+                name=HOST_NAME,
+                host=Array("ManagedObjectReference", [self.host.ref]),
+                datastore=Array("ManagedObjectReference",
+                                [self.datastore.ref]),
+                network=Array("ManagedObjectReference"),
+                resourcePool=self.res_pool.ref)
+        self.host_folder.props["childEntity"].append(
+                                            self.compute_resource.ref)
+        self.datacenter = self._add("Datacenter", "datacenter-1",
+                name=DATACENTER_NAME,
+                vmFolder=self.vm_folder.ref,
+                hostFolder=self.host_folder.ref,
+                datastore=Array("ManagedObjectReference",
+                                [self.datastore.ref]),
+                network=Array("ManagedObjectReference"))
+        self.root_folder.props["childEntity"].append(self.datacenter.ref)
+        self._add_port_group(NETWORK_NAME, 0, VSWITCH_NAME)
+        self._dirs[(DATASTORE_NAME, "")] = {}
+
+        for index in range(num_vms):
+            name = "vm-%06d" % index
+            self._mkdir(DATASTORE_NAME, name)
+            disk = self._new_disk(DATASTORE_NAME, "%s/%s.vmdk" % (name, name),
+                                  1024 * 1024, 1000, 0)
+            self._add_vm(name, str(uuid.uuid4()), 1, 512, "poweredOn",
+                         [self._new_controller(1000), disk])
+
+    def _add_port_group(self, name, vlan_id, vswitch_name):
+        """Adds a port group, and the network of its name."""
+        host_network = self.host.props["config"].network
+        for vswitch in host_network.vswitch:
+            if vswitch.name == vswitch_name:
+                break
+        else:
+            raise SimulatorFault("NotFound",
+                                 "vSwitch %s not found" % vswitch_name)
+        for port_group in host_network.portgroup:
+            if port_group.spec.name == name:
+                raise SimulatorFault(error_util.FAULT_ALREADY_EXISTS,
+                                     "The port group %s already exists" %
+                                     name)
+        key = "key-vim.host.PortGroup-%s" % name
+        host_network.portgroup.append(data_object("HostPortGroup",
+                key=key, vswitch=vswitch.key,
+                spec=data_object("HostPortGroupSpec", name=name,
+                                 vlanId=vlan_id, vswitchName=vswitch_name)))
+        vswitch.portgroup.append(key)
+        for network_value in self.host.props["network"]:
+            if self._objects[network_value.value].props["name"] == name:
+                break
+        else:
+            network = self.network
+            if name != NETWORK_NAME:
+                network = self._add("Network", self._new_value("network"),
+                                    name=name,
+                                    host=Array("ManagedObjectReference"))
+            network.props["host"].append(self.host.ref)
+            for managed_object in [self.host, self.compute_resource,
+                                   self.datacenter]:
+                managed_object.props["network"].append(network.ref)
+                self._changed(managed_object)
+        self._changed(self.host)
+
+    def _new_controller(self, key):
+        return data_object("VirtualLsiLogicController", key=key,
+                           busNumber=0, sharedBus="noSharing",
+                           device=[])
+
+    def _new_disk(self, datastore_name, path, capacity_kb, key,
+                  controller_key, unit_number=0, thin=False):
+        """Creates a flat disk on the datastore and its device."""
+        file_name = vm_util.build_datastore_path(datastore_name, path)
+        self._create_disk_file(file_name, capacity_kb)
+        return data_object("VirtualDisk", key=key,
+                           controllerKey=controller_key,
+                           unitNumber=unit_number, capacityInKB=capacity_kb,
+                           backing=data_object(
+                                    "VirtualDiskFlatVer2BackingInfo",
+                                    fileName=file_name, diskMode="persistent",
+                                    thinProvisioned=thin))
+
+    def _add_vm(self, name, instance_uuid, num_cpu, memory_mb, power_state,
+                devices, folder=None, res_pool=None, guest_id="otherGuest"):
+        """Adds a VM to the inventory."""
+        folder = folder or self.vm_folder
+        res_pool = res_pool or self.res_pool
+        vmx_path = vm_util.build_datastore_path(DATASTORE_NAME,
+                                                "%s/%s.vmx" % (name, name))
+        self._create_file(vmx_path, 2048)
+        vm = self._add("VirtualMachine", self._new_value("vm"), name=name,
+            parent=folder.ref,
+            resourcePool=res_pool.ref,
+            config=data_object("VirtualMachineConfigInfo", name=name,
+                instanceUuid=instance_uuid, uuid=str(uuid.uuid4()),
+                guestId=guest_id, template=False,
+                files=data_object("VirtualMachineFileInfo",
+                                  vmPathName=vmx_path),
+                hardware=data_object("VirtualHardware", numCPU=num_cpu,
+                    memoryMB=memory_mb,
+                    device=Array("VirtualDevice",
+                                 [data_object("VirtualIDEController",
+                                              key=200, busNumber=0,
+                                              device=[]),
+                                  data_object("VirtualIDEController",
+                                              key=201, busNumber=1,
+                                              device=[])] + devices))),
+            summary=data_object("VirtualMachineSummary",
+                config=data_object("VirtualMachineConfigSummary", name=name,
+                                   numCpu=num_cpu, memorySizeMB=memory_mb,
+                                   instanceUuid=instance_uuid,
+                                   vmPathName=vmx_path),
+                guest=data_object("VirtualMachineGuestSummary",
+                                  toolsStatus="toolsNotInstalled",
+                                  toolsRunningStatus="guestToolsNotRunning")),
+            runtime=data_object("VirtualMachineRuntimeInfo",
+                                powerState=power_state,
+                                connectionState="connected",
+                                host=self.host.ref),
+            snapshot=None)
+        for container in [folder, res_pool, self.host]:
+            key = container is folder and "childEntity" or "vm"
+            container.props[key].append(vm.ref)
+            self._changed(container)
+        self._vms_by_uuid[instance_uuid] = vm
+        return vm
+
+    def _remove_vm(self, vm):
+        """Removes a VM from the inventory."""
+        folder = self._objects[vm.props["parent"].value]
+        res_pool = self._objects[vm.props["resourcePool"].value]
+        for container, key in [(folder, "childEntity"), (res_pool, "vm"),
+                               (self.host, "vm")]:
+            container.props[key].remove(vm.ref)
+            self._changed(container)
+        del self._objects[vm.value]
+        self._vms_by_uuid.pop(vm.props["config"].instanceUuid, None)
+
+    # Datastore files
+
+    def _split(self, path):
+        """Splits a datastore path into the datastore and the path."""
+        datastore_name, file_path = vm_util.split_datastore_path(path)
+        return datastore_name, file_path.strip("/")
+
+    def _mkdir(self, datastore_name, dir_path, parents=False):
+        parent = dir_path.rpartition("/")[0]
+        if (datastore_name, parent) not in self._dirs:
+            if not parents:
+                raise SimulatorFault("FileNotFound", "File [%s] %s was not "
+                                     "found" % (datastore_name, parent))
+            self._mkdir(datastore_name, parent, parents)
+        if (datastore_name, dir_path) in self._dirs:
+            raise SimulatorFault("FileAlreadyExists", "Cannot complete the "
+                                 "operation because the file or folder "
+                                 "[%s] %s already exists" %
+                                 (datastore_name, dir_path))
+        self._dirs[(datastore_name, dir_path)] = {}
+
+    def _create_file(self, path, size):
+        datastore_name, file_path = self._split(path)
+        dir_path, file_name = file_path.rpartition("/")[::2]
+        if (datastore_name, dir_path) not in self._dirs:
+            self._mkdir(datastore_name, dir_path, parents=True)
+        self._dirs[(datastore_name, dir_path)][file_name] = size
+
+    def _create_disk_file(self, path, capacity_kb):
+        """Creates the descriptor and the flat file of a disk."""
+        if self._file_exists(path):
+            raise SimulatorFault("FileAlreadyExists", "Cannot complete the "
+                                 "operation because the file or folder %s "
+                                 "already exists" % path)
+        self._create_file(path, 512)
+        self._create_file(path[:-len(".vmdk")] + "-flat.vmdk",
+                          capacity_kb * 1024)
+
+    def _file_exists(self, path):
+        datastore_name, file_path = self._split(path)
+        dir_path, file_name = file_path.rpartition("/")[::2]
+        return file_name in self._dirs.get((datastore_name, dir_path), {})
+
+    def _delete_path(self, path):
+        """Deletes a file, or a directory with all its content."""
+        datastore_name, file_path = self._split(path)
+        if file_path and (datastore_name, file_path) in self._dirs:
+            for key in self._dirs.keys():
+                if key[0] == datastore_name and (key[1] == file_path or
+                        key[1].startswith(file_path + "/")):
+                    del self._dirs[key]
+            return
+        dir_path, file_name = file_path.rpartition("/")[::2]
+        files = self._dirs.get((datastore_name, dir_path), {})
+        if file_name not in files:
+            raise SimulatorFault("FileNotFound",
+                                 "File %s was not found" % path)
+        del files[file_name]
+
+    # Calls
+
+    def has_method(self, method):
+        return method[:1].isupper() and hasattr(self, method)
+
+    def invoke(self, vim_obj, method, managed_object, kwargs):
+        """Serves a call made by a FakeVim."""
+        latency = self.latency
+        if callable(latency):
+            latency = latency(method)
+        if latency:
+            executor.get_backend().sleep(latency)
+        vim_obj._plugin.request_bytes = (ENVELOPE_BYTES + 2 * len(method) +
+                                         estimate_size(kwargs))
+        self.call_counts[method] = self.call_counts.get(method, 0) + 1
+        handler = getattr(self, method)
+        try:
+            fault = self._faults.get(method)
+            if fault is not None:
+                fault[1] -= 1
+                if fault[1] <= 0:
+                    del self._faults[method]
+                raise fault[0]
+            if (method not in NO_SESSION_METHODS and
+                    vim_obj._session_key not in self._sessions):
+                raise SimulatorFault(error_util.FAULT_NOT_AUTHENTICATED,
+                                     "The session is not authenticated.")
+            if method == "WaitForUpdatesEx":
+                # Waits without holding the lock
+                result = handler(vim_obj, managed_object, **kwargs)
+            else:
+                self._lock.acquire()
+                try:
+                    self._complete_tasks()
+                    result = handler(vim_obj, managed_object, **kwargs)
+                finally:
+                    self._lock.release()
+        except SimulatorFault, excep:
+            raise error_util.VimFaultException([excep.fault],
+                                               Exception(excep.message))
+        vim_obj._plugin.response_bytes = ENVELOPE_BYTES + estimate_size(
+                                                                    result)
+        return result
+
+    # Sessions
+
+    def RetrieveServiceContent(self, vim_obj, _this):
+        return data_object("ServiceContent",
+            rootFolder=self.root_folder.ref,
+            propertyCollector=self._objects["propertyCollector"].ref,
+            sessionManager=self._objects["SessionManager"].ref,
+            searchIndex=self._objects["SearchIndex"].ref,
+            virtualDiskManager=self._objects["virtualDiskManager"].ref,
+            fileManager=self._objects["FileManager"].ref,
+            about=data_object("AboutInfo", name="VMware ESXi simulator",
+                              apiVersion="5.0", apiType="HostAgent"))
+
+    def Login(self, vim_obj, _this, userName=None, password=None,
+              locale=None):
+        if userName != self.user or password != self.password:
+            raise SimulatorFault("InvalidLogin", "Cannot complete login due "
+                                 "to an incorrect user name or password.")
+        key = str(uuid.uuid4())
+        user_session = data_object("UserSession", key=key, userName=userName,
+                                   loginTime=time.time())
+        self._sessions[key] = user_session
+        vim_obj._session_key = key
+        return user_session
+
+    def Logout(self, vim_obj, _this):
+        key = vim_obj._session_key
+        self._sessions.pop(key, None)
+        for collector, collector_state in self._collectors.items():
+            if collector_state[0] == key:
+                del self._collectors[collector]
+
+    # Property collector
+
+    def _get_property(self, vim_obj, managed_object, path):
+        """Gets a property of a managed object, or _MISSING."""
+        if managed_object.type == "SessionManager":
+            if path == "currentSession":
+                return self._sessions.get(vim_obj._session_key, _MISSING)
+            return _MISSING
+        parts = path.split(".")
+        value = managed_object.props.get(parts[0], _MISSING)
+        for part in parts[1:]:
+            if value is _MISSING or value is None:
+                return _MISSING
+            value = getattr(value, part, _MISSING)
+        return value
+
+    def _wrap(self, value):
+        """Wraps the array property values as suds does."""
+        if isinstance(value, Array):
+            if not value:
+                return ""
+            return data_object("ArrayOf" + value.item_type,
+                               **{value.item_type: list(value)})
+        return value
+
+    def _select(self, spec):
+        """
+        Gets the objects selected by a PropertyFilterSpec, as a list of
+        (ManagedObject, property paths or None for all of them).
+        """
+        named = {}
+
+        def _collect_named(select_set):
+            for selection in select_set or []:
+                if selection.__class__.__name__ == "TraversalSpec":
+                    if getattr(selection, "name", None) and \
+                            selection.name not in named:
+                        named[selection.name] = selection
+                        _collect_named(getattr(selection, "selectSet", []))
+
+        object_specs = spec.objectSet
+        if not isinstance(object_specs, (list, tuple)):
+            object_specs = [object_specs]
+        for object_spec in object_specs:
+            _collect_named(getattr(object_spec, "selectSet", None))
+
+        selected = []
+        seen = set()
+
+        def _add(managed_object):
+            if managed_object.value not in seen:
+                seen.add(managed_object.value)
+                selected.append(managed_object)
+
+        visited = set()
+
+        def _traverse(managed_object, select_set):
+            for selection in select_set or []:
+                if selection.__class__.__name__ == "TraversalSpec":
+                    traversal = selection
+                else:
+                    traversal = named.get(getattr(selection, "name", None))
+                if traversal is None or not is_a(managed_object.type,
+                                                 traversal.type):
+                    continue
+                key = (managed_object.value, id(traversal))
+                if key in visited:
+                    continue
+                visited.add(key)
+                targets = managed_object.props.get(traversal.path)
+                if targets is None:
+                    continue
+                if not isinstance(targets, (list, tuple)):
+                    targets = [targets]
+                for target in targets:
+                    child = self._objects.get(target.value)
+                    if child is None:
+                        continue
+                    if not getattr(traversal, "skip", False):
+                        _add(child)
+                    _traverse(child, getattr(traversal, "selectSet", None))
+
+        for object_spec in object_specs:
+            root = self._get(object_spec.obj)
+            if not getattr(object_spec, "skip", False):
+                _add(root)
+            _traverse(root, getattr(object_spec, "selectSet", None))
+
+        property_specs = spec.propSet
+        if not isinstance(property_specs, (list, tuple)):
+            property_specs = [property_specs]
+        result = []
+        for managed_object in selected:
+            paths = []
+            all_properties = False
+            matched = False
+            for property_spec in property_specs:
+                if not is_a(managed_object.type, property_spec.type):
+                    continue
+                matched = True
+                if getattr(property_spec, "all", False):
+                    all_properties = True
+                for path in getattr(property_spec, "pathSet", None) or []:
+                    if path not in paths:
+                        paths.append(path)
+            if matched:
+                result.append((managed_object,
+                               None if all_properties else paths))
+        return result
+
+    def _object_content(self, vim_obj, managed_object, paths):
+        if paths is None:
+            paths = sorted(managed_object.props.keys())
+        prop_set = []
+        for path in paths:
+            value = self._get_property(vim_obj, managed_object, path)
+            if value is not _MISSING:
+                prop_set.append(data_object("DynamicProperty", name=path,
+                                            val=self._wrap(value)))
+        return data_object("ObjectContent", obj=managed_object.ref,
+                           propSet=prop_set)
+
+    def _retrieve(self, vim_obj, specSet):
+        objects = []
+        for spec in specSet:
+            for managed_object, paths in self._select(spec):
+                objects.append(self._object_content(vim_obj, managed_object,
+                                                    paths))
+        return objects
+
+    def RetrieveProperties(self, vim_obj, _this, specSet=None):
+        return self._retrieve(vim_obj, specSet)
+
+    def RetrievePropertiesEx(self, vim_obj, _this, specSet=None,
+                             options=None):
+        objects = self._retrieve(vim_obj, specSet)
+        return self._page(objects, getattr(options, "maxObjects", None))
+
+    def ContinuePropertiesEx(self, vim_obj, _this, token=None):
+        if token not in self._results:
+            raise SimulatorFault("InvalidArgument", "token")
+        objects, max_objects = self._results.pop(token)
+        return self._page(objects, max_objects)
+
+    def CancelRetrievePropertiesEx(self, vim_obj, _this, token=None):
+        self._results.pop(token, None)
+
+    def _page(self, objects, max_objects):
+        """Gets a page of a RetrievePropertiesEx result."""
+        if not objects:
+            return None
+        result = data_object("RetrieveResult")
+        if max_objects and len(objects) > max_objects:
+            result.token = self._new_value("token")
+            self._results[result.token] = (objects[max_objects:],
+                                           max_objects)
+            objects = objects[:max_objects]
+        result.objects = objects
+        return result
+
+    def CreatePropertyCollector(self, vim_obj, _this):
+        collector = self._add("PropertyCollector",
+                              self._new_value("session[collector]"))
+        self._collectors[collector.value] = (vim_obj._session_key, {},
+                                             collections.OrderedDict())
+        return collector.ref
+
+    def DestroyPropertyCollector(self, vim_obj, _this):
+        self._collectors.pop(_this.value, None)
+        self._objects.pop(_this.value, None)
+
+    def CreateFilter(self, vim_obj, _this, spec=None, partialUpdates=False):
+        if _this.value not in self._collectors:
+            raise SimulatorFault(error_util.FAULT_MANAGED_OBJECT_NOT_FOUND,
+                                 "The property collector is gone")
+        property_filter = ManagedObjectReference("PropertyFilter",
+                                                 self._new_value("filter"))
+        self._collectors[_this.value][1][property_filter.value] = spec
+        return property_filter
+
+    def DestroyPropertyFilter(self, vim_obj, _this):
+        for session_key, filters, versions in self._collectors.values():
+            filters.pop(_this.value, None)
+
+    def _collect_updates(self, vim_obj, collector, version, max_updates):
+        """
+        Gets the updates of the filters of the collector since the
+        version, all of them for an empty version, or None. With
+        max_updates, the UpdateSet holds at most that many object updates
+        and is truncated, the next ones follow from its version.
+        """
+        session_key, filters, versions = self._collectors[collector.value]
+        if version:
+            if version not in versions:
+                raise SimulatorFault(FAULT_INVALID_COLLECTOR_VERSION,
+                                     "Unknown version %s" % version)
+            base = versions[version]
+        else:
+            base = {}
+        # filter value -> {MoRef value: (type, version reported)}
+        state = {}
+        filter_updates = []
+        truncated = False
+        num_updates = 0
+        for filter_value, spec in filters.items():
+            reported = dict(base.get(filter_value, {}))
+            state[filter_value] = reported
+            if truncated:
+                continue
+            object_updates = []
+            selected = set()
+            try:
+                selection = self._select(spec)
+            except SimulatorFault:
+                selection = []
+            for managed_object, paths in selection:
+                selected.add(managed_object.value)
+                type_and_version = reported.get(managed_object.value)
+                if type_and_version is None:
+                    kind = "enter"
+                elif type_and_version[1] == managed_object.version:
+                    continue
+                else:
+                    kind = "modify"
+                if max_updates and num_updates >= max_updates:
+                    truncated = True
+                    break
+                num_updates += 1
+                reported[managed_object.value] = (managed_object.type,
+                                                  managed_object.version)
+                content = self._object_content(vim_obj, managed_object,
+                                               paths)
+                object_updates.append(data_object("ObjectUpdate",
+                    kind=kind, obj=managed_object.ref,
+                    changeSet=[data_object("PropertyChange",
+                                           name=prop.name, op="assign",
+                                           val=prop.val)
+                               for prop in content.propSet]))
+            for value in reported.keys():
+                if truncated:
+                    break
+                if value not in selected:
+                    if max_updates and num_updates >= max_updates:
+                        truncated = True
+                        break
+                    num_updates += 1
+                    type_name = reported.pop(value)[0]
+                    object_updates.append(data_object("ObjectUpdate",
+                        kind="leave",
+                        obj=ManagedObjectReference(type_name, value),
+                        changeSet=[]))
+            if object_updates:
+                filter_updates.append(data_object("PropertyFilterUpdate",
+                    filter=ManagedObjectReference("PropertyFilter",
+                                                  filter_value),
+                    objectSet=object_updates))
+        if not filter_updates:
+            return None
+        new_version = self._new_value("version")
+        versions[new_version] = state
+        while len(versions) > COLLECTOR_VERSIONS_KEPT:
+            versions.popitem(last=False)
+        return data_object("UpdateSet", version=new_version,
+                           filterSet=filter_updates, truncated=truncated)
+
+    def WaitForUpdatesEx(self, vim_obj, _this, version=None, options=None):
+        max_wait = getattr(options, "maxWaitSeconds", None)
+        max_updates = getattr(options, "maxObjectUpdates", None)
+        deadline = max_wait is not None and time.time() + max_wait or None
+        while True:
+            self._lock.acquire()
+            try:
+                if _this.value not in self._collectors:
+                    raise SimulatorFault(
+                                error_util.FAULT_MANAGED_OBJECT_NOT_FOUND,
+                                "The property collector is gone")
+                self._complete_tasks()
+                update_set = self._collect_updates(vim_obj, _this, version,
+                                                   max_updates)
+            finally:
+                self._lock.release()
+            if update_set is not None:
+                return update_set
+            if deadline is not None and time.time() >= deadline:
+                return None
+            executor.get_backend().sleep(WAIT_POLL_INTERVAL)
+
+    # Tasks
+
+    def _new_task(self, name, entity, action):
+        """
+        Creates a task running action, which returns the task result or
+        raises a SimulatorFault.
+        """
+        info = data_object("TaskInfo", name=name, descriptionId=name,
+                           entity=entity and entity.ref, state="running",
+                           result=None, error=None,
+                           queueTime=time.time(), startTime=time.time(),
+                           completeTime=None)
+        task = self._add("Task", self._new_value("task"), info=info)
+        info.key = task.value
+        task.action = action
+        if self.task_duration > 0:
+            task.complete_at = time.time() + self.task_duration
+            self._running_tasks.append(task)
+        else:
+            self._run_task(task)
+        return task.ref
+
+    def _run_task(self, task):
+        info = task.props["info"]
+        try:
+            info.result = task.action()
+            info.state = "success"
+        except SimulatorFault, excep:
+            info.state = "error"
+            info.error = data_object("LocalizedMethodFault",
+                                     fault=data_object(excep.fault),
+                                     localizedMessage=excep.message)
+        info.completeTime = time.time()
+        task.action = None
+        self._changed(task)
+        self._completed_tasks.append((info.completeTime, task.value))
+
+    def _complete_tasks(self):
+        """Completes the tasks due, and drops the old completed ones."""
+        now = time.time()
+        if self._running_tasks:
+            running = []
+            for task in self._running_tasks:
+                if task.complete_at <= now:
+                    self._run_task(task)
+                else:
+                    running.append(task)
+            self._running_tasks = running
+        while (self._completed_tasks and
+               now - self._completed_tasks[0][0] > TASK_RETENTION):
+            self._objects.pop(self._completed_tasks.pop(0)[1], None)
+
+    # Search index
+
+    def FindByUuid(self, vim_obj, _this, datacenter=None, uuid=None,
+                   vmSearch=False, instanceUuid=False):
+        if instanceUuid:
+            vm = self._vms_by_uuid.get(uuid)
+            return vm and vm.ref
+        for managed_object in self._objects.values():
+            if (managed_object.type == "VirtualMachine" and
+                    managed_object.props["config"].uuid == uuid):
+                return managed_object.ref
+        return None
+
+    def FindByInventoryPath(self, vim_obj, _this, inventoryPath=None):
+        parts = inventoryPath.strip("/").split("/")
+        current = self.root_folder
+        for part in parts:
+            children = []
+            if current.type == "Folder":
+                children = current.props["childEntity"]
+            elif current.type == "Datacenter":
+                children = [current.props["vmFolder"],
+                            current.props["hostFolder"]]
+            for child_ref in children:
+                child = self._objects[child_ref.value]
+                if child.props.get("name") == urllib.unquote(part):
+                    current = child
+                    break
+            else:
+                return None
+        return current.ref
+
+    # Files
+
+    def MakeDirectory(self, vim_obj, _this, name=None, datacenter=None,
+                      createParentDirectories=False):
+        datastore_name, dir_path = self._split(name)
+        self._mkdir(datastore_name, dir_path, createParentDirectories)
+
+    def DeleteDatastoreFile_Task(self, vim_obj, _this, name=None,
+                                 datacenter=None):
+        return self._new_task("DeleteDatastoreFile_Task", None,
+                              lambda: self._delete_path(name))
+
+    def SearchDatastore_Task(self, vim_obj, _this, datastorePath=None,
+                             searchSpec=None):
+        def _search():
+            datastore_name, dir_path = self._split(datastorePath)
+            files = self._dirs.get((datastore_name, dir_path))
+            if files is None:
+                raise SimulatorFault("FileNotFound", "File %s was not found"
+                                     % datastorePath)
+            patterns = getattr(searchSpec, "matchPattern", None) or ["*"]
+            names = [name for name in sorted(files)
+                     if [pattern for pattern in patterns
+                         if fnmatch.fnmatch(name, pattern)]]
+            result = data_object("HostDatastoreBrowserSearchResults",
+                                 datastore=self.datastore.ref,
+                                 folderPath=datastorePath)
+            if names:
+                result.file = [data_object("FileInfo", path=name,
+                                           fileSize=files[name])
+                               for name in names]
+            return result
+        return self._new_task("SearchDatastore_Task", None, _search)
+
+    def CreateVirtualDisk_Task(self, vim_obj, _this, name=None,
+                               datacenter=None, spec=None):
+        def _create():
+            datastore_name, file_path = self._split(name)
+            dir_path = file_path.rpartition("/")[0]
+            if (datastore_name, dir_path) not in self._dirs:
+                raise SimulatorFault("FileNotFound", "File [%s] %s was not "
+                                     "found" % (datastore_name, dir_path))
+            self._create_disk_file(name, spec.capacityKb)
+            return name
+        return self._new_task("CreateVirtualDisk_Task", None, _create)
+
+    def CopyVirtualDisk_Task(self, vim_obj, _this, sourceName=None,
+                             sourceDatacenter=None, destName=None,
+                             destDatacenter=None, destSpec=None,
+                             force=False):
+        def _copy():
+            if not self._file_exists(sourceName):
+                raise SimulatorFault("FileNotFound", "File %s was not found"
+                                     % sourceName)
+            self._create_disk_file(destName,
+                                   getattr(destSpec, "capacityKb", 0) or 0)
+            return destName
+        return self._new_task("CopyVirtualDisk_Task", None, _copy)
+
+    # Virtual machines
+
+    def _apply_device_changes(self, vm_name, devices, device_changes):
+        """Applies the deviceChange of a config spec to the devices."""
+        keys = {}
+        next_key = max([device.key for device in devices] + [1000]) + 1
+        for change in device_changes or []:
+            device = change.device
+            if change.operation == "remove":
+                for existing in devices:
+                    if existing.key == device.key:
+                        devices.remove(existing)
+                        break
+                if (getattr(change, "fileOperation", None) == "destroy" and
+                        getattr(device.backing, "fileName", None)):
+                    self._delete_path(device.backing.fileName)
+                continue
+            if device.key is None or device.key < 0:
+                keys[device.key] = next_key
+                device.key = next_key
+                next_key += 1
+            if getattr(device, "controllerKey", None) in keys:
+                device.controllerKey = keys[device.controllerKey]
+            if device.__class__.__name__ == "VirtualDisk":
+                file_name = getattr(device.backing, "fileName", None)
+                if getattr(change, "fileOperation", None) == "create":
+                    if not file_name:
+                        file_name = vm_util.build_datastore_path(
+                                DATASTORE_NAME, "%s/%s.vmdk" % (vm_name,
+                                                                vm_name))
+                        index = 1
+                        while self._file_exists(file_name):
+                            file_name = vm_util.build_datastore_path(
+                                DATASTORE_NAME, "%s/%s_%d.vmdk" % (
+                                                vm_name, vm_name, index))
+                            index += 1
+                        device.backing.fileName = file_name
+                    self._create_disk_file(file_name,
+                                           device.capacityInKB or 0)
+                elif not self._file_exists(file_name):
+                    raise SimulatorFault("FileNotFound", "File %s was not "
+                                         "found" % file_name)
+            devices.append(device)
+
+    def CreateVM_Task(self, vim_obj, _this, config=None, pool=None,
+                      host=None):
+        def _create():
+            folder = self._get(_this, "Folder")
+            res_pool = self._get(pool, "ResourcePool")
+            for child in folder.props["childEntity"]:
+                child_object = self._objects.get(child.value)
+                if child_object and child_object.props.get("name") == \
+                        config.name:
+                    raise SimulatorFault("DuplicateName", "The name '%s' "
+                                         "already exists." % config.name)
+            datastore_name = self._split(config.files.vmPathName)[0]
+            if datastore_name != DATASTORE_NAME:
+                raise SimulatorFault("InvalidDatastore", "Invalid datastore "
+                                     "path '%s'." % config.files.vmPathName)
+            if (DATASTORE_NAME, config.name) not in self._dirs:
+                self._mkdir(DATASTORE_NAME, config.name)
+            devices = []
+            self._apply_device_changes(config.name, devices,
+                                       getattr(config, "deviceChange", None))
+            vm = self._add_vm(config.name,
+                              getattr(config, "instanceUuid", None) or
+                              str(uuid.uuid4()),
+                              getattr(config, "numCPUs", None) or 1,
+                              getattr(config, "memoryMB", None) or 4,
+                              "poweredOff", devices, folder, res_pool,
+                              getattr(config, "guestId", None) or
+                              "otherGuest")
+            return vm.ref
+        return self._new_task("CreateVM_Task", None, _create)
+
+    def ReconfigVM_Task(self, vim_obj, _this, spec=None):
+        vm = self._get(_this, "VirtualMachine")
+
+        def _reconfig():
+            self._get(_this, "VirtualMachine")
+            config = vm.props["config"]
+            self._apply_device_changes(vm.props["name"],
+                                       config.hardware.device,
+                                       getattr(spec, "deviceChange", None))
+            if getattr(spec, "numCPUs", None):
+                config.hardware.numCPU = spec.numCPUs
+                vm.props["summary"].config.numCpu = spec.numCPUs
+            if getattr(spec, "memoryMB", None):
+                config.hardware.memoryMB = spec.memoryMB
+                vm.props["summary"].config.memorySizeMB = spec.memoryMB
+            self._changed(vm)
+        return self._new_task("ReconfigVM_Task", vm, _reconfig)
+
+    def CreateSnapshot_Task(self, vim_obj, _this, name=None,
+                            description=None, memory=False, quiesce=False):
+        vm = self._get(_this, "VirtualMachine")
+
+        def _snapshot():
+            self._get(_this, "VirtualMachine")
+            # The devices of the VM as of the snapshot, for its clones
+            snapshot = self._add("VirtualMachineSnapshot",
+                    self._new_value("snapshot"), vm=vm.ref,
+                    config=copy.deepcopy(vm.props["config"]))
+            tree = data_object("VirtualMachineSnapshotTree",
+                               snapshot=snapshot.ref, vm=vm.ref, name=name,
+                               description=description,
+                               createTime=time.time(),
+                               childSnapshotList=[])
+            info = vm.props["snapshot"]
+            if info is None:
+                info = data_object("VirtualMachineSnapshotInfo",
+                                   rootSnapshotList=[])
+                vm.props["snapshot"] = info
+                info.rootSnapshotList.append(tree)
+            else:
+                parent = self._objects[info.currentSnapshot.value]
+                parent.tree.childSnapshotList.append(tree)
+            snapshot.tree = tree
+            info.currentSnapshot = snapshot.ref
+            self._changed(vm)
+            return snapshot.ref
+        return self._new_task("CreateSnapshot_Task", vm, _snapshot)
+
+    def CloneVM_Task(self, vim_obj, _this, folder=None, name=None,
+                     spec=None):
+        vm = self._get(_this, "VirtualMachine")
+
+        def _clone():
+            self._get(_this, "VirtualMachine")
+            target_folder = self._get(folder, "Folder")
+            for child in target_folder.props["childEntity"]:
+                child_object = self._objects.get(child.value)
+                if child_object and child_object.props.get("name") == name:
+                    raise SimulatorFault("DuplicateName", "The name '%s' "
+                                         "already exists." % name)
+            location = spec.location
+            linked = (getattr(location, "diskMoveType", None) ==
+                      "createNewChildDiskBacking")
+            snapshot_ref = getattr(spec, "snapshot", None)
+            if snapshot_ref is not None:
+                source_config = self._get(snapshot_ref,
+                                    "VirtualMachineSnapshot").props["config"]
+            elif linked:
+                raise SimulatorFault("InvalidArgument", "A specified "
+                                     "parameter was not correct: "
+                                     "spec.snapshot")
+            else:
+                source_config = vm.props["config"]
+            res_pool = self._objects[(getattr(location, "pool", None) or
+                                      vm.props["resourcePool"]).value]
+
+            if (DATASTORE_NAME, name) not in self._dirs:
+                self._mkdir(DATASTORE_NAME, name)
+            devices = []
+            for device in source_config.hardware.device:
+                if device.__class__.__name__ == "VirtualIDEController":
+                    continue
+                device = copy.deepcopy(device)
+                if device.__class__.__name__ == "VirtualDisk":
+                    disk_path = "%s/%s.vmdk" % (name, name)
+                    index = 1
+                    while self._file_exists(vm_util.build_datastore_path(
+                                                DATASTORE_NAME, disk_path)):
+                        disk_path = "%s/%s_%d.vmdk" % (name, name, index)
+                        index += 1
+                    file_name = vm_util.build_datastore_path(DATASTORE_NAME,
+                                                             disk_path)
+                    if linked:
+                        # A child disk, empty until written to
+                        self._create_disk_file(file_name, 0)
+                        parent = device.backing
+                        device.backing = copy.copy(parent)
+                        device.backing.parent = parent
+                    else:
+                        self._create_disk_file(file_name,
+                                               device.capacityInKB or 0)
+                        device.backing.parent = None
+                    device.backing.fileName = file_name
+                devices.append(device)
+
+            config = getattr(spec, "config", None)
+            self._apply_device_changes(name, devices,
+                                       getattr(config, "deviceChange", None))
+            clone = self._add_vm(name,
+                        getattr(config, "instanceUuid", None) or
+                        str(uuid.uuid4()),
+                        getattr(config, "numCPUs", None) or
+                        source_config.hardware.numCPU,
+                        getattr(config, "memoryMB", None) or
+                        source_config.hardware.memoryMB,
+                        getattr(spec, "powerOn", False) and "poweredOn" or
+                        "poweredOff",
+                        devices, target_folder, res_pool,
+                        source_config.guestId)
+            return clone.ref
+        return self._new_task("CloneVM_Task", vm, _clone)
+
+    def _set_power_state(self, vm, from_states, to_state):
+        runtime = vm.props["runtime"]
+        if runtime.powerState not in from_states:
+            raise SimulatorFault("InvalidPowerState", "The attempted "
+                                 "operation cannot be performed in the "
+                                 "current state (%s)." % runtime.powerState)
+        runtime.powerState = to_state
+        self._changed(vm)
+
+    def PowerOnVM_Task(self, vim_obj, _this, host=None):
+        vm = self._get(_this, "VirtualMachine")
+        return self._new_task("PowerOnVM_Task", vm,
+                lambda: self._set_power_state(vm, ["poweredOff", "suspended"],
+                                              "poweredOn"))
+
+    def PowerOffVM_Task(self, vim_obj, _this):
+        vm = self._get(_this, "VirtualMachine")
+        return self._new_task("PowerOffVM_Task", vm,
+                lambda: self._set_power_state(vm, ["poweredOn", "suspended"],
+                                              "poweredOff"))
+
+    def ResetVM_Task(self, vim_obj, _this):
+        vm = self._get(_this, "VirtualMachine")
+        return self._new_task("ResetVM_Task", vm,
+                lambda: self._set_power_state(vm, ["poweredOn"],
+                                              "poweredOn"))
+
+    def RebootGuest(self, vim_obj, _this):
+        vm = self._get(_this, "VirtualMachine")
+        if vm.props["summary"].guest.toolsRunningStatus != \
+                "guestToolsRunning":
+            raise SimulatorFault("ToolsUnavailable", "Cannot complete "
+                                 "operation because VMware Tools is not "
+                                 "running in this virtual machine.")
+        self._set_power_state(vm, ["poweredOn"], "poweredOn")
+
+    def UnregisterVM(self, vim_obj, _this):
+        vm = self._get(_this, "VirtualMachine")
+        if vm.props["runtime"].powerState != "poweredOff":
+            raise SimulatorFault("InvalidPowerState", "The attempted "
+                                 "operation cannot be performed in the "
+                                 "current state (%s)." %
+                                 vm.props["runtime"].powerState)
+        self._remove_vm(vm)
+
+    # Networking
+
+    def AddPortGroup(self, vim_obj, _this, portgrp=None):
+        self._get(_this, "HostNetworkSystem")
+        self._add_port_group(portgrp.name, portgrp.vlanId,
+                             portgrp.vswitchName)
@@ -0,0 +1,192 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+"""
+Waits for tasks with property collector updates instead of polling them.
+"""
+
+import logging
+
+import error_util
+import executor
+import trace
+import vim_util
+
+LOG = logging.getLogger()
+
+# Seconds a WaitForUpdatesEx call waits for task updates
+WAIT_TIMEOUT = 60
+
+TASK_PROPERTIES = ["info.state", "info.error", "info.result"]
+
+
+class TaskWatcher(object):
+    """
+    Wakes up the callers waiting for tasks as soon as the tasks complete.
+    Each task gets a filter on a property collector of the watcher, and a
+    single greenthread waits for the updates of all the filters with
+    WaitForUpdatesEx.
+    """
+
+    def __init__(self, login_func, logout_func, vim_func):
+        """
+        login_func  : Returns a new logged in VIM Object
+        logout_func : Logs out the VIM Object passed
+        vim_func    : Returns a new VIM Object, not logged in
+        """
+        self._login_func = login_func
+        self._logout_func = logout_func
+        self._vim_func = vim_func
+        # WaitForUpdatesEx blocks its connection, the filters are created
+        # and destroyed over a second connection of the same session.
+        self._vim = None
+        self._control_vim = None
+        self._collector = None
+        self._version = ""
+        # task MoRef value -> (event, property filter, {path: value})
+        self._waiters = {}
+        self._thread = None
+        self._lock = executor.get_backend().semaphore()
+
+    def wait(self, task_ref):
+        """
+        Waits for the task to complete and returns its result. Raises an
+        Exception with the task error if the task fails, and a
+        TaskWatcherException if the watcher could not follow the task.
+        """
+        done = executor.get_backend().event()
+        self._lock.acquire()
+        try:
+            try:
+                # Like the calls of the watcher greenthread, the calls made
+                # here depend on the tasks waited for by other callers
+                with trace.detached():
+                    property_filter = self._create_filter(task_ref)
+            except Exception, excep:
+                if not self._waiters:
+                    self._reset()
+                raise error_util.TaskWatcherException("Unable to watch "
+                                "task %s: " % task_ref.value, excep)
+            self._waiters[task_ref.value] = (done, property_filter, {})
+            if self._thread is None:
+                self._thread = executor.get_backend().spawn(self._run)
+        finally:
+            self._lock.release()
+        return done.wait()
+
+    def _create_filter(self, task_ref):
+        """Creates the filter of the task, connecting if needed."""
+        if self._collector is None:
+            self._connect()
+        collector = self._collector
+        client_factory = self._control_vim.client.factory
+        property_filter_spec = vim_util.build_property_filter_spec(
+                client_factory,
+                [vim_util.get_spec_cache(
+                        client_factory).get_property_spec("Task",
+                                                TASK_PROPERTIES)],
+                [vim_util.get_obj_spec(client_factory, task_ref)])
+        property_filter = self._control_vim.CreateFilter(collector,
+                                spec=property_filter_spec,
+                                partialUpdates=False)
+        if self._collector is not collector:
+            raise Exception("Task updates failed meanwhile")
+        return property_filter
+
+    def close(self):
+        """Logs out the session of the watcher."""
+        self._reset()
+
+    def _connect(self):
+        """Creates the session and property collector of the watcher."""
+        self._vim = self._login_func()
+        self._control_vim = self._vim_func()
+        self._control_vim.share_session(self._vim)
+        self._collector = self._vim.CreatePropertyCollector(
+                            self._vim.get_service_content().propertyCollector)
+        self._version = ""
+
+    def _run(self):
+        """Dispatches the task updates while tasks are waited for."""
+        try:
+            wait_options = None
+            while True:
+                self._lock.acquire()
+                try:
+                    if not self._waiters:
+                        self._thread = None
+                        return
+                    vim_obj = self._vim
+                    collector = self._collector
+                    version = self._version
+                finally:
+                    self._lock.release()
+                if wait_options is None:
+                    wait_options = vim_obj.client.factory.create(
+                                                        'ns0:WaitOptions')
+                    wait_options.maxWaitSeconds = WAIT_TIMEOUT
+                update_set = vim_obj.WaitForUpdatesEx(collector,
+                                                        version=version,
+                                                        options=wait_options)
+                if update_set:
+                    self._lock.acquire()
+                    try:
+                        self._version = update_set.version
+                        self._apply(update_set)
+                    finally:
+                        self._lock.release()
+        except Exception, excep:
+            LOG.warn("In vmwareapi:task_watcher:_run, got this exception: "
+                     "%s" % excep)
+            self._lock.acquire()
+            try:
+                waiters = self._waiters
+                self._thread = None
+                self._reset()
+            finally:
+                self._lock.release()
+            # The callers fall back to polling their tasks
+            for done, property_filter, info in waiters.values():
+                done.send_exception(error_util.TaskWatcherException(
+                                "Task updates failed: ", excep))
+
+    def _apply(self, update_set):
+        """Wakes up the callers of the tasks that have completed."""
+        for filter_update in getattr(update_set, "filterSet", []):
+            for object_update in getattr(filter_update, "objectSet", []):
+                waiter = self._waiters.get(object_update.obj.value)
+                if waiter is None:
+                    continue
+                done, property_filter, info = waiter
+                for change in getattr(object_update, "changeSet", []):
+                    info[change.name] = getattr(change, "val", None)
+                state = info.get("info.state")
+                if state not in ["success", "error"]:
+                    continue
+                del self._waiters[object_update.obj.value]
+                if state == "success":
+                    done.send(info.get("info.result"))
+                else:
+                    error_info = str(getattr(info.get("info.error"),
+                                             "localizedMessage", ""))
+                    LOG.warn("Task %s status: error %s" %
+                             (object_update.obj.value, error_info))
+                    done.send_exception(Exception(error_info))
+                self._destroy_filter(property_filter)
+
+    def _destroy_filter(self, property_filter):
+        """Destroys the filter of a completed task."""
+        try:
+            self._control_vim.DestroyPropertyFilter(property_filter)
+        except Exception, excep:
+            LOG.debug(excep)
+
+    def _reset(self):
+        """Drops the session and the filters of the watcher."""
+        vim_obj = self._vim
+        self._vim = None
+        self._control_vim = None
+        self._collector = None
+        self._version = ""
+        self._waiters = {}
+        if vim_obj is not None:
+            self._logout_func(vim_obj)
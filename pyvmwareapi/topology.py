@@ -0,0 +1,115 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+"""
+Cache of the references of the host topology: datacenter, VM folder,
+resource pool, host system and cluster.
+"""
+
+import time
+
+import vim_util
+
+# Seconds the references are kept for
+TOPOLOGY_TTL = 300.0
+
+
+class TopologyCache(object):
+    """
+    Keeps the references that almost never change, so that they are not
+    looked up with a full inventory traversal by every operation.
+    References older than ttl are looked up again; invalidate drops them
+    at once, e.g. after the inventory was reorganized.
+    """
+
+    def __init__(self, session, ttl=TOPOLOGY_TTL):
+        self._session = session
+        self._ttl = ttl
+        # key -> (time of the lookup, value)
+        self._entries = {}
+
+    def invalidate(self):
+        """Drops all the cached references."""
+        self._entries = {}
+
+    def get_datacenter_ref_and_name(self):
+        """Get the datacenter name and the reference."""
+        return self._get(("datacenter",), self._lookup_datacenter_ref_and_name)
+
+    def get_vmfolder_ref(self):
+        """Get the Vm folder ref from the datacenter."""
+        return self._get(("vmfolder",), self._lookup_vmfolder_ref)
+
+    def get_res_pool_ref(self, cluster=None):
+        """Get the resource pool of the host, or of the cluster specified."""
+        return self._get(("res_pool", self._key_of(cluster)),
+                         self._lookup_res_pool_ref, cluster)
+
+    def get_host_ref(self, cluster=None):
+        """Get reference to a host within the cluster specified."""
+        return self._get(("host", self._key_of(cluster)),
+                         self._lookup_host_ref, cluster)
+
+    def get_cluster_ref(self, cluster_name):
+        """Get reference to the cluster with the name specified."""
+        return self._get(("cluster", cluster_name),
+                         self._lookup_cluster_ref, cluster_name)
+
+    def _get(self, key, lookup_func, *args):
+        """Gets the cached value of key, looking it up if needed."""
+        entry = self._entries.get(key)
+        if entry is not None and time.time() - entry[0] < self._ttl:
+            return entry[1]
+        value = lookup_func(*args)
+        # Missing objects may show up later, they are not cached
+        if value is not None:
+            self._entries[key] = (time.time(), value)
+        return value
+
+    def _key_of(self, mobj):
+        if mobj is None:
+            return None
+        return mobj.value
+
+    def _lookup_datacenter_ref_and_name(self):
+        dc_obj = self._session._call_method(vim_util, "get_objects",
+                "Datacenter", ["name"])
+        return dc_obj[0].obj, dc_obj[0].propSet[0].val
+
+    def _lookup_vmfolder_ref(self):
+        dc_objs = self._session._call_method(vim_util, "get_objects",
+                                             "Datacenter", ["vmFolder"])
+        # There is only one default datacenter in a standalone ESX host
+        return dc_objs[0].propSet[0].val
+
+    def _lookup_res_pool_ref(self, cluster):
+        # Get the resource pool. Taking the first resource pool coming our
+        # way. Assuming that is the default resource pool.
+        if cluster is None:
+            return self._session._call_method(vim_util, "get_objects",
+                                              "ResourcePool")[0].obj
+        return self._session._call_method(vim_util, "get_dynamic_property",
+                                          cluster, "ClusterComputeResource",
+                                          "resourcePool")
+
+    def _lookup_host_ref(self, cluster):
+        if cluster is None:
+            return self._session._call_method(vim_util, "get_objects",
+                                              "HostSystem")[0].obj
+        host_ret = self._session._call_method(vim_util,
+                                              "get_dynamic_property",
+                                              cluster,
+                                              "ClusterComputeResource",
+                                              "host")
+        if host_ret is None:
+            return
+        if not host_ret.ManagedObjectReference:
+            return
+        return host_ret.ManagedObjectReference[0]
+
+    def _lookup_cluster_ref(self, cluster_name):
+        cls = self._session._call_method(vim_util, "get_objects",
+                                         "ClusterComputeResource", ["name"])
+        for cluster in cls:
+            if cluster.propSet[0].val == cluster_name:
+                return cluster.obj
+        return None
@@ -0,0 +1,286 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+"""
+Timing of the phases of the VM operations. A span covers a phase: its
+start and end, duration, the task it waited for and the number of SOAP
+calls made during it. Ended spans go to the sink set here, e.g.
+
+    trace.set_sink(trace.JsonLinesSink("/var/log/pyvmwareapi.trace"))
+
+Without a sink, spans cost next to nothing.
+
+The SOAP calls made within a block can also be counted by method, and
+held to a budget, e.g. in a test:
+
+    with trace.count_calls(15, RetrievePropertiesEx=4) as counter:
+        conn.spawn(instance, disk_size, network_info)
+
+The calls of the task watcher, which serve all the tasks waited for at
+once, are left out of the spans and counters. Tasks polled instead, when
+the watcher is off or fails, count their polls.
+"""
+
+import contextlib
+import itertools
+import json
+import threading
+import time
+
+import error_util
+import executor
+
+# The sink of the ended spans, None when tracing is off
+_SINK = None
+
+# Spans and call counters opened by the current greenthread or thread
+_LOCAL = None
+
+# Call counters open in the process
+_COUNTING = 0
+_COUNTING_LOCK = threading.Lock()
+
+_IDS = itertools.count(1)
+
+
+class Span(object):
+    """A phase of an operation."""
+
+    def __init__(self, name, parent, attributes):
+        self.id = _IDS.next()
+        self.name = name
+        self.parent = parent
+        self.attributes = attributes
+        self.start = time.time()
+        self.end = None
+        self.soap_calls = 0
+        self.error = None
+        # Work bound to the span may record from other threads
+        self._lock = threading.Lock()
+
+    def record_call(self):
+        self._lock.acquire()
+        try:
+            self.soap_calls += 1
+        finally:
+            self._lock.release()
+
+    def set(self, **attributes):
+        """Sets attributes of the span, e.g. task."""
+        self.attributes.update(attributes)
+
+    def to_dict(self):
+        span_dict = {'id': self.id,
+                     'name': self.name,
+                     'parent': self.parent and self.parent.id,
+                     'start': self.start,
+                     'end': self.end,
+                     'duration': self.end - self.start,
+                     'soap_calls': self.soap_calls,
+                     'error': self.error}
+        span_dict.update(self.attributes)
+        return span_dict
+
+
+class CallCounter(object):
+    """
+    The SOAP calls made within a count_calls block: counts by method
+    name and total.
+    """
+
+    def __init__(self, budget=None, method_budgets=None):
+        self.counts = {}
+        self.total = 0
+        self.budget = budget
+        self.method_budgets = method_budgets or {}
+        # Work bound to the block may record from other threads
+        self._lock = threading.Lock()
+
+    def record(self, method):
+        self._lock.acquire()
+        try:
+            self.counts[method] = self.counts.get(method, 0) + 1
+            self.total += 1
+        finally:
+            self._lock.release()
+
+    def check(self):
+        """Raises CallBudgetExceeded if the calls went over budget."""
+        excesses = []
+        if self.budget is not None and self.total > self.budget:
+            excesses.append("%d calls, budget %d" % (self.total,
+                                                     self.budget))
+        for method, budget in sorted(self.method_budgets.items()):
+            if self.counts.get(method, 0) > budget:
+                excesses.append("%d %s calls, budget %d" % (
+                                self.counts[method], method, budget))
+        if excesses:
+            raise error_util.CallBudgetExceeded("%s (calls made: %s)" % (
+                                    ", ".join(excesses), self.counts))
+
+
+class JsonLinesSink(object):
+    """Writes the spans to a file, one JSON object per line."""
+
+    def __init__(self, path_or_file):
+        if isinstance(path_or_file, basestring):
+            path_or_file = open(path_or_file, "a")
+        self._file = path_or_file
+        self._lock = threading.Lock()
+
+    def emit(self, span_dict):
+        line = json.dumps(span_dict, sort_keys=True) + "\n"
+        self._lock.acquire()
+        try:
+            self._file.write(line)
+            self._file.flush()
+        finally:
+            self._lock.release()
+
+
+class ListSink(object):
+    """Keeps the spans in memory, in the spans list."""
+
+    def __init__(self):
+        self.spans = []
+
+    def emit(self, span_dict):
+        self.spans.append(span_dict)
+
+
+def set_sink(sink):
+    """
+    Sets the sink of the ended spans, an object with emit(span_dict).
+    None turns tracing off.
+    """
+    global _SINK
+    _SINK = sink
+
+
+def _get_stack(name="spans"):
+    """
+    Gets the spans, or the call counters with name "counters", open in
+    the current greenthread or thread.
+    """
+    global _LOCAL
+    if _LOCAL is None:
+        _LOCAL = executor.get_backend().local()
+    stack = getattr(_LOCAL, name, None)
+    if stack is None:
+        stack = []
+        setattr(_LOCAL, name, stack)
+    return stack
+
+
+@contextlib.contextmanager
+def span(name, **attributes):
+    """Times the block it wraps as a span, nested in the open span."""
+    sink = _SINK
+    if sink is None:
+        yield None
+        return
+    stack = _get_stack()
+    current = Span(name, stack and stack[-1] or None, attributes)
+    stack.append(current)
+    try:
+        yield current
+    except Exception, excep:
+        current.error = str(excep)
+        raise
+    finally:
+        stack.remove(current)
+        current.end = time.time()
+        sink.emit(current.to_dict())
+
+
+def annotate(**attributes):
+    """Sets attributes of the innermost open span."""
+    if _SINK is None:
+        return
+    stack = _get_stack()
+    if stack:
+        stack[-1].set(**attributes)
+
+
+def _set_counting(delta):
+    global _COUNTING
+    _COUNTING_LOCK.acquire()
+    try:
+        _COUNTING += delta
+    finally:
+        _COUNTING_LOCK.release()
+
+
+@contextlib.contextmanager
+def count_calls(budget=None, **method_budgets):
+    """
+    Counts the SOAP calls made within the block, by the current
+    greenthread or thread and the work it binds. At the end of the
+    block, raises CallBudgetExceeded if more than budget calls were
+    made, or more calls of a method than its keyword argument allows.
+    """
+    stack = _get_stack("counters")
+    counter = CallCounter(budget, method_budgets)
+    stack.append(counter)
+    _set_counting(1)
+    try:
+        yield counter
+    finally:
+        _set_counting(-1)
+        stack.remove(counter)
+    counter.check()
+
+
+def record_call(method):
+    """Counts a SOAP call of the method in the open spans and counters."""
+    if _SINK is not None:
+        for open_span in _get_stack():
+            open_span.record_call()
+    if _COUNTING:
+        for counter in _get_stack("counters"):
+            counter.record(method)
+
+
+@contextlib.contextmanager
+def detached():
+    """
+    Runs the block outside of the open spans and call counters, e.g. the
+    calls of machinery shared by several operations.
+    """
+    if _SINK is None and not _COUNTING:
+        yield
+        return
+    saved = []
+    for name in ["spans", "counters"]:
+        stack = _get_stack(name)
+        saved.append((stack, stack[:]))
+        del stack[:]
+    try:
+        yield
+    finally:
+        for stack, items in saved:
+            stack[:] = items
+
+
+def bind(func):
+    """
+    Wraps func so that it runs within the spans and call counters open
+    now, wherever it is called from, e.g. a task poll run by a looping
+    call.
+    """
+    if _SINK is None and not _COUNTING:
+        return func
+    bound = [(name, list(_get_stack(name)))
+             for name in ["spans", "counters"]]
+
+    def _bound(*args, **kwargs):
+        saved = []
+        for name, opened in bound:
+            stack = _get_stack(name)
+            saved.append((stack, stack[:]))
+            stack[:] = opened
+        try:
+            return func(*args, **kwargs)
+        finally:
+            for stack, items in saved:
+                stack[:] = items
+    return _bound
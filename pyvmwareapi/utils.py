@@ -3,9 +3,8 @@
 """Utilities and helper functions."""
 
 import sys
-from eventlet import event
-from eventlet.green import subprocess
-from eventlet import greenthread
+
+import executor
 
 
 class LoopingCallDone(Exception):
@@ -45,18 +44,19 @@ class FixedIntervalLoopingCall(LoopingCallBase):
 
     def start(self, interval, initial_delay=None):
         self._running = True
-        done = event.Event()
+        backend = executor.get_backend()
+        done = backend.event()
 
         def _inner():
             if initial_delay:
-                greenthread.sleep(initial_delay)
+                backend.sleep(initial_delay)
 
             try:
                 while self._running:
                     self.f(*self.args, **self.kw)
                     if not self._running:
                         break
-                    greenthread.sleep(interval)
+                    backend.sleep(interval)
             except LoopingCallDone, e:
                 self.stop()
                 done.send(e.retvalue)
@@ -68,6 +68,6 @@ class FixedIntervalLoopingCall(LoopingCallBase):
 
         self.done = done
 
-        greenthread.spawn(_inner)
+        backend.spawn(_inner)
         return self.done
 
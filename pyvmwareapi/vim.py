@@ -4,11 +4,22 @@
 Classes for making VMware VI SOAP calls.
 """
 
+import hashlib
 import httplib
+import logging
+import os
+import tempfile
+import time
+
 import error_util
+import executor
+import metrics
+import trace
 
 try:
     import suds
+    import suds.client
+    import suds.transport.https
 except ImportError:
     suds = None
 
@@ -16,11 +27,33 @@ RESP_NOT_XML_ERROR = 'Response is "text/html", not "text/xml"'
 CONN_ABORT_ERROR = 'Software caused connection abort'
 ADDRESS_IN_USE_ERROR = 'Address already in use'
 
+# Parsed WSDL/schema objects are pickled under this directory, in one
+# sub-directory per host API version.
+WSDL_CACHE_DIR = os.path.join(tempfile.gettempdir(), 'pyvmwareapi-wsdl')
+
+LOG = logging.getLogger()
+
+# The faults returned by the host, none without suds, e.g. for the VIM
+# Objects of the simulator
+_WEB_FAULTS = suds and (suds.WebFault,) or ()
+
+# suds clients already built in this process, keyed by the WSDL location
+# and the API version key. VIM Objects get their own clone of these.
+_CLIENTS = {}
+# API version keys already computed in this process, keyed by the host
+# and the WSDL location, so that the host versions are fetched once.
+_VERSION_KEYS = {}
+
 
 if suds:
 
     class VIMMessagePlugin(suds.plugin.MessagePlugin):
 
+        def __init__(self):
+            # Sizes of the messages of the last call, for the metrics
+            self.request_bytes = 0
+            self.response_bytes = 0
+
         def addAttributeForValue(self, node):
             # suds does not handle AnyType properly.
             # VI SDK requires type attribute to be set when AnyType is used
@@ -38,38 +71,192 @@ if suds:
             context.envelope.prune()
             context.envelope.walk(self.addAttributeForValue)
 
+        def sending(self, context):
+            self.request_bytes = len(context.envelope)
+
+        def received(self, context):
+            self.response_bytes = len(context.reply)
+
+    class GreenHttpsTransport(suds.transport.https.HttpAuthenticated):
+        """
+        HTTP(S) transport whose connections wait on the network without
+        blocking the other greenthreads, with no monkey patching of the
+        process.
+        """
+
+        def u2handlers(self):
+            green_urllib2 = _get_green_urllib2()
+            return [green_urllib2.ProxyHandler(self.proxy),
+                    green_urllib2.HTTPBasicAuthHandler(self.pm)]
+
+        def u2opener(self):
+            if self.urlopener is None:
+                return _get_green_urllib2().build_opener(*self.u2handlers())
+            return self.urlopener
+
+
+def get_transport_factory():
+    """
+    Gets the default transport factory of the VIM Objects: the green
+    transport with the eventlet backend, so that a call waiting on the
+    network, e.g. the long WaitForUpdatesEx of the task watcher, does not
+    block the other greenthreads, else the suds HTTPS transport.
+    """
+    if executor.get_backend().name == "eventlet":
+        return GreenHttpsTransport
+    return suds.transport.https.HttpAuthenticated
+
+
+def _get_green_urllib2():
+    """
+    Gets the urllib2 of eventlet. It is imported on first use, so that
+    the processes not using eventlet do not import it.
+    """
+    try:
+        from eventlet.green import urllib2
+    except ImportError:
+        raise Exception("Unable to import eventlet.")
+    return urllib2
+
 
 class Vim:
     """The VIM Object."""
 
     def __init__(self,
                  protocol="https",
-                 host="localhost"):
+                 host="localhost",
+                 wsdl_loc=None,
+                 cache_dir=None,
+                 transport_factory=None):
         """
         Creates the necessary Communication interfaces and gets the
         ServiceContent for initiating SOAP transactions.
 
-        protocol: http or https
-        host    : ESX IPAddress[:port] or ESX Hostname[:port]
+        protocol  : http or https
+        host      : ESX IPAddress[:port] or ESX Hostname[:port]
+        wsdl_loc  : WSDL location, e.g. file:///path/to/vimService.wsdl.
+                    Defaults to the WSDL served by the host.
+        cache_dir : Directory of the on-disk WSDL/schema cache
+        transport_factory : Returns a new suds transport for the VIM
+                    Object. Defaults to get_transport_factory().
         """
         if not suds:
             raise Exception("Unable to import suds.")
 
         self._protocol = protocol
         self._host_name = host
-        wsdl_url = 'https://%s/sdk/vimService.wsdl' % self._host_name 
+        self._transport_factory = (transport_factory or
+                                   get_transport_factory())
+        if wsdl_loc is None:
+            wsdl_loc = 'https://%s/sdk/vimService.wsdl' % self._host_name
         url = '%s://%s/sdk' % (self._protocol, self._host_name)
-        self.client = suds.client.Client(wsdl_url, location=url,
-                            plugins=[VIMMessagePlugin()])
+        self.client = self._get_client(wsdl_loc, url,
+                                       cache_dir or WSDL_CACHE_DIR)
         self._service_content = self.RetrieveServiceContent("ServiceInstance")
 
+    def _get_client(self, wsdl_loc, url, cache_dir):
+        """
+        Gets a suds client for the WSDL. The parsed schema is shared with
+        the other clients of this process and cached on disk, keyed by
+        the API version of the host.
+        """
+        version_key = self._get_api_version_key(wsdl_loc)
+        client = _CLIENTS.get((wsdl_loc, version_key))
+        if client is None:
+            cache = suds.cache.ObjectCache(
+                        location=os.path.join(cache_dir, version_key))
+            # Caching policy 1 pickles the parsed WSDL and schema, not
+            # only the documents, so a new process does not parse them
+            client = suds.client.Client(wsdl_loc, cache=cache,
+                                        cachingpolicy=1,
+                                        plugins=[VIMMessagePlugin()],
+                                        transport=self._transport_factory())
+            _CLIENTS[(wsdl_loc, version_key)] = client
+        client = client.clone()
+        # A plugin of its own, as it holds the sizes of the last call
+        self._plugin = VIMMessagePlugin()
+        client.set_options(location=url,
+                           transport=self._transport_factory(),
+                           plugins=[self._plugin])
+        return client
+
+    def _get_api_version_key(self, wsdl_loc):
+        """
+        Gets the key identifying the API version described by the WSDL,
+        so that the schema cached for a host is dropped on its upgrade.
+        The key is computed once per process for the host and the WSDL.
+        """
+        version_key = _VERSION_KEYS.get((self._host_name, wsdl_loc))
+        if version_key is not None:
+            return version_key
+        digest = hashlib.sha1(wsdl_loc)
+        if wsdl_loc.startswith('file://'):
+            stat = os.stat(wsdl_loc[len('file://'):])
+            digest.update("%d:%d" % (stat.st_size, stat.st_mtime))
+        else:
+            versions_url = '%s://%s/sdk/vimServiceVersions.xml' % (
+                                        self._protocol, self._host_name)
+            try:
+                transport = self._transport_factory()
+                versions = transport.open(
+                                suds.transport.Request(versions_url))
+                digest.update(versions.read())
+            except Exception, excep:
+                # Old hosts do not publish their versions. The schema is
+                # then cached by its location only.
+                LOG.debug("Unable to get %s: %s" % (versions_url, excep))
+        version_key = digest.hexdigest()
+        _VERSION_KEYS[(self._host_name, wsdl_loc)] = version_key
+        return version_key
+
     def get_service_content(self):
         """Gets the service content object."""
         return self._service_content
 
+    def share_session(self, other):
+        """
+        Makes the calls of this VIM Object use the session of the other
+        VIM Object, over a connection of its own.
+        """
+        self.client.options.transport.cookiejar = (
+                                    other.client.options.transport.cookiejar)
+
     def __getattr__(self, attr_name):
         """Makes the API calls and gets the result."""
         def vim_request_handler(managed_object, **kwargs):
+            """
+            Makes the API call, recording its metrics.
+
+            managed_object    : Managed Object Reference or Managed
+                                Object Name
+            **kwargs          : Keyword arguments of the call
+            """
+            trace.record_call(attr_name)
+            enabled = metrics.REGISTRY.enabled
+            if enabled:
+                self._plugin.request_bytes = 0
+                self._plugin.response_bytes = 0
+            faults = None
+            start = time.time()
+            try:
+                return vim_request(managed_object, **kwargs)
+            except Exception, excep:
+                # The retries of the call are recorded for the SOAP method
+                excep.soap_method = attr_name
+                if isinstance(excep, error_util.VimFaultException):
+                    faults = excep.fault_list
+                else:
+                    faults = [excep.__class__.__name__]
+                raise
+            finally:
+                if enabled:
+                    metrics.REGISTRY.record_call(attr_name,
+                                                 time.time() - start,
+                                                 self._plugin.request_bytes,
+                                                 self._plugin.response_bytes,
+                                                 faults)
+
+        def vim_request(managed_object, **kwargs):
             """
             Builds the SOAP message and parses the response for fault
             checking and other errors.
@@ -97,7 +284,7 @@ class Vim:
             # check of the SOAP response
             except error_util.VimFaultException, excep:
                 raise
-            except suds.WebFault, excep:
+            except _WEB_FAULTS, excep:
                 doc = excep.document
                 detail = doc.childAtPath("/Envelope/Body/Fault/detail")
                 fault_list = []
@@ -4,6 +4,12 @@
 The VMware API utility module.
 """
 
+import weakref
+
+# Number of objects per page of the paged retrievals. The lists are
+# retrieved in pages sized by the server.
+MAX_OBJECTS = 1000
+
 
 def build_selection_spec(client_factory, name):
     """Builds the selection spec."""
@@ -110,6 +116,157 @@ def build_property_filter_spec(client_factory, property_specs, object_specs):
     return property_filter_spec
 
 
+class SpecCache(object):
+    """
+    Specs built once per client factory and reused by every call. Creating
+    suds objects from the schema is expensive, while the recursive
+    traversal spec and most property specs never change. The cached specs
+    are shared, they are made read-only so that callers cannot modify
+    them.
+    """
+
+    def __init__(self, client_factory):
+        # The cache lives as long as the client factory, not longer
+        self._client_factory = weakref.proxy(client_factory)
+        self._traversal_spec = None
+        self._host_network_traversal_spec = None
+        # (type, pathSet, all) -> PropertySpec
+        self._property_specs = {}
+        # (root MoRef value, type, pathSet, all) -> PropertyFilterSpec
+        self._filter_specs = {}
+
+    def get_recursive_traversal_spec(self):
+        """Gets the Recursive Traversal Spec."""
+        if self._traversal_spec is None:
+            self._traversal_spec = freeze_spec(
+                        build_recursive_traversal_spec(self._client_factory))
+        return self._traversal_spec
+
+    def get_host_network_traversal_spec(self):
+        """
+        Gets the Traversal Spec selecting, from the root folder, the hosts
+        and their networks.
+        """
+        if self._host_network_traversal_spec is None:
+            client_factory = self._client_factory
+            visit_folders_select_spec = build_selection_spec(client_factory,
+                                                    "host_network_folders")
+            h_to_network = build_traversal_spec(client_factory,
+                                    "h_to_network", "HostSystem", "network",
+                                    False, [])
+            cr_to_h = build_traversal_spec(client_factory, "cr_to_h_network",
+                                    "ComputeResource", "host", False,
+                                    [h_to_network])
+            dc_to_hf = build_traversal_spec(client_factory,
+                                    "dc_to_hf_network", "Datacenter",
+                                    "hostFolder", False,
+                                    [visit_folders_select_spec])
+            self._host_network_traversal_spec = freeze_spec(
+                    build_traversal_spec(client_factory,
+                                         "host_network_folders", "Folder",
+                                         "childEntity", False,
+                                         [visit_folders_select_spec,
+                                          dc_to_hf, cr_to_h]))
+        return self._host_network_traversal_spec
+
+    def get_property_spec(self, type, properties_to_collect=None,
+                          all_properties=False):
+        """Gets the Property Spec for the type and properties given."""
+        if not properties_to_collect:
+            properties_to_collect = ["name"]
+        key = (type, tuple(properties_to_collect), all_properties)
+        property_spec = self._property_specs.get(key)
+        if property_spec is None:
+            property_spec = build_property_spec(self._client_factory, type,
+                                                list(properties_to_collect),
+                                                all_properties)
+            self._property_specs[key] = freeze_spec(property_spec)
+        return property_spec
+
+    def get_objects_filter_spec(self, root_folder, type,
+                                properties_to_collect=None,
+                                all_properties=False):
+        """
+        Gets the Property Filter Spec selecting the objects of the type
+        given under root_folder.
+        """
+        if not properties_to_collect:
+            properties_to_collect = ["name"]
+        key = (root_folder.value, type, tuple(properties_to_collect),
+               all_properties)
+        property_filter_spec = self._filter_specs.get(key)
+        if property_filter_spec is None:
+            object_spec = build_object_spec(self._client_factory,
+                                root_folder,
+                                [self.get_recursive_traversal_spec()])
+            property_filter_spec = build_property_filter_spec(
+                                self._client_factory,
+                                [self.get_property_spec(type,
+                                                properties_to_collect,
+                                                all_properties)],
+                                [object_spec])
+            self._filter_specs[key] = freeze_spec(property_filter_spec)
+        return property_filter_spec
+
+
+# client factory -> SpecCache
+_SPEC_CACHES = weakref.WeakKeyDictionary()
+# spec class -> its read-only subclass
+_FROZEN_CLASSES = {}
+
+
+def _read_only_setattr(self, name, value):
+    if name.startswith('__') and name.endswith('__'):
+        # The suds bookkeeping, not the data of the spec
+        super(self.__class__, self).__setattr__(name, value)
+        return
+    raise TypeError("%s is a cached spec shared by every call, it cannot "
+                    "be modified" % self.__class__.__name__)
+
+
+def _read_only_delattr(self, name):
+    raise TypeError("%s is a cached spec shared by every call, it cannot "
+                    "be modified" % self.__class__.__name__)
+
+
+def freeze_spec(spec):
+    """
+    Makes a spec read-only, along with the specs it holds: its attributes
+    can no longer be set and its arrays become tuples, so that no caller
+    modifies a cached spec shared with every other call. Returns it.
+    """
+    if spec.__class__ in _FROZEN_CLASSES.values():
+        return spec
+    for name, value in spec.__dict__.items():
+        if name.startswith('__') and name.endswith('__'):
+            continue
+        if isinstance(value, list):
+            value = tuple(value)
+            spec.__dict__[name] = value
+        items = isinstance(value, tuple) and value or (value,)
+        for item in items:
+            if item.__class__.__name__.endswith("Spec"):
+                freeze_spec(item)
+    frozen_class = _FROZEN_CLASSES.get(spec.__class__)
+    if frozen_class is None:
+        frozen_class = type(spec.__class__.__name__, (spec.__class__,),
+                            {'__setattr__': _read_only_setattr,
+                             '__delattr__': _read_only_delattr})
+        _FROZEN_CLASSES[spec.__class__] = frozen_class
+    # Not through the __setattr__ of suds, which keeps dunders in __dict__
+    object.__setattr__(spec, '__class__', frozen_class)
+    return spec
+
+
+def get_spec_cache(client_factory):
+    """Gets the spec cache of the client factory."""
+    spec_cache = _SPEC_CACHES.get(client_factory)
+    if spec_cache is None:
+        spec_cache = SpecCache(client_factory)
+        _SPEC_CACHES[client_factory] = spec_cache
+    return spec_cache
+
+
 def get_object_properties(vim, collector, mobj, type, properties):
     """Gets the properties of the Managed object specified."""
     client_factory = vim.client.factory
@@ -118,16 +275,12 @@ def get_object_properties(vim, collector, mobj, type, properties):
     usecoll = collector
     if usecoll is None:
         usecoll = vim.get_service_content().propertyCollector
-    property_filter_spec = client_factory.create('ns0:PropertyFilterSpec')
-    property_spec = client_factory.create('ns0:PropertySpec')
-    property_spec.all = (properties is None or len(properties) == 0)
-    property_spec.pathSet = properties
-    property_spec.type = type
-    object_spec = client_factory.create('ns0:ObjectSpec')
-    object_spec.obj = mobj
-    object_spec.skip = False
-    property_filter_spec.propSet = [property_spec]
-    property_filter_spec.objectSet = [object_spec]
+    property_spec = get_spec_cache(client_factory).get_property_spec(type,
+                            properties,
+                            properties is None or len(properties) == 0)
+    property_filter_spec = get_prop_filter_spec(client_factory,
+                            [get_obj_spec(client_factory, mobj)],
+                            [property_spec])
     return vim.RetrieveProperties(usecoll, specSet=[property_filter_spec])
 
 
@@ -142,23 +295,103 @@ def get_dynamic_property(vim, mobj, type, property_name):
     return property_value
 
 
-def get_objects(vim, type, properties_to_collect=None, all=False):
-    """Gets the list of objects of the type specified."""
+def build_retrieve_options(client_factory, max_objects=None):
+    """
+    Builds the RetrievePropertiesEx options. Without max_objects, the
+    server sizes the pages.
+    """
+    retrieve_options = client_factory.create('ns0:RetrieveOptions')
+    if max_objects is not None:
+        retrieve_options.maxObjects = max_objects
+    return retrieve_options
+
+
+def retrieve_properties_page(vim, property_filter_spec,
+                             max_objects=MAX_OBJECTS):
+    """
+    Retrieves the first page of the objects selected by the property
+    filter spec with RetrievePropertiesEx. The token of the result, if
+    any, continues the retrieval on the session of the VIM Object.
+    """
+    collector = vim.get_service_content().propertyCollector
+    return vim.RetrievePropertiesEx(collector,
+                    specSet=[property_filter_spec],
+                    options=build_retrieve_options(vim.client.factory,
+                                                   max_objects))
+
+
+def continue_retrieve_properties(vim, token):
+    """Retrieves the next page of a retrieval."""
+    return vim.ContinuePropertiesEx(
+                    vim.get_service_content().propertyCollector, token=token)
+
+
+def cancel_retrieve_properties(vim, token):
+    """Drops the pages left of a retrieval."""
+    vim.CancelRetrievePropertiesEx(
+                    vim.get_service_content().propertyCollector, token=token)
+
+
+def retrieve_properties_iter(vim, property_filter_spec, max_objects=None):
+    """
+    Retrieves the objects selected by the property filter spec with
+    RetrievePropertiesEx, and yields them page by page as the pages
+    arrive. Abandoning the iteration cancels the retrieval. The VIM
+    Object is used by every page, the iteration is not to be spread
+    over the calls of a session pool.
+    """
+    collector = vim.get_service_content().propertyCollector
+    result = retrieve_properties_page(vim, property_filter_spec,
+                                      max_objects)
+    token = None
+    try:
+        while result:
+            token = getattr(result, "token", None)
+            for obj_content in result.objects:
+                yield obj_content
+            if not token:
+                break
+            result = vim.ContinuePropertiesEx(collector, token=token)
+            token = None
+    finally:
+        if token:
+            try:
+                vim.CancelRetrievePropertiesEx(collector, token=token)
+            except Exception:
+                # The server drops the result after a while anyway
+                pass
+
+
+def get_properties_for_filter_spec(vim, property_filter_spec):
+    """Gets the objects selected by the property filter spec."""
+    return list(retrieve_properties_iter(vim, property_filter_spec))
+
+
+def _get_objects_filter_spec(vim, type, properties_to_collect, all):
+    """Gets the filter spec of the objects of the type specified."""
     if not properties_to_collect:
         properties_to_collect = ["name"]
+    return get_spec_cache(vim.client.factory).get_objects_filter_spec(
+                                vim.get_service_content().rootFolder,
+                                type, properties_to_collect, all)
 
-    client_factory = vim.client.factory
-    object_spec = build_object_spec(client_factory,
-                        vim.get_service_content().rootFolder,
-                        [build_recursive_traversal_spec(client_factory)])
-    property_spec = build_property_spec(client_factory, type=type,
-                                properties_to_collect=properties_to_collect,
-                                all_properties=all)
-    property_filter_spec = build_property_filter_spec(client_factory,
-                                [property_spec],
-                                [object_spec])
-    return vim.RetrieveProperties(vim.get_service_content().propertyCollector,
-                                specSet=[property_filter_spec])
+
+def get_objects_page(vim, type, properties_to_collect=None, all=False,
+                     max_objects=MAX_OBJECTS):
+    """
+    Gets the first page of the objects of the type specified, see
+    retrieve_properties_page.
+    """
+    return retrieve_properties_page(vim, _get_objects_filter_spec(vim,
+                                        type, properties_to_collect, all),
+                                    max_objects)
+
+
+def get_objects(vim, type, properties_to_collect=None, all=False):
+    """Gets the list of objects of the type specified."""
+    return list(retrieve_properties_iter(vim, _get_objects_filter_spec(vim,
+                                            type, properties_to_collect,
+                                            all)))
 
 
 def get_prop_spec(client_factory, spec_type, properties):
@@ -196,11 +429,34 @@ def get_properties_for_a_collection_of_objects(vim, type,
     client_factory = vim.client.factory
     if len(obj_list) == 0:
         return []
-    prop_spec = get_prop_spec(client_factory, type, properties)
+    prop_spec = get_spec_cache(client_factory).get_property_spec(type,
+                                                                 properties)
     lst_obj_specs = []
     for obj in obj_list:
         lst_obj_specs.append(get_obj_spec(client_factory, obj))
     prop_filter_spec = get_prop_filter_spec(client_factory,
                                             lst_obj_specs, [prop_spec])
-    return vim.RetrieveProperties(vim.get_service_content().propertyCollector,
-                                   specSet=[prop_filter_spec])
+    return list(retrieve_properties_iter(vim, prop_filter_spec))
+
+
+def get_properties_for_a_collection_of_objects_by_type(vim, obj_list,
+                                                       type_properties):
+    """
+    Gets the properties for the collection of objects, with the
+    properties to collect given per object type, e.g.
+    {"Network": ["name"]}. An object gets the properties of all the
+    types it is an instance of.
+    """
+    client_factory = vim.client.factory
+    if len(obj_list) == 0:
+        return []
+    spec_cache = get_spec_cache(client_factory)
+    lst_prop_specs = []
+    for type, properties in type_properties.items():
+        lst_prop_specs.append(spec_cache.get_property_spec(type, properties))
+    lst_obj_specs = []
+    for obj in obj_list:
+        lst_obj_specs.append(get_obj_spec(client_factory, obj))
+    prop_filter_spec = get_prop_filter_spec(client_factory,
+                                            lst_obj_specs, lst_prop_specs)
+    return list(retrieve_properties_iter(vim, prop_filter_spec))
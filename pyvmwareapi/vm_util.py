@@ -7,6 +7,11 @@ The VMware API VM utility module to build SOAP object specs.
 import copy
 import vim_util
 
+# Types of the network adapters of a VM
+ETHERNET_CARD_TYPES = ["VirtualPCNet32", "VirtualE1000", "VirtualE1000e",
+                       "VirtualVmxnet", "VirtualVmxnet2", "VirtualVmxnet3",
+                       "VirtualSriovEthernetCard"]
+
 
 def build_datastore_path(datastore_name, path):
     """Build the datastore compliant path."""
@@ -28,11 +33,17 @@ def split_datastore_path(datastore_path):
 
 
 def get_vm_create_spec(client_factory, instance, data_store_name,
-                       vif_infos, os_type="otherGuest"):
-    """Builds the VM Create spec."""
+                       vif_infos, os_type="otherGuest", disk_size=None,
+                       adapter_type="lsiLogic", disk_type="preallocated"):
+    """
+    Builds the VM Create spec. With a disk_size, in KB, the spec also
+    creates the disk of the VM, and its controller, in the VM folder.
+    """
     config_spec = client_factory.create('ns0:VirtualMachineConfigSpec')
     config_spec.name = instance['name']
     config_spec.guestId = os_type
+    if instance.get('uuid'):
+        config_spec.instanceUuid = instance['uuid']
 
     vm_file_info = client_factory.create('ns0:VirtualMachineFileInfo')
     vm_file_info.vmPathName = "[" + data_store_name + "]"
@@ -56,6 +67,17 @@ def get_vm_create_spec(client_factory, instance, data_store_name,
 
     device_config_spec = vif_spec_list
 
+    if disk_size is not None:
+        if disk_size < 1:
+            raise Exception("Disk size of %s KB is below 1 KB" % disk_size)
+        # The disk and its controller, with the file created along with
+        # the VM
+        disk_config_spec = get_vmdk_attach_config_spec(client_factory,
+                                    adapter_type, disk_type,
+                                    disk_size=disk_size)
+        device_config_spec = (device_config_spec +
+                              disk_config_spec.deviceChange)
+
     config_spec.deviceChange = device_config_spec
 
     return config_spec
@@ -347,26 +369,65 @@ def delete_virtual_disk_spec(client_factory, device):
 
 
 def clone_vm_spec(client_factory, location,
-                  power_on=False, snapshot=None, template=False):
-    """Builds the VM clone spec."""
+                  power_on=False, snapshot=None, template=False,
+                  config=None):
+    """
+    Builds the VM clone spec. config is a VirtualMachineConfigSpec
+    applied to the clone.
+    """
     clone_spec = client_factory.create('ns0:VirtualMachineCloneSpec')
     clone_spec.location = location
     clone_spec.powerOn = power_on
     clone_spec.snapshot = snapshot
     clone_spec.template = template
+    clone_spec.config = config
     return clone_spec
 
 
 def relocate_vm_spec(client_factory, datastore=None, host=None,
-                     disk_move_type="moveAllDiskBackingsAndAllowSharing"):
+                     disk_move_type="moveAllDiskBackingsAndAllowSharing",
+                     pool=None):
     """Builds the VM relocation spec."""
     rel_spec = client_factory.create('ns0:VirtualMachineRelocateSpec')
     rel_spec.datastore = datastore
     rel_spec.diskMoveType = disk_move_type
     rel_spec.host = host
+    rel_spec.pool = pool
     return rel_spec
 
 
+def get_clone_config_spec(client_factory, instance, vif_infos,
+                          hardware_devices):
+    """
+    Builds the config spec of a clone of a template VM for the instance:
+    its CPUs, memory and instance UUID, and its network adapters, which
+    replace the ones of the template.
+    """
+    config_spec = client_factory.create('ns0:VirtualMachineConfigSpec')
+    config_spec.numCPUs = int(instance['vcpus'])
+    config_spec.memoryMB = int(instance['memory_mb'])
+    if instance.get('uuid'):
+        config_spec.instanceUuid = instance['uuid']
+
+    device_config_spec = []
+    if hardware_devices.__class__.__name__ == "ArrayOfVirtualDevice":
+        hardware_devices = hardware_devices.VirtualDevice
+    for device in hardware_devices or []:
+        if device.__class__.__name__ in ETHERNET_CARD_TYPES:
+            remove_spec = client_factory.create(
+                            'ns0:VirtualDeviceConfigSpec')
+            remove_spec.operation = "remove"
+            remove_spec.device = device
+            device_config_spec.append(remove_spec)
+    for index, vif_info in enumerate(vif_infos):
+        network_spec = create_network_spec(client_factory, vif_info)
+        # The temporary keys of the devices of a spec are distinct
+        network_spec.device.key = -47 - index
+        device_config_spec.append(network_spec)
+    config_spec.deviceChange = device_config_spec
+    return config_spec
+
+
 def get_dummy_vm_create_spec(client_factory, name, data_store_name):
     """Builds the dummy VM create spec."""
     config_spec = client_factory.create('ns0:VirtualMachineConfigSpec')
@@ -471,32 +532,58 @@ def get_vm_ref_from_name(session, vm_name):
     return None
 
 
+def get_vm_ref_from_uuid(session, instance_uuid):
+    """Get reference to the VM with the instance UUID specified."""
+    vim = session._get_vim()
+    return session._call_method(vim, "FindByUuid",
+                vim.get_service_content().searchIndex,
+                uuid=instance_uuid, vmSearch=True, instanceUuid=True)
+
+
+def build_vm_inventory_path(datacenter_name, vm_name):
+    """
+    Build the inventory path of the VM in the VM folder of the datacenter,
+    with the characters of the names escaped as vSphere does.
+    """
+    def _escape(name):
+        return name.replace("%", "%25").replace("/", "%2f").replace("\\",
+                                                                    "%5c")
+    return "%s/vm/%s" % (_escape(datacenter_name), _escape(vm_name))
+
+
+def get_vm_ref_from_inventory_path(session, inventory_path):
+    """
+    Get reference to the VM at the inventory path specified, e.g.
+    "ha-datacenter/vm/vm_name".
+    """
+    vim = session._get_vim()
+    ref = session._call_method(vim, "FindByInventoryPath",
+                vim.get_service_content().searchIndex,
+                inventoryPath=inventory_path)
+    if ref is None or ref._type != "VirtualMachine":
+        return None
+    return ref
+
+
+def get_vm_ref(session, instance):
+    """
+    Get reference to the VM of the instance. Instances having a 'uuid'
+    are looked up by their instance UUID through the SearchIndex, the
+    others by scanning the names of all the VMs.
+    """
+    if instance.get('uuid'):
+        return get_vm_ref_from_uuid(session, instance['uuid'])
+    return get_vm_ref_from_name(session, instance['name'])
+
+
 def get_cluster_ref_from_name(session, cluster_name):
     """Get reference to the cluster with the name specified."""
-    cls = session._call_method(vim_util, "get_objects",
-                               "ClusterComputeResource", ["name"])
-    for cluster in cls:
-        if cluster.propSet[0].val == cluster_name:
-            return cluster.obj
-    return None
+    return session._topology.get_cluster_ref(cluster_name)
 
 
 def get_host_ref(session, cluster=None):
     """Get reference to a host within the cluster specified."""
-    if cluster is None:
-        host_mor = session._call_method(vim_util, "get_objects",
-                                        "HostSystem")[0].obj
-    else:
-        host_ret = session._call_method(vim_util, "get_dynamic_property",
-                                        cluster, "ClusterComputeResource",
-                                        "host")
-        if host_ret is None:
-            return
-        if not host_ret.ManagedObjectReference:
-            return
-        host_mor = host_ret.ManagedObjectReference[0]
-
-    return host_mor
+    return session._topology.get_host_ref(cluster)
 
 
 def get_datastore_ref_and_name(session, cluster=None, host=None):
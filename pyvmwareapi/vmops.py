@@ -8,7 +8,10 @@ import os
 import time
 import logging
 
+import executor
 import network_util
+import read_write_util
+import trace
 import vif as vmwarevif
 import vim_util
 import vm_util
@@ -17,15 +20,25 @@ LOG = logging.getLogger()
 
 VMWARE_PREFIX = 'vmware'
 RESIZE_TOTAL_STEPS = 4
+SPAWN_CONCURRENCY = 4
+
+# VM properties get_info reports on
+INFO_PROPERTIES = ["summary.config.numCpu",
+                   "summary.config.memorySizeMB",
+                   "runtime.powerState"]
 
 
 class VMwareVMOps(object):
     """Management class for VM-related tasks."""
 
-    def __init__(self, session, volumeops):
-        """Initializer."""
+    def __init__(self, session, volumeops, inline_disk=False):
+        """
+        Initializer. With inline_disk, spawn creates the VM with its disk
+        in one task instead of attaching the disk afterwards.
+        """
         self._session = session
         self._volumeops = volumeops
+        self._inline_disk = inline_disk
         self._cluster = None
         self._instance_path_base = VMWARE_PREFIX
         self._default_root_device = 'vda'
@@ -37,7 +50,20 @@ class VMwareVMOps(object):
         vms = self._session._call_method(vim_util, "get_objects",
                      "VirtualMachine",
                      ["name", "runtime.connectionState"])
-        lst_vm_names = []
+        return list(self._get_instance_names(vms))
+
+    def iter_instances(self):
+        """
+        Yields the VM instances that are registered with the ESX host,
+        page by page, without holding the whole inventory in memory.
+        """
+        vms = self._session._iter_objects("get_objects_page",
+                     "VirtualMachine",
+                     ["name", "runtime.connectionState"])
+        return self._get_instance_names(vms)
+
+    def _get_instance_names(self, vms):
+        """Yields the names of the VMs that are not orphaned."""
         for vm in vms:
             vm_name = None
             conn_state = None
@@ -48,8 +74,7 @@ class VMwareVMOps(object):
                     conn_state = prop.val
             # Ignoring the orphaned or inaccessible VMs
             if conn_state not in ["orphaned", "inaccessible"]:
-                lst_vm_names.append(vm_name)
-        return lst_vm_names
+                yield vm_name
 
     def spawn(self, instance, disk_size, network_info,
               block_device_info=None):
@@ -73,46 +98,233 @@ class VMwareVMOps(object):
         4. Attach the disk to the VM by reconfiguring the same.
         5. Power on the VM.
         """
-        vm_ref = vm_util.get_vm_ref_from_name(self._session, instance['name'])
+        with trace.span("spawn", instance=instance['name']):
+            with trace.span("spawn_context"):
+                context = self._get_spawn_context()
+            self._spawn(instance, disk_size, network_info, context)
+
+    def spawn_many(self, instances, concurrency=SPAWN_CONCURRENCY):
+        """
+        Creates many VM instances, up to concurrency of them at a time.
+        The datastore, datacenter, VM folder, resource pool and port
+        groups are looked up once for all of them. The calls of the
+        spawns only overlap over a transport that does not block the
+        backend, e.g. the default one of the VIM Objects.
+
+        instances : list of (instance, disk_size, network_info)
+
+        Returns a dict per instance, in order, with its 'name', 'state'
+        ("success" or "error"), 'error' message and 'elapsed' seconds.
+        """
+        with trace.span("spawn_context"):
+            context = self._get_spawn_context()
+        # Make sure that the port groups exist before spawning in parallel
+        for instance, disk_size, network_info in instances:
+            self._get_vif_infos(network_info, context)
+
+        def _spawn_one(args):
+            instance, disk_size, network_info = args
+            start = time.time()
+            error = None
+            try:
+                with trace.span("spawn", instance=instance['name']):
+                    self._spawn(instance, disk_size, network_info, context)
+            except Exception, excep:
+                LOG.warn("In vmwareapi:vmops:spawn_many, got this exception"
+                         " while spawning %s: %s" % (instance['name'], excep))
+                error = str(excep)
+            return {'name': instance['name'],
+                    'state': "success" if error is None else "error",
+                    'error': error,
+                    'elapsed': time.time() - start}
+
+        pool = executor.get_backend().pool(concurrency)
+        return list(pool.imap(trace.bind(_spawn_one), instances))
+
+    def spawn_from_template(self, template, instance, linked=True,
+                            network_info=None):
+        """
+        Creates a VM instance as a clone of a template VM, in one
+        CloneVM_Task that also sets the CPUs, memory and network adapters
+        of the instance and powers it on.
+
+        template : The template VM, a dict with a 'name' and an optional
+                   'uuid' like the instances, or its name
+        linked   : Makes a linked clone, whose disks are child disks of
+                   the ones of the current snapshot of the template, not
+                   copies of them
+        """
+        if isinstance(template, basestring):
+            template = {'name': template}
+        with trace.span("spawn_from_template", instance=instance['name'],
+                        template=template['name'], linked=linked):
+            with trace.span("spawn_context"):
+                context = self._get_spawn_context()
+            with trace.span("lookup_vm"):
+                self._check_vm_absent(instance, context['dc_name'])
+
+            with trace.span("lookup_template"):
+                template_ref = vm_util.get_vm_ref(self._session, template)
+                if template_ref is None:
+                    raise Exception('Template "%s" not found.' %
+                                    template['name'])
+                props = self._session._call_method(vim_util,
+                            "get_object_properties", None, template_ref,
+                            "VirtualMachine", ["config.hardware.device",
+                                               "snapshot.currentSnapshot"])
+            hardware_devices = None
+            snapshot_ref = None
+            for elem in props:
+                for prop in elem.propSet:
+                    if prop.name == "config.hardware.device":
+                        hardware_devices = prop.val
+                    elif prop.name == "snapshot.currentSnapshot":
+                        snapshot_ref = prop.val
+            if linked and snapshot_ref is None:
+                raise Exception('Template "%s" has no snapshot to link '
+                                'the clone to.' % template['name'])
+
+            with trace.span("ensure_networks"):
+                vif_infos = self._get_vif_infos(network_info, context)
+
+            client_factory = self._session._get_vim().client.factory
+            if linked:
+                disk_move_type = "createNewChildDiskBacking"
+            else:
+                disk_move_type = "moveAllDiskBackingsAndDisallowSharing"
+                snapshot_ref = None
+            rel_spec = vm_util.relocate_vm_spec(client_factory,
+                                datastore=context['data_store_ref'],
+                                disk_move_type=disk_move_type,
+                                pool=context['res_pool_ref'])
+            config_spec = vm_util.get_clone_config_spec(client_factory,
+                                instance, vif_infos, hardware_devices)
+            clone_spec = vm_util.clone_vm_spec(client_factory, rel_spec,
+                                power_on=True, snapshot=snapshot_ref,
+                                config=config_spec)
+
+            with trace.span("clone_vm"):
+                clone_task = self._session._call_method(
+                                self._session._get_vim(),
+                                "CloneVM_Task", template_ref,
+                                folder=context['vm_folder_ref'],
+                                name=instance['name'], spec=clone_spec)
+                self._session._wait_for_task(instance['name'], clone_task)
+
+    def _check_vm_absent(self, instance, dc_name):
+        """
+        Raises if the VM of the instance exists, by UUID or by name. The
+        name is looked up in the VM folder of the datacenter, where the VM
+        is created and where the names are unique, so that neither check
+        scans all the VMs.
+        """
+        vm_ref = None
+        if instance.get('uuid'):
+            vm_ref = vm_util.get_vm_ref_from_uuid(self._session,
+                                                  instance['uuid'])
+        if vm_ref is None:
+            vm_ref = vm_util.get_vm_ref_from_inventory_path(self._session,
+                        vm_util.build_vm_inventory_path(dc_name,
+                                                        instance['name']))
         if vm_ref:
             raise Exception('VM "%s" exists' % instance['name'])
 
-        client_factory = self._session._get_vim().client.factory
-        service_content = self._session._get_vim().get_service_content()
+    def _get_spawn_context(self):
+        """
+        Looks up what the VM instances spawned on the host share: the
+        datastore, the datacenter, the VM folder and the resource pool.
+        """
         ds = vm_util.get_datastore_ref_and_name(self._session, self._cluster)
-        data_store_ref = ds[0]
-        data_store_name = ds[1]
+        dc_ref, dc_name = self._get_datacenter_ref_and_name()
+        return {'data_store_ref': ds[0],
+                'data_store_name': ds[1],
+                'dc_ref': dc_ref,
+                'dc_name': dc_name,
+                'vm_folder_ref': self._get_vmfolder_ref(),
+                'res_pool_ref': self._get_res_pool_ref(),
+                # port group name -> network ref of the ensured bridges
+                'bridges': {},
+                # fetched by the first VIF
+                'network_snapshot': None}
+
+    def _get_vif_infos(self, network_info, context):
+        """Ensures the bridges of the VIFs and builds their VIF infos."""
+        vif_infos = []
+        if network_info is None:
+            return vif_infos
+        bridges = context['bridges']
+        dv_network_names = []
+        for vif in network_info:
+            network_name = vif['pg']
+            if network_name in bridges:
+                continue
+            if context.get('network_snapshot') is None:
+                context['network_snapshot'] = (
+                        network_util.HostNetworkSnapshot(self._session,
+                                                         self._cluster))
+            snapshot = context['network_snapshot']
+            vmwarevif.ensure_vlan_bridge(self._session, vif, self._cluster,
+                                         snapshot)
+            bridges[network_name] = None
+            network_ref = snapshot.get_network(network_name)
+            if (network_ref is not None and
+                    network_ref._type == "DistributedVirtualPortgroup"):
+                dv_network_names.append(network_name)
+        if dv_network_names:
+            # The distributed port groups of all the VIFs in one pass
+            bridges.update(network_util.get_networks_with_the_names(
+                            self._session, dv_network_names, self._cluster))
+        for vif in network_info:
+            vif_infos.append({'network_name': vif['pg'],
+                              'mac_address': vif['address'],
+                              'network_ref': bridges[vif['pg']],
+                             })
+        return vif_infos
+
+    def _spawn(self, instance, disk_size, network_info, context):
+        """Creates a VM instance with the lookups of the spawn context."""
+        with trace.span("lookup_vm"):
+            self._check_vm_absent(instance, context['dc_name'])
 
-        vmdk_file_size_in_kb = int(disk_size) / 1024
+        client_factory = self._session._get_vim().client.factory
+        service_content = self._session._get_vim().get_service_content()
+        data_store_ref = context['data_store_ref']
+        data_store_name = context['data_store_name']
+
+        # A local flat disk image to upload as the disk of the VM
+        image_path = instance.get('image')
+        if image_path:
+            disk_size = os.path.getsize(image_path)
+        # Rounded up to whole KB, a disk is never made smaller than asked
+        vmdk_file_size_in_kb = (int(disk_size) + 1023) / 1024
         os_type = "otherGuest"
         adapter_type = "lsiLogic"
         disk_type = "preallocated"
+        if image_path:
+            # Only the metadata file of the disk is kept, its flat file is
+            # replaced by the image: a thin disk is created, whose flat
+            # file is not written in full just to be deleted
+            disk_type = "thin"
+        # The disk of an image is uploaded after its metadata is created
+        inline_disk = self._inline_disk and not image_path
 
-        vm_folder_ref = self._get_vmfolder_ref()
-        res_pool_ref = self._get_res_pool_ref()
-
-        def _get_vif_infos():
-            vif_infos = []
-            if network_info is None:
-                return vif_infos
-            for vif in network_info:
-                mac_address = vif['address']
-                network_name = vif['pg']
-                network_ref = vmwarevif.ensure_vlan_bridge(
-                                                        self._session, vif,
-                                                        self._cluster)
-                vif_infos.append({'network_name': network_name,
-                                  'mac_address': mac_address,
-                                  'network_ref': network_ref,
-                                 })
-            return vif_infos
+        vm_folder_ref = context['vm_folder_ref']
+        res_pool_ref = context['res_pool_ref']
 
-        vif_infos = _get_vif_infos()
+        with trace.span("ensure_networks"):
+            vif_infos = self._get_vif_infos(network_info, context)
 
         # Get the create vm config spec
-        config_spec = vm_util.get_vm_create_spec(
-                            client_factory, instance,
-                            data_store_name, vif_infos, os_type)
+        if inline_disk:
+            # The disk is created along with the VM
+            config_spec = vm_util.get_vm_create_spec(
+                                client_factory, instance,
+                                data_store_name, vif_infos, os_type,
+                                vmdk_file_size_in_kb, adapter_type, disk_type)
+        else:
+            config_spec = vm_util.get_vm_create_spec(
+                                client_factory, instance,
+                                data_store_name, vif_infos, os_type)
 
         def _execute_create_vm():
             """Create VM on ESX host."""
@@ -121,11 +333,12 @@ class VMwareVMOps(object):
                                     self._session._get_vim(),
                                     "CreateVM_Task", vm_folder_ref,
                                     config=config_spec, pool=res_pool_ref)
-            self._session._wait_for_task(instance['name'], vm_create_task)
+            # The task result is the reference of the VM created
+            return self._session._wait_for_task_result(instance['name'],
+                                                       vm_create_task)
 
-
-        _execute_create_vm()
-        vm_ref = vm_util.get_vm_ref_from_name(self._session, instance['name'])
+        with trace.span("create_vm"):
+            vm_ref = _execute_create_vm()
 
         def _create_virtual_disk():
             """Create a virtual disk of the size of flat vmdk file."""
@@ -155,7 +368,7 @@ class VMwareVMOps(object):
                         service_content.fileManager,
                         name=vmdk_path,
                         datacenter=dc_ref)
-            self._session._wait_for_task(instance[''], vmdk_delete_task)
+            self._session._wait_for_task(instance['name'], vmdk_delete_task)
 
         def _copy_virtual_disk():
             """Copy a sparse virtual disk to a thin virtual disk."""
@@ -171,14 +384,25 @@ class VMwareVMOps(object):
                 "CopyVirtualDisk_Task",
                 service_content.virtualDiskManager,
                 sourceName=sparse_uploaded_vmdk_path,
-                sourceDatacenter=self._get_datacenter_ref_and_name()[0],
+                sourceDatacenter=dc_ref,
                 destName=uploaded_vmdk_path,
                 destSpec=vmdk_copy_spec)
             self._session._wait_for_task(instance['name'], vmdk_copy_task)
 
+        def _upload_image():
+            """Upload the image as the flat vmdk file."""
+            stats = self._session._upload_file(image_path,
+                                               flat_uploaded_vmdk_path,
+                                               context['dc_name'])
+            LOG.debug("Image %s uploaded for %s: %s" % (image_path,
+                      instance['name'], stats.to_dict()))
+
         ebs_root = None
 
-        if not ebs_root:
+        if inline_disk:
+            # The disk was created and attached by CreateVM_Task
+            pass
+        elif not ebs_root:
             upload_folder = instance['name']
             upload_name = instance['name']
 
@@ -187,9 +411,11 @@ class VMwareVMOps(object):
             uploaded_vmdk_path = vm_util.build_datastore_path(data_store_name,
                                                 uploaded_vmdk_name)
 
-            if not self._check_if_folder_file_exists(
+            with trace.span("datastore_search"):
+                disk_exists = self._check_if_folder_file_exists(
                                         data_store_ref, data_store_name,
-                                        upload_folder, upload_name + ".vmdk"):
+                                        upload_folder, upload_name + ".vmdk")
+            if not disk_exists:
 
                 # Naming the VM files in correspondence with the VM instance
                 # The flat vmdk file name
@@ -205,23 +431,34 @@ class VMwareVMOps(object):
                 sparse_uploaded_vmdk_path = vm_util.build_datastore_path(
                                                     data_store_name,
                                                     sparse_uploaded_vmdk_name)
-                dc_ref = self._get_datacenter_ref_and_name()[0]
+                dc_ref = context['dc_ref']
 
                 if disk_type != "sparse":
                    # Create a flat virtual disk and retain the metadata file.
-                    _create_virtual_disk()
+                    with trace.span("create_disk"):
+                        _create_virtual_disk()
+
+                if image_path:
+                    # The thin flat file created along with the metadata
+                    # file is replaced by the image
+                    with trace.span("delete_flat_disk"):
+                        _delete_disk_file(flat_uploaded_vmdk_path)
+                    with trace.span("upload_image"):
+                        _upload_image()
 
                 if disk_type == "sparse":
                     # Copy the sparse virtual disk to a thin virtual disk.
                     disk_type = "thin"
-                    _copy_virtual_disk()
+                    with trace.span("copy_disk"):
+                        _copy_virtual_disk()
             else:
                 # linked clone base disk exists
                 if disk_type == "sparse":
                     disk_type = "thin"
 
             # Attach the vmdk uploaded to the VM.
-            self._volumeops.attach_disk_to_vm(
+            with trace.span("attach_disk"):
+                self._volumeops.attach_disk_to_vm(
                                 vm_ref, instance,
                                 adapter_type, disk_type, uploaded_vmdk_path,
                                 vmdk_file_size_in_kb, False)
@@ -236,11 +473,12 @@ class VMwareVMOps(object):
                                self._session._get_vim(),
                                "PowerOnVM_Task", vm_ref)
             self._session._wait_for_task(instance['name'], power_on_task)
-        _power_on_vm()
+        with trace.span("power_on"):
+            _power_on_vm()
 
     def reboot(self, instance):
         """Reboot a VM instance."""
-        vm_ref = vm_util.get_vm_ref_from_name(self._session, instance['name'])
+        vm_ref = vm_util.get_vm_ref(self._session, instance)
         if vm_ref is None:
             raise Exception('VM "%s" not found.' % instance['name'])
 
@@ -276,6 +514,36 @@ class VMwareVMOps(object):
                                                     "ResetVM_Task", vm_ref)
             self._session._wait_for_task(instance['name'], reset_task)
 
+    def export_disk(self, instance, local_path,
+                    streams=read_write_util.DOWNLOAD_STREAMS, progress=None):
+        """
+        Downloads the flat file of the disk of a VM instance, its raw
+        data, to a local file, over streams parallel ranged GETs. The
+        file can be given as the 'image' of an instance to spawn. The
+        disk of a running VM may change while it is exported.
+        """
+        with trace.span("export_disk", instance=instance['name']):
+            with trace.span("lookup_vm"):
+                vm_ref = vm_util.get_vm_ref(self._session, instance)
+            if vm_ref is None:
+                raise Exception('VM "%s" not found.' % instance['name'])
+            hardware_devices = self._session._call_method(vim_util,
+                        "get_dynamic_property", vm_ref, "VirtualMachine",
+                        "config.hardware.device")
+            vmdk_path = vm_util.get_vmdk_path_and_adapter_type(
+                                                    hardware_devices)[0]
+            if vmdk_path is None:
+                raise Exception('VM "%s" has no disk to export.' %
+                                instance['name'])
+            # The data of the disk is in the flat file of its descriptor
+            if vmdk_path.endswith(".vmdk"):
+                vmdk_path = vmdk_path[:-len(".vmdk")] + "-flat.vmdk"
+            dc_name = self._get_datacenter_ref_and_name()[1]
+            with trace.span("download_disk"):
+                return self._session._download_file(vmdk_path, dc_name,
+                                                    local_path, streams,
+                                                    progress)
+
     def destroy(self, instance, destroy_disks=True):
         """
         Destroy a VM instance. Steps followed are:
@@ -283,13 +551,19 @@ class VMwareVMOps(object):
         2. Un-register a VM.
         3. Delete the contents of the folder holding the VM related data.
         """
+        with trace.span("destroy", instance=instance['name']):
+            self._destroy(instance, destroy_disks)
+
+    def _destroy(self, instance, destroy_disks):
+        """Runs the steps of destroy, each one traced."""
         try:
-            vm_ref = vm_util.get_vm_ref_from_name(self._session,
-                                                  instance['name'])
-            if vm_ref is None:
-                return
-            lst_properties = ["config.files.vmPathName", "runtime.powerState"]
-            props = self._session._call_method(vim_util,
+            with trace.span("lookup_vm"):
+                vm_ref = vm_util.get_vm_ref(self._session, instance)
+                if vm_ref is None:
+                    return
+                lst_properties = ["config.files.vmPathName",
+                                  "runtime.powerState"]
+                props = self._session._call_method(vim_util,
                         "get_object_properties",
                         None, vm_ref, "VirtualMachine", lst_properties)
             pwr_state = None
@@ -305,15 +579,18 @@ class VMwareVMOps(object):
                 datastore_name, vmx_file_path = _ds_path
             # Power off the VM if it is in PoweredOn state.
             if pwr_state == "poweredOn":
-                poweroff_task = self._session._call_method(
-                       self._session._get_vim(),
-                       "PowerOffVM_Task", vm_ref)
-                self._session._wait_for_task(instance['name'], poweroff_task)
+                with trace.span("power_off"):
+                    poweroff_task = self._session._call_method(
+                           self._session._get_vim(),
+                           "PowerOffVM_Task", vm_ref)
+                    self._session._wait_for_task(instance['name'],
+                                                 poweroff_task)
 
             # Un-register the VM
             try:
-                self._session._call_method(self._session._get_vim(),
-                                           "UnregisterVM", vm_ref)
+                with trace.span("unregister"):
+                    self._session._call_method(self._session._get_vim(),
+                                               "UnregisterVM", vm_ref)
             except Exception, excep:
                 LOG.warn("In vmwareapi:vmops:destroy, got this exception"
                            " while un-registering the VM: %s" % str(excep))
@@ -326,13 +603,15 @@ class VMwareVMOps(object):
                                      datastore_name,
                                      os.path.dirname(vmx_file_path))
                     vim = self._session._get_vim()
-                    delete_task = self._session._call_method(
-                        vim,
-                        "DeleteDatastoreFile_Task",
-                        vim.get_service_content().fileManager,
-                        name=dir_ds_compliant_path,
-                        datacenter=self._get_datacenter_ref_and_name()[0])
-                    self._session._wait_for_task(instance['name'], delete_task)
+                    with trace.span("delete_folder"):
+                        delete_task = self._session._call_method(
+                            vim,
+                            "DeleteDatastoreFile_Task",
+                            vim.get_service_content().fileManager,
+                            name=dir_ds_compliant_path,
+                            datacenter=self._get_datacenter_ref_and_name()[0])
+                        self._session._wait_for_task(instance['name'],
+                                                     delete_task)
                 except Exception, excep:
                     LOG.warn("In vmwareapi:vmops:destroy, "
                                  "got this exception while deleting"
@@ -346,28 +625,97 @@ class VMwareVMOps(object):
 
     def get_info(self, instance):
         """Return data about the VM instance."""
-        vm_ref = vm_util.get_vm_ref_from_name(self._session, instance['name'])
+        vm_ref = vm_util.get_vm_ref(self._session, instance)
         if vm_ref is None:
             raise Exception('VM "%s" not found.' % instance['name'])
 
-        lst_properties = ["summary.config.numCpu",
-                    "summary.config.memorySizeMB",
-                    "runtime.powerState"]
         vm_props = self._session._call_method(vim_util,
                     "get_object_properties", None, vm_ref, "VirtualMachine",
-                    lst_properties)
+                    INFO_PROPERTIES)
+        prop_set = []
+        for elem in vm_props:
+            prop_set.extend(elem.propSet)
+        return self._get_info_from_prop_set(prop_set)
+
+    def get_info_many(self, instances):
+        """
+        Return data about the VM instances. The instances are matched by
+        their UUID, else by their name, with one retrieval of the names
+        and UUIDs of the VMs, then the data of the VMs found is collected
+        with a second retrieval, whatever the number of instances. The
+        result maps the name of every instance found to the data returned
+        by get_info.
+        """
+        by_uuid = {}
+        by_name = {}
+        for instance in instances:
+            if instance.get('uuid'):
+                by_uuid[instance['uuid']] = instance['name']
+            else:
+                by_name[instance['name']] = instance['name']
+        vms = self._session._call_method(vim_util, "get_objects",
+                    "VirtualMachine", ["name", "config.instanceUuid"])
+        # VM ref value -> instance name
+        names = {}
+        vm_refs = []
+        for vm in vms:
+            props = {}
+            for prop in vm.propSet:
+                props[prop.name] = prop.val
+            instance_name = by_uuid.pop(props.get("config.instanceUuid"),
+                                        None)
+            if instance_name is None:
+                instance_name = by_name.pop(props.get("name"), None)
+            if instance_name is not None:
+                names[vm.obj.value] = instance_name
+                vm_refs.append(vm.obj)
+        vm_props = self._session._call_method(vim_util,
+                    "get_properties_for_a_collection_of_objects",
+                    "VirtualMachine", vm_refs, INFO_PROPERTIES)
+        infos = {}
+        for vm in vm_props:
+            infos[names[vm.obj.value]] = self._get_info_from_prop_set(
+                                                        vm.propSet)
+        return infos
+
+    def get_info_all(self):
+        """
+        Return data about all the VMs of the ESX host, collected with a
+        single retrieval of the whole inventory. The result maps the VM
+        names to the data returned by get_info.
+        """
+        infos = {}
+        for vm_name, info in self._get_all_info():
+            infos[vm_name] = info
+        return infos
+
+    def _get_all_info(self):
+        """Get the name and data of every VM."""
+        vms = self._session._call_method(vim_util, "get_objects",
+                    "VirtualMachine", ["name"] + INFO_PROPERTIES)
+        all_info = []
+        for vm in vms:
+            vm_name = None
+            for prop in vm.propSet:
+                if prop.name == "name":
+                    vm_name = prop.val
+            all_info.append((vm_name,
+                             self._get_info_from_prop_set(vm.propSet)))
+        return all_info
+
+    def _get_info_from_prop_set(self, prop_set):
+        """Build the VM data from its INFO_PROPERTIES."""
         max_mem = None
         pwr_state = None
         num_cpu = None
-        for elem in vm_props:
-            for prop in elem.propSet:
-                if prop.name == "summary.config.numCpu":
-                    num_cpu = int(prop.val)
-                elif prop.name == "summary.config.memorySizeMB":
-                    # In MB, but we want in KB
-                    max_mem = int(prop.val) * 1024
-                elif prop.name == "runtime.powerState":
-                    pwr_state = prop.val
+        for prop in prop_set:
+            if prop.name == "summary.config.numCpu":
+                num_cpu = int(prop.val)
+            elif prop.name == "summary.config.memorySizeMB":
+                # In MB, but we want in KB
+                max_mem = int(prop.val) * 1024
+            elif prop.name == "runtime.powerState":
+                pwr_state = prop.val
 
         return {'state': pwr_state,
                 'max_mem': max_mem,
@@ -377,9 +725,7 @@ class VMwareVMOps(object):
 
     def _get_datacenter_ref_and_name(self):
         """Get the datacenter name and the reference."""
-        dc_obj = self._session._call_method(vim_util, "get_objects",
-                "Datacenter", ["name"])
-        return dc_obj[0].obj, dc_obj[0].propSet[0].val
+        return self._session._topology.get_datacenter_ref_and_name()
 
     def _get_host_ref_from_name(self, host_name):
         """Get reference to the host with the name specified."""
@@ -392,25 +738,11 @@ class VMwareVMOps(object):
 
     def _get_vmfolder_ref(self):
         """Get the Vm folder ref from the datacenter."""
-        dc_objs = self._session._call_method(vim_util, "get_objects",
-                                             "Datacenter", ["vmFolder"])
-        # There is only one default datacenter in a standalone ESX host
-        vm_folder_ref = dc_objs[0].propSet[0].val
-        return vm_folder_ref
+        return self._session._topology.get_vmfolder_ref()
 
     def _get_res_pool_ref(self):
-        # Get the resource pool. Taking the first resource pool coming our
-        # way. Assuming that is the default resource pool.
-        if self._cluster is None:
-            res_pool_ref = self._session._call_method(vim_util, "get_objects",
-                                                      "ResourcePool")[0].obj
-        else:
-            res_pool_ref = self._session._call_method(vim_util,
-                                                      "get_dynamic_property",
-                                                      self._cluster,
-                                                      "ClusterComputeResource",
-                                                      "resourcePool")
-        return res_pool_ref
+        """Get the resource pool of the host or of the cluster."""
+        return self._session._topology.get_res_pool_ref(self._cluster)
 
     def _path_exists(self, ds_browser, ds_path):
         """Check if the path exists on the datastore."""
@@ -418,17 +750,11 @@ class VMwareVMOps(object):
                                    "SearchDatastore_Task",
                                    ds_browser,
                                    datastorePath=ds_path)
-        # Wait till the state changes from queued or running.
-        # If an error state is returned, it means that the path doesn't exist.
-        while True:
-            task_info = self._session._call_method(vim_util,
-                                       "get_dynamic_property",
-                                       search_task, "Task", "info")
-            if task_info.state in ['queued', 'running']:
-                time.sleep(2)
-                continue
-            break
-        if task_info.state == "error":
+        # Wait till the task completes.
+        # If an error is raised, it means that the path doesn't exist.
+        try:
+            self._session._wait_for_task_result(None, search_task)
+        except Exception:
             return False
         return True
 
@@ -441,21 +767,16 @@ class VMwareVMOps(object):
                                    ds_browser,
                                    datastorePath=ds_path,
                                    searchSpec=search_spec)
-        # Wait till the state changes from queued or running.
-        # If an error state is returned, it means that the path doesn't exist.
-        while True:
-            task_info = self._session._call_method(vim_util,
-                                       "get_dynamic_property",
-                                       search_task, "Task", "info")
-            if task_info.state in ['queued', 'running']:
-                time.sleep(2)
-                continue
-            break
-        if task_info.state == "error":
+        # Wait till the task completes.
+        # If an error is raised, it means that the path doesn't exist.
+        try:
+            search_result = self._session._wait_for_task_result(None,
+                                                                search_task)
+        except Exception:
             return False, False
 
-        file_exists = (getattr(task_info.result, 'file', False) and
-                       task_info.result.file[0].path == file_name)
+        file_exists = (getattr(search_result, 'file', False) and
+                       search_result.file[0].path == file_name)
         return True, file_exists
 
     def _mkdir(self, ds_path):
@@ -472,11 +793,11 @@ class VMwareVMOps(object):
 
     def _check_if_folder_file_exists(self, ds_ref, ds_name,
                                      folder_name, file_name):
-        ds_browser = vim_util.get_dynamic_property(
-                                self._session._get_vim(),
-                                ds_ref,
-                                "Datastore",
-                                "browser")
+        ds_browser = self._session._call_method(vim_util,
+                                                "get_dynamic_property",
+                                                ds_ref,
+                                                "Datastore",
+                                                "browser")
         # Check if the folder exists or not. If not, create one
         # Check if the file exists or not.
         folder_path = vm_util.build_datastore_path(ds_name, folder_name)
@@ -0,0 +1,178 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+"""
+Tests of the record and replay of the exchanges of the suds transports.
+"""
+
+import os
+import shutil
+import StringIO
+import tempfile
+import unittest
+
+from pyvmwareapi import cassette
+from pyvmwareapi import executor
+
+try:
+    import suds.transport
+except ImportError:
+    suds = None
+
+URL = "https://esx/sdk"
+WSDL_URL = "https://esx/sdk/vimService.wsdl"
+WSDL = "<definitions/>"
+
+
+def soap_request(method, body=""):
+    return suds.transport.Request(URL,
+        '<SOAP-ENV:Envelope><SOAP-ENV:Body><ns1:%s>%s</ns1:%s>'
+        '</SOAP-ENV:Body></SOAP-ENV:Envelope>' % (method, body, method))
+
+
+if suds:
+
+    class FakeTransport(suds.transport.Transport):
+        """Serves canned replies, by SOAP method."""
+
+        def __init__(self, replies):
+            suds.transport.Transport.__init__(self)
+            self.replies = replies
+
+        def open(self, request):
+            return StringIO.StringIO(WSDL)
+
+        def send(self, request):
+            reply = self.replies[cassette.get_soap_method(request.message)]
+            if isinstance(reply, Exception):
+                raise reply
+            return reply
+
+
+@unittest.skipIf(suds is None, "suds is not installed")
+class CassetteTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.addCleanup(executor.set_backend, executor._BACKEND)
+        executor.set_backend("threads")
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "test.cassette")
+        fault = suds.transport.TransportError("Internal Server Error", 500,
+                                              StringIO.StringIO("<fault/>"))
+        replies = {
+            "RetrieveServiceContent": suds.transport.Reply(200,
+                                            {"content-type": "text/xml"},
+                                            "<content/>"),
+            "Logout": None,
+            "Login": fault,
+            "Empty": suds.transport.Reply(200, {}, ""),
+        }
+        self.recorder = cassette.Recorder(self.path,
+                                          lambda: FakeTransport(replies))
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _record(self, *requests):
+        transport = self.recorder.transport()
+        for request in requests:
+            try:
+                transport.send(request)
+            except suds.transport.TransportError:
+                pass
+        self.recorder.close()
+        return cassette.Player(self.path, latency_scale=0.0).transport()
+
+    def test_get_soap_method(self):
+        self.assertEqual(cassette.get_soap_method(
+                                soap_request("Login").message), "Login")
+        self.assertEqual(cassette.get_soap_method("<html/>"), None)
+        self.assertEqual(cassette.get_soap_method(None), None)
+
+    def test_reply(self):
+        transport = self._record(soap_request("RetrieveServiceContent"))
+        reply = transport.send(soap_request("RetrieveServiceContent"))
+        self.assertEqual(reply.code, 200)
+        self.assertEqual(reply.headers, {"content-type": "text/xml"})
+        self.assertEqual(reply.message, "<content/>")
+
+    def test_no_reply(self):
+        transport = self._record(soap_request("Logout"))
+        self.assertEqual(transport.send(soap_request("Logout")), None)
+
+    def test_empty_reply(self):
+        transport = self._record(soap_request("Empty"))
+        self.assertEqual(transport.send(soap_request("Empty")).message, "")
+
+    def test_fault(self):
+        recording = self.recorder.transport()
+        try:
+            recording.send(soap_request("Login"))
+            self.fail("The fault was not raised")
+        except suds.transport.TransportError, excep:
+            # The reply read for the record is passed on
+            self.assertEqual(excep.fp.read(), "<fault/>")
+        transport = self._record()
+        try:
+            transport.send(soap_request("Login"))
+            self.fail("The fault was not replayed")
+        except suds.transport.TransportError, excep:
+            self.assertEqual(excep.httpcode, 500)
+            self.assertEqual(excep.fp.read(), "<fault/>")
+
+    def test_document(self):
+        recording = self.recorder.transport()
+        self.assertEqual(recording.open(
+                            suds.transport.Request(WSDL_URL)).read(), WSDL)
+        transport = self._record()
+        self.assertEqual(transport.open(
+                            suds.transport.Request(WSDL_URL)).read(), WSDL)
+        self.assertRaises(suds.transport.TransportError, transport.open,
+                          suds.transport.Request(URL + "/other.xsd"))
+
+    def test_same_request_preferred(self):
+        replies = self.recorder.transport_factory().replies
+        replies["RetrieveServiceContent"] = suds.transport.Reply(200, {},
+                                                                 "<first/>")
+        recording = self.recorder.transport()
+        recording.send(soap_request("RetrieveServiceContent", "1"))
+        replies["RetrieveServiceContent"] = suds.transport.Reply(200, {},
+                                                                 "<second/>")
+        transport = self._record(soap_request("RetrieveServiceContent",
+                                              "2"))
+        player = transport._player
+        self.assertEqual(transport.send(soap_request(
+                "RetrieveServiceContent", "2")).message, "<second/>")
+        self.assertEqual(player.remaining(), {"RetrieveServiceContent": 1})
+        # Without an identical request, the first one left is replayed
+        self.assertEqual(transport.send(soap_request(
+                "RetrieveServiceContent", "3")).message, "<first/>")
+        self.assertEqual(player.remaining(), {})
+        self.assertRaises(Exception, transport.send,
+                          soap_request("RetrieveServiceContent"))
+
+    def test_credentials_not_recorded(self):
+        replies = self.recorder.transport_factory().replies
+        replies["Login"] = suds.transport.Reply(200,
+                                {"Set-Cookie": "vmware_soap_session=abc",
+                                 "content-type": "text/xml"}, "<session/>")
+        credentials = ("<ns1:userName>root</ns1:userName>"
+                       "<ns1:password>%s</ns1:password>")
+        transport = self._record(soap_request("Login",
+                                              credentials % "secret"))
+        recorded = open(self.path).read()
+        self.assertFalse("secret" in recorded)
+        self.assertFalse("abc" in recorded)
+        # Replayed with the credentials of another machine
+        reply = transport.send(soap_request("Login", credentials % "other"))
+        self.assertEqual(reply.message, "<session/>")
+        self.assertEqual(reply.headers, {"content-type": "text/xml"})
+
+    def test_redact(self):
+        self.assertEqual(cassette.redact(
+            '<password xsi:type="xsd:string">a\nb</password><p>c</p>'),
+            '<password xsi:type="xsd:string">REDACTED</password><p>c</p>')
+        self.assertEqual(cassette.redact(None), None)
+
+
+if __name__ == "__main__":
+    unittest.main()
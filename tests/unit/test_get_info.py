@@ -0,0 +1,68 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+"""
+Tests of the bulk get_info of many or all the VMs, against the simulator.
+"""
+
+import unittest
+import uuid
+
+from pyvmwareapi import executor
+from pyvmwareapi import simulator
+
+NUM_VMS = 5
+
+
+class GetInfoTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.addCleanup(executor.set_backend, executor._BACKEND)
+        executor.set_backend("threads")
+        self.sim = simulator.Simulator(num_vms=NUM_VMS)
+        self.conn = self.sim.driver(watch_tasks=False)
+        self.instances = []
+        for index in range(2):
+            instance = {'name': "new-%d" % index, 'vcpus': index + 1,
+                        'memory_mb': 128, 'uuid': str(uuid.uuid4())}
+            self.conn.spawn(instance, 1024 * 1024)
+            self.instances.append(instance)
+        self.sim.reset_call_counts()
+
+    def tearDown(self):
+        self.conn.close()
+
+    def test_many_by_uuid(self):
+        infos = self.conn.get_info_many(self.instances)
+        self.assertEqual(sorted(infos), ["new-0", "new-1"])
+        self.assertEqual(infos["new-1"]['num_cpu'], 2)
+        self.assertEqual(infos["new-1"]['state'], "poweredOn")
+        # One retrieval to match the instances, one for their data
+        self.assertEqual(self.sim.call_counts, {"RetrievePropertiesEx": 2})
+
+    def test_many_fixed_calls(self):
+        instances = [{'name': "vm-%06d" % index} for index in range(NUM_VMS)]
+        infos = self.conn.get_info_many(instances + self.instances)
+        self.assertEqual(len(infos), NUM_VMS + 2)
+        self.assertEqual(self.sim.call_counts, {"RetrievePropertiesEx": 2})
+
+    def test_many_by_name(self):
+        infos = self.conn.get_info_many([{'name': "vm-000001"},
+                                         self.instances[0]])
+        self.assertEqual(sorted(infos), ["new-0", "vm-000001"])
+        self.assertEqual(infos["vm-000001"],
+                         self.conn.get_info({'name': "vm-000001"}))
+
+    def test_many_not_found(self):
+        infos = self.conn.get_info_many([{'name': "missing"},
+                                         {'name': "other",
+                                          'uuid': str(uuid.uuid4())}])
+        self.assertEqual(infos, {})
+
+    def test_all(self):
+        infos = self.conn.get_info_all()
+        self.assertEqual(len(infos), NUM_VMS + 2)
+        self.assertEqual(infos["new-0"]['num_cpu'], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,93 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+"""
+Tests of the inventory cache, kept current by the updates of the
+simulator.
+"""
+
+import unittest
+
+from pyvmwareapi import executor
+from pyvmwareapi import inventory
+from pyvmwareapi import simulator
+
+
+class InventoryCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.addCleanup(executor.set_backend, executor._BACKEND)
+        executor.set_backend("threads")
+        self.sim = simulator.Simulator(num_vms=3)
+        self.conn = self.sim.driver(inventory_cache=True)
+        self.inventory = self.conn._session._inventory
+
+    def tearDown(self):
+        self.conn.close()
+
+    def _spawn(self, name):
+        self.conn.spawn({'name': name, 'vcpus': 1, 'memory_mb': 128},
+                        1024 * 1024)
+
+    def test_list_instances_from_cache(self):
+        self.assertEqual(self.conn.list_instances(),
+                         ["vm-000000", "vm-000001", "vm-000002"])
+        self.sim.reset_call_counts()
+        self.conn.list_instances()
+        self.assertEqual(self.sim.call_counts.get("RetrieveProperties"),
+                         None)
+        self.assertEqual(self.sim.call_counts.get("RetrievePropertiesEx"),
+                         None)
+
+    def test_truncated_updates(self):
+        self.addCleanup(setattr, inventory, "MAX_OBJECT_UPDATES",
+                        inventory.MAX_OBJECT_UPDATES)
+        inventory.MAX_OBJECT_UPDATES = 2
+        self.sim.reset_call_counts()
+        self.assertEqual(self.conn.list_instances(),
+                         ["vm-000000", "vm-000001", "vm-000002"])
+        # The load is fetched over several truncated UpdateSets
+        self.assertTrue(self.sim.call_counts["WaitForUpdatesEx"] > 1)
+
+    def test_enter(self):
+        self.conn.list_instances()
+        self._spawn("new")
+        self.assertTrue("new" in self.conn.list_instances())
+
+    def test_modify(self):
+        self.conn.list_instances()
+        self._spawn("new")
+        self.conn.destroy({'name': "new"})
+        self._spawn("new")
+        self.assertEqual(self.conn.list_instances().count("new"), 1)
+
+    def test_leave(self):
+        self.conn.list_instances()
+        self._spawn("new")
+        self.conn.destroy({'name': "new"})
+        self.conn.destroy({'name': "vm-000001"})
+        self.assertEqual(self.conn.list_instances(),
+                         ["vm-000000", "vm-000002"])
+        self.assertFalse(None in self.inventory._objects)
+        self.assertEqual(len(self.inventory._objects["VirtualMachine"]), 2)
+
+    def test_leave_other_type(self):
+        self.conn.list_instances()
+        value = sorted(self.inventory._objects["VirtualMachine"].keys())[0]
+        datastore = simulator.ManagedObjectReference("Datastore", value)
+        self.inventory._objects.setdefault("Datastore", {})[value] = (
+                                                        0, datastore, {})
+        leave = simulator.data_object("ObjectUpdate", kind="leave",
+                    obj=simulator.ManagedObjectReference("VirtualMachine",
+                                                         value),
+                    changeSet=[])
+        update_set = simulator.data_object("UpdateSet", filterSet=[
+                        simulator.data_object("PropertyFilterUpdate",
+                                              objectSet=[leave])])
+        self.inventory._apply(update_set)
+        self.assertFalse(value in self.inventory._objects["VirtualMachine"])
+        # The object of another type with the same value stays
+        self.assertTrue(value in self.inventory._objects["Datastore"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,178 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+"""
+Tests of the adaptive limiter, and of the back-off of the calls of a
+driver connected to the simulator on an overload.
+"""
+
+import httplib
+import os
+import sys
+import threading
+import traceback
+import unittest
+
+from pyvmwareapi import driver
+from pyvmwareapi import executor
+from pyvmwareapi import limiter
+from pyvmwareapi import metrics
+from pyvmwareapi import simulator
+
+
+class BackoffTestCase(unittest.TestCase):
+
+    def test_bounds(self):
+        for retry_count in range(1, 10):
+            delay = limiter.backoff(retry_count, 2.0)
+            self.assertTrue(0 <= delay <= min(limiter.BACKOFF_MAX,
+                                              2.0 * 2 ** retry_count))
+
+    def test_cap(self):
+        for index in range(100):
+            self.assertTrue(limiter.backoff(20, 2.0, cap=1.0) <= 1.0)
+
+
+class GetLimiterTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.addCleanup(executor.set_backend, executor._BACKEND)
+        executor.set_backend("threads")
+
+    def tearDown(self):
+        for backend in executor.BACKENDS:
+            limiter._LIMITERS.pop(("concurrent", backend), None)
+
+    def test_shared_by_concurrent_sessions(self):
+        limiters = []
+
+        def _get():
+            limiters.append(limiter.get_limiter("concurrent"))
+
+        threads = [threading.Thread(target=_get) for index in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(set(map(id, limiters))), 1)
+
+    def test_per_backend(self):
+        threads_limiter = limiter.get_limiter("concurrent")
+        executor.set_backend("inline")
+        inline_limiter = limiter.get_limiter("concurrent")
+        self.assertFalse(inline_limiter is threads_limiter)
+        self.assertTrue(limiter.get_limiter("concurrent") is inline_limiter)
+        # Each one waits with the primitives of its own backend
+        self.assertTrue(isinstance(inline_limiter._lock,
+                                   executor.InlineSemaphore))
+        self.assertFalse(isinstance(threads_limiter._lock,
+                                    executor.InlineSemaphore))
+        executor.set_backend("threads")
+        self.assertTrue(limiter.get_limiter("concurrent") is threads_limiter)
+
+
+class AdaptiveLimiterTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.addCleanup(executor.set_backend, executor._BACKEND)
+        executor.set_backend("threads")
+        self.limiter = limiter.AdaptiveLimiter(initial_limit=2)
+
+    def test_waits_at_limit(self):
+        self.limiter.acquire()
+        self.limiter.acquire()
+        acquired = threading.Event()
+
+        def _acquire():
+            self.limiter.acquire()
+            acquired.set()
+
+        thread = threading.Thread(target=_acquire)
+        thread.setDaemon(True)
+        thread.start()
+        acquired.wait(0.1)
+        self.assertFalse(acquired.isSet())
+        self.limiter.release(0.01)
+        acquired.wait(10)
+        self.assertTrue(acquired.isSet())
+        self.assertEqual(self.limiter.in_flight, 2)
+
+    def test_increase(self):
+        self.limiter.acquire()
+        self.limiter.release(0.01)
+        self.assertEqual(self.limiter.limit, 2.5)
+
+    def test_decrease_on_overload(self):
+        self.limiter.acquire()
+        self.limiter.release(0.01, overloaded=True)
+        self.assertEqual(self.limiter.limit, 1.0)
+        # Once per DECREASE_INTERVAL, and not below min_limit
+        self.limiter.acquire()
+        self.limiter.release(0.01, overloaded=True)
+        self.assertEqual(self.limiter.limit, 1.0)
+
+    def test_decrease_on_latency(self):
+        self.limiter.acquire()
+        self.limiter.release(limiter.LATENCY_THRESHOLD + 1)
+        self.assertEqual(self.limiter.limit, 1.0)
+
+    def test_call_not_made(self):
+        self.limiter.acquire()
+        self.limiter.release(None, overloaded=True)
+        self.assertEqual(self.limiter.limit, 2.0)
+        self.assertEqual(self.limiter.in_flight, 0)
+
+
+class OverloadTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.addCleanup(executor.set_backend, executor._BACKEND)
+        executor.set_backend("threads")
+        self.retry_interval = driver.TIME_BETWEEN_API_CALL_RETRIES
+        driver.TIME_BETWEEN_API_CALL_RETRIES = 0.001
+        limiter._LIMITERS.pop((simulator.HOST, "threads"), None)
+        metrics.REGISTRY.reset()
+        self.sim = simulator.Simulator(num_vms=2)
+        self.conn = self.sim.driver(watch_tasks=False)
+
+    def tearDown(self):
+        self.conn.close()
+        driver.TIME_BETWEEN_API_CALL_RETRIES = self.retry_interval
+        limiter._LIMITERS.pop((simulator.HOST, "threads"), None)
+
+    def test_overload_retried(self):
+        limit = limiter.get_limiter(simulator.HOST).limit
+        self.sim.inject_fault("RetrievePropertiesEx",
+                              httplib.CannotSendRequest(), count=2)
+        self.assertEqual(len(self.conn.list_instances()), 2)
+        self.assertEqual(self.sim.call_counts["RetrievePropertiesEx"], 3)
+        # The session is kept
+        self.assertEqual(self.sim.call_counts["Login"], 1)
+        self.assertEqual(self.sim.call_counts.get("Logout"), None)
+        self.assertEqual(
+            metrics.REGISTRY.snapshot()["RetrievePropertiesEx"]["retries"],
+            2)
+        self.assertTrue(limiter.get_limiter(simulator.HOST).limit < limit)
+
+    def test_overload_retries_exhausted(self):
+        self.sim.inject_fault("RetrievePropertiesEx",
+                              httplib.CannotSendRequest(),
+                              count=driver.API_RETRY_COUNT + 1)
+        self.assertRaises(Exception, self.conn.list_instances)
+        self.assertEqual(self.sim.call_counts["RetrievePropertiesEx"],
+                         driver.API_RETRY_COUNT + 1)
+
+    def test_traceback_kept(self):
+        self.sim.inject_fault("RetrievePropertiesEx",
+                              httplib.CannotSendRequest(),
+                              count=driver.API_RETRY_COUNT + 1)
+        try:
+            self.conn.list_instances()
+        except Exception:
+            frames = traceback.extract_tb(sys.exc_info()[2])
+        # Raised where the call failed, not where the retries ended
+        self.assertEqual(os.path.basename(frames[-1][0]).split(".")[0],
+                         "vim")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,130 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+"""
+Tests of the lookups of the host networks, against the simulator.
+"""
+
+import unittest
+
+from pyvmwareapi import executor
+from pyvmwareapi import network_util
+from pyvmwareapi import simulator
+from pyvmwareapi import vif as vmwarevif
+
+
+class NetworkLookupTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.addCleanup(executor.set_backend, executor._BACKEND)
+        executor.set_backend("threads")
+        self.sim = simulator.Simulator(num_vms=1)
+        self.conn = self.sim.driver(watch_tasks=False)
+        self.session = self.conn._session
+        # Nothing looked up yet
+        self.session._topology.invalidate()
+        self.sim.reset_call_counts()
+
+    def tearDown(self):
+        self.conn.close()
+
+    def test_one_retrieval(self):
+        networks = network_util.get_networks_with_the_names(
+                        self.session, [simulator.NETWORK_NAME, "missing"])
+        self.assertEqual(networks, {simulator.NETWORK_NAME: {
+                                        'type': 'Network',
+                                        'name': simulator.NETWORK_NAME}})
+        # Neither the network list nor the host is looked up on its own
+        self.assertEqual(self.sim.call_counts, {"RetrievePropertiesEx": 1})
+
+    def test_network_with_the_name(self):
+        self.assertEqual(network_util.get_network_with_the_name(
+                                self.session, "missing"), None)
+        self.assertEqual(network_util.get_network_with_the_name(
+                                self.session, simulator.NETWORK_NAME)['name'],
+                         simulator.NETWORK_NAME)
+
+
+class HostNetworkSnapshotTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.addCleanup(executor.set_backend, executor._BACKEND)
+        executor.set_backend("threads")
+        self.sim = simulator.Simulator(num_vms=1)
+        self.conn = self.sim.driver(watch_tasks=False)
+        self.session = self.conn._session
+        # The host is looked up once per session, not per snapshot
+        self.session._topology.get_host_ref()
+        self.sim.reset_call_counts()
+        self.refreshes = []
+        refresh = network_util.HostNetworkSnapshot.refresh
+
+        def _refresh(snapshot):
+            self.refreshes.append(snapshot)
+            return refresh(snapshot)
+        self.addCleanup(setattr, network_util.HostNetworkSnapshot,
+                        "refresh", refresh)
+        network_util.HostNetworkSnapshot.refresh = _refresh
+
+    def tearDown(self):
+        self.conn.close()
+
+    def _vif(self, pg, vlan, index):
+        return {'pg': pg, 'vlan': vlan,
+                'address': "00:50:56:00:00:%02x" % index}
+
+    def test_one_retrieval(self):
+        snapshot = network_util.HostNetworkSnapshot(self.session)
+        self.assertEqual(self.sim.call_counts, {"RetrievePropertiesEx": 1})
+        self.assertTrue(snapshot.has_pnic(simulator.PNIC_NAME))
+        self.assertFalse(snapshot.has_pnic("vmnic9"))
+        self.assertEqual(snapshot.get_vswitch_for_pnic(simulator.PNIC_NAME),
+                         simulator.VSWITCH_NAME)
+        self.assertEqual(snapshot.get_vswitch_for_pnic("vmnic9"), None)
+        port_group = snapshot.get_portgroup(simulator.NETWORK_NAME)
+        self.assertEqual(port_group.spec.vlanId, 0)
+        self.assertEqual(snapshot.get_portgroup("missing"), None)
+        self.assertEqual([p_gp.spec.name for p_gp in
+                          snapshot.get_portgroups_for_vlan("0")],
+                         [simulator.NETWORK_NAME])
+        self.assertEqual(snapshot.get_portgroups_for_vlan(100), [])
+        self.assertEqual(snapshot.get_network(simulator.NETWORK_NAME).value,
+                         self.sim.network.value)
+        self.assertEqual(snapshot.network_system.value,
+                         self.sim.network_system.value)
+        # The lookups are all answered from the snapshot
+        self.assertEqual(self.sim.call_counts, {"RetrievePropertiesEx": 1})
+
+    def test_refresh_after_add_port_group(self):
+        snapshot = network_util.HostNetworkSnapshot(self.session)
+        vmwarevif.ensure_vlan_bridge(self.session,
+                                     self._vif("pg-100", 100, 0),
+                                     snapshot=snapshot)
+        self.assertEqual(self.sim.call_counts["AddPortGroup"], 1)
+        self.assertEqual(len(self.refreshes), 2)
+        self.assertEqual(snapshot.get_portgroup("pg-100").spec.vlanId, 100)
+        self.assertEqual([p_gp.spec.name for p_gp in
+                          snapshot.get_portgroups_for_vlan(100)], ["pg-100"])
+        self.assertTrue(snapshot.get_network("pg-100") is not None)
+        # Existing now, the bridge is not added again
+        vmwarevif.ensure_vlan_bridge(self.session,
+                                     self._vif("pg-100", 100, 1),
+                                     snapshot=snapshot)
+        self.assertEqual(self.sim.call_counts["AddPortGroup"], 1)
+        self.assertEqual(len(self.refreshes), 2)
+
+    def test_spawn_four_nics(self):
+        for index in range(1, 4):
+            network_util.create_port_group(self.session, "pg-%d" % index,
+                                           simulator.VSWITCH_NAME, index)
+        network_info = [self._vif(simulator.NETWORK_NAME, 0, 0)]
+        network_info += [self._vif("pg-%d" % index, index, index)
+                         for index in range(1, 4)]
+        self.conn.spawn({'name': "new", 'vcpus': 1, 'memory_mb': 128},
+                        1024 * 1024, network_info)
+        # One network query for the four VIFs
+        self.assertEqual(len(self.refreshes), 1)
+        self.assertEqual(self.sim.call_counts["AddPortGroup"], 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
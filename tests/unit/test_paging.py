@@ -0,0 +1,80 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+"""
+Tests of the paged retrievals of the VMs, against the simulator.
+"""
+
+import threading
+import unittest
+
+from pyvmwareapi import executor
+from pyvmwareapi import simulator
+
+NUM_VMS = 5
+
+
+class PagingTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.addCleanup(executor.set_backend, executor._BACKEND)
+        executor.set_backend("threads")
+        self.sim = simulator.Simulator(num_vms=NUM_VMS)
+        self.conn = self.sim.driver(session_pool_size=1)
+        self.session = self.conn._session
+
+    def tearDown(self):
+        self.conn.close()
+
+    def _iter_names(self, max_objects):
+        for vm in self.session._iter_objects("get_objects_page",
+                                             "VirtualMachine", ["name"],
+                                             max_objects=max_objects):
+            yield vm.propSet[0].val
+
+    def test_list_in_one_call(self):
+        self.sim.reset_call_counts()
+        self.assertEqual(len(self.conn.list_instances()), NUM_VMS)
+        self.assertEqual(self.sim.call_counts["RetrievePropertiesEx"], 1)
+        self.assertEqual(self.sim.call_counts.get("ContinuePropertiesEx"),
+                         None)
+
+    def test_iter_instances(self):
+        self.assertEqual(list(self.conn.iter_instances()),
+                         self.conn.list_instances())
+
+    def test_iter_pages(self):
+        self.sim.reset_call_counts()
+        names = list(self._iter_names(2))
+        self.assertEqual(names, ["vm-%06d" % index
+                                 for index in range(NUM_VMS)])
+        self.assertEqual(self.sim.call_counts["RetrievePropertiesEx"], 1)
+        self.assertEqual(self.sim.call_counts["ContinuePropertiesEx"], 2)
+        self.assertEqual(self.sim._results, {})
+
+    def test_calls_between_pages(self):
+        # With a single session, the other calls are made between the
+        # pages instead of waiting for the iteration to end
+        infos = []
+
+        def _iterate():
+            for name in self._iter_names(1):
+                infos.append(self.conn.get_info({'name': name}))
+
+        thread = threading.Thread(target=_iterate)
+        thread.setDaemon(True)
+        thread.start()
+        thread.join(30)
+        self.assertFalse(thread.isAlive())
+        self.assertEqual(len(infos), NUM_VMS)
+
+    def test_abandon_cancels(self):
+        names = self._iter_names(2)
+        names.next()
+        names.close()
+        self.assertEqual(self.sim.call_counts["CancelRetrievePropertiesEx"],
+                         1)
+        self.assertEqual(self.sim._results, {})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,398 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+"""
+Tests of the HTTP transfers of the datastore files, against a local
+HTTP server standing in for the datastore.
+"""
+
+import BaseHTTPServer
+import hashlib
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from pyvmwareapi import error_util
+from pyvmwareapi import executor
+from pyvmwareapi import metrics
+from pyvmwareapi import read_write_util
+from pyvmwareapi import simulator
+
+COOKIE = "vmware_soap_session=session"
+FILE_SIZE = 3 * 64 * 1024 + 17
+CHUNK_SIZE = 16 * 1024
+RANGE_SIZE = 64 * 1024
+RANGE_RE = re.compile(r"bytes=(\d+)-(\d+)")
+
+
+class DatastoreHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Serves the files of the server, failing as the server is told."""
+
+    def log_message(self, *args):
+        pass
+
+    def _send_empty(self, status):
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def _send_validator(self, data):
+        if self.server.validator == "etag":
+            self.send_header("ETag", self.server.etag(data))
+        elif self.server.validator == "last_modified":
+            self.send_header("Last-Modified", self.server.last_modified)
+
+    def do_HEAD(self):
+        data = self.server.files.get(self.path)
+        if data is None:
+            self._send_empty(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(data)))
+        self._send_validator(data)
+        self.end_headers()
+
+    def do_PUT(self):
+        self.server.puts += 1
+        length = int(self.headers["Content-Length"])
+        if self.server.stalls:
+            # Neither reads the file nor answers for a while
+            self.server.stalls -= 1
+            time.sleep(self.server.stall_time)
+            self.close_connection = 1
+            return
+        if self.server.put_statuses:
+            self.rfile.read(length)
+            self._send_empty(self.server.put_statuses.pop(0))
+            return
+        if self.server.failures:
+            # Drops the connection a third of the way in
+            self.server.failures -= 1
+            self.rfile.read(length / 3)
+            self.close_connection = 1
+            return
+        self.server.files[self.path] = self.rfile.read(length)
+        self._send_empty(201)
+
+    def do_GET(self):
+        self.server.gets += 1
+        if self.server.gets == self.server.change_at:
+            # The file is written again between two ranges
+            self.server.files[self.path] = os.urandom(FILE_SIZE)
+            self.server.last_modified = "Tue, 01 Jan 2030 00:00:00 GMT"
+        data = self.server.files.get(self.path)
+        if data is None:
+            self._send_empty(404)
+            return
+        if self.server.validator == "etag":
+            if_match = self.headers.get("If-Match")
+            if if_match is not None and if_match != self.server.etag(data):
+                self._send_empty(412)
+                return
+            current = self.server.etag(data)
+        else:
+            current = self.server.last_modified
+        if_range = self.headers.get("If-Range")
+        match = RANGE_RE.match(self.headers.get("Range", ""))
+        if (self.server.ignore_range or not match or
+                (if_range is not None and if_range != current)):
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(data)))
+            self._send_validator(data)
+            self.end_headers()
+            self.wfile.write(data)
+            return
+        start, end = int(match.group(1)), int(match.group(2))
+        body = data[start:end + 1]
+        self.send_response(206)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Content-Range", "bytes %d-%d/%d" % (start, end,
+                                                              len(data)))
+        self._send_validator(data)
+        self.end_headers()
+        if self.server.failures:
+            # Drops the connection half way through the range
+            self.server.failures -= 1
+            body = body[:len(body) / 2]
+            self.close_connection = 1
+        self.wfile.write(body)
+
+
+class DatastoreServer(BaseHTTPServer.HTTPServer):
+
+    def __init__(self):
+        BaseHTTPServer.HTTPServer.__init__(self, ("127.0.0.1", 0),
+                                           DatastoreHandler)
+        # path -> contents
+        self.files = {}
+        # Requests to fail
+        self.failures = 0
+        self.puts = 0
+        self.gets = 0
+        # Statuses to answer the next PUTs with, instead of storing them
+        self.put_statuses = []
+        # PUTs to stall for stall_time seconds
+        self.stalls = 0
+        self.stall_time = 0
+        # Whether the GETs send the whole file whatever the Range
+        self.ignore_range = False
+        # The validator sent: "etag", "last_modified" or None
+        self.validator = "etag"
+        self.last_modified = "Mon, 01 Jan 2018 00:00:00 GMT"
+        # The GET before which the file is replaced, if any
+        self.change_at = None
+
+    def handle_error(self, request, client_address):
+        # The clients that timed out close their connections, as expected
+        pass
+
+    def etag(self, data):
+        return '"%s"' % hashlib.md5(data).hexdigest()
+
+    def url(self, name):
+        return "http://127.0.0.1:%d/folder/%s" % (self.server_port, name)
+
+
+class ServerTestCase(unittest.TestCase):
+    """Runs a local datastore server, with a local file to send."""
+
+    def setUp(self):
+        self.addCleanup(executor.set_backend, executor._BACKEND)
+        executor.set_backend("threads")
+        self.retry_interval = read_write_util.TIME_BETWEEN_RETRIES
+        read_write_util.TIME_BETWEEN_RETRIES = 0.001
+        metrics.REGISTRY.reset()
+        self.server = DatastoreServer()
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.setDaemon(True)
+        thread.start()
+        self.dir = tempfile.mkdtemp()
+        self.local_path = os.path.join(self.dir, "disk-flat.vmdk")
+        self.data = os.urandom(FILE_SIZE)
+        local_file = open(self.local_path, "wb")
+        local_file.write(self.data)
+        local_file.close()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.dir)
+        read_write_util.TIME_BETWEEN_RETRIES = self.retry_interval
+
+
+class TransferTestCase(ServerTestCase):
+
+    def setUp(self):
+        ServerTestCase.setUp(self)
+        self.download_path = os.path.join(self.dir, "download-flat.vmdk")
+
+    def _upload(self, **kwargs):
+        return read_write_util.upload_file(self.server.url("disk-flat.vmdk"),
+                                           COOKIE, self.local_path,
+                                           chunk_size=CHUNK_SIZE, **kwargs)
+
+    def test_upload(self):
+        progress = []
+        stats = self._upload(progress=lambda stats: progress.append(
+                                                        stats.bytes_sent))
+        self.assertEqual(self.server.files["/folder/disk-flat.vmdk"],
+                         self.data)
+        self.assertEqual(stats.attempts, 1)
+        self.assertEqual(stats.bytes_sent, FILE_SIZE)
+        self.assertEqual(progress[-1], FILE_SIZE)
+        self.assertEqual(progress, sorted(progress))
+
+    def test_upload_interrupted(self):
+        self.server.failures = 2
+        stats = self._upload()
+        self.assertEqual(self.server.files["/folder/disk-flat.vmdk"],
+                         self.data)
+        self.assertEqual(stats.attempts, 3)
+        # The bytes of the failed attempts are not counted
+        self.assertEqual(stats.bytes_sent, FILE_SIZE)
+        self.assertEqual(
+            metrics.REGISTRY.snapshot()["upload_file"]["retries"], 2)
+
+    def test_upload_retries_exhausted(self):
+        self.server.failures = 2
+        self.assertRaises(Exception, self._upload, retries=1)
+        self.assertEqual(self.server.puts, 2)
+        self.assertFalse("/folder/disk-flat.vmdk" in self.server.files)
+
+    def test_upload_server_error_retried(self):
+        self.server.put_statuses = [503]
+        stats = self._upload()
+        self.assertEqual(stats.attempts, 2)
+        self.assertEqual(self.server.files["/folder/disk-flat.vmdk"],
+                         self.data)
+
+    def test_upload_client_error_not_retried(self):
+        for status in (401, 403, 404):
+            self.server.puts = 0
+            self.server.put_statuses = [status]
+            try:
+                self._upload()
+            except error_util.HTTPStatusException, excep:
+                self.assertEqual(excep.status, status)
+            else:
+                self.fail("PUT did not fail")
+            self.assertEqual(self.server.puts, 1)
+        self.assertEqual(metrics.REGISTRY.snapshot().get("upload_file",
+                                                         {}).get("retries",
+                                                                 0), 0)
+
+    def test_upload_stalled(self):
+        self.addCleanup(setattr, read_write_util, "SOCKET_TIMEOUT",
+                        read_write_util.SOCKET_TIMEOUT)
+        read_write_util.SOCKET_TIMEOUT = 0.2
+        self.server.stalls = 1
+        self.server.stall_time = 0.3
+        stats = self._upload()
+        # The stalled PUT timed out and was sent again
+        self.assertTrue(stats.attempts > 1)
+        self.assertEqual(self.server.files["/folder/disk-flat.vmdk"],
+                         self.data)
+
+    def test_upload_existing_sent_again(self):
+        self._upload()
+        stats = self._upload()
+        self.assertFalse(stats.skipped)
+        self.assertEqual(self.server.puts, 2)
+
+    def test_upload_skip_existing(self):
+        self._upload()
+        stats = self._upload(skip_existing=True)
+        self.assertTrue(stats.skipped)
+        self.assertEqual(stats.bytes_sent, 0)
+        self.assertEqual(self.server.puts, 1)
+
+    def test_upload_skip_existing_other_size(self):
+        self.server.files["/folder/disk-flat.vmdk"] = "partial"
+        stats = self._upload(skip_existing=True)
+        self.assertFalse(stats.skipped)
+        self.assertEqual(self.server.files["/folder/disk-flat.vmdk"],
+                         self.data)
+
+    def _download(self, **kwargs):
+        self.server.files["/folder/disk-flat.vmdk"] = self.data
+        stats = read_write_util.download_file(
+                        self.server.url("disk-flat.vmdk"), COOKIE,
+                        self.download_path, streams=2, range_size=RANGE_SIZE,
+                        chunk_size=CHUNK_SIZE, **kwargs)
+        local_file = open(self.download_path, "rb")
+        try:
+            self.assertEqual(local_file.read(), self.data)
+        finally:
+            local_file.close()
+        return stats
+
+    def test_download(self):
+        progress = []
+        stats = self._download(progress=lambda stats: progress.append(
+                                                        stats.bytes_sent))
+        self.assertEqual(stats.total_bytes, FILE_SIZE)
+        self.assertEqual(stats.bytes_sent, FILE_SIZE)
+        self.assertEqual(stats.attempts, 4)
+        self.assertEqual(progress[-1], FILE_SIZE)
+
+    def test_download_truncated_ranges(self):
+        self.server.failures = 2
+        stats = self._download()
+        self.assertEqual(stats.attempts, 6)
+        # The bytes of the failed ranges are not counted
+        self.assertEqual(stats.bytes_sent, FILE_SIZE)
+        self.assertEqual(
+            metrics.REGISTRY.snapshot()["download_file"]["retries"], 2)
+
+    def test_download_retries_exhausted(self):
+        self.server.failures = 1
+        self.assertRaises(Exception, self._download, retries=0)
+        # The other ranges were cancelled and the partial file deleted
+        self.assertTrue(self.server.gets <= 2)
+        self.assertFalse(os.path.exists(self.download_path))
+
+    def test_download_range_ignored(self):
+        self.server.ignore_range = True
+        self.assertRaises(Exception, self._download, retries=0)
+        self.assertFalse(os.path.exists(self.download_path))
+
+    def test_download_changed(self):
+        self.server.change_at = 1
+        self.assertRaises(error_util.FileChangedException, self._download)
+        # Not fetched again, the file is no longer the one asked for, and
+        # only the ranges of the 2 streams already started were sent
+        self.assertTrue(self.server.gets <= 2)
+        self.assertFalse(os.path.exists(self.download_path))
+
+    def test_download_changed_last_modified(self):
+        self.server.validator = "last_modified"
+        self.server.change_at = 2
+        self.assertRaises(error_util.FileChangedException, self._download)
+        self.assertFalse(os.path.exists(self.download_path))
+
+    def test_download_last_modified(self):
+        self.server.validator = "last_modified"
+        self.assertEqual(self._download().bytes_sent, FILE_SIZE)
+
+    def test_download_without_validator(self):
+        self.server.validator = None
+        self.assertEqual(self._download().bytes_sent, FILE_SIZE)
+
+    def test_download_missing(self):
+        self.assertRaises(Exception, read_write_util.download_file,
+                          self.server.url("missing-flat.vmdk"), COOKIE,
+                          os.path.join(self.dir, "missing-flat.vmdk"))
+
+
+class ImageTestCase(ServerTestCase):
+    """The transfers of a driver connected to the simulator."""
+
+    def setUp(self):
+        ServerTestCase.setUp(self)
+        self.sim = simulator.Simulator()
+        self.conn = self.sim.driver(watch_tasks=False)
+        # The datastore files are served by the local server
+        session = self.conn._session
+        session._host_ip = "127.0.0.1:%d" % self.server.server_port
+        session._scheme = "http"
+
+    def tearDown(self):
+        self.conn.close()
+        ServerTestCase.tearDown(self)
+
+    def _files(self, name):
+        return [data for path, data in self.server.files.items()
+                if path.startswith("/folder/%s?" % name)]
+
+    def test_upload_session_returned(self):
+        checked_out = []
+        pool = self.conn._session._pool
+        self.conn.upload_image(self.local_path,
+                               "[datastore1] images/disk-flat.vmdk",
+                               progress=lambda stats: checked_out.append(
+                                                len(pool._checked_out)))
+        self.assertEqual(self._files("images/disk-flat.vmdk"), [self.data])
+        # The session was back in the pool while the file was sent
+        self.assertTrue(checked_out)
+        self.assertEqual(set(checked_out), set([0]))
+
+    def test_spawn_image_thin(self):
+        disk_types = []
+        invoke = self.sim.invoke
+
+        def _invoke(vim_obj, method, managed_object, kwargs):
+            if method == "CreateVirtualDisk_Task":
+                disk_types.append(kwargs['spec'].diskType)
+            return invoke(vim_obj, method, managed_object, kwargs)
+        self.sim.invoke = _invoke
+        self.conn.spawn({'name': "new", 'vcpus': 1, 'memory_mb': 128,
+                         'image': self.local_path}, None)
+        self.assertEqual(disk_types, ["thin"])
+        self.assertEqual(self._files("new/new-flat.vmdk"), [self.data])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,174 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+"""
+Tests of the session pool, alone and under the sessions of a driver
+connected to the simulator.
+"""
+
+import threading
+import unittest
+
+from pyvmwareapi import executor
+from pyvmwareapi import session_pool
+from pyvmwareapi import simulator
+
+
+class FakeSession(object):
+
+    def __init__(self, number):
+        self.number = number
+        self.active = True
+
+
+class VimSessionPoolTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.addCleanup(executor.set_backend, executor._BACKEND)
+        executor.set_backend("threads")
+        self.created = []
+        self.destroyed = []
+
+    def _create(self):
+        vim = FakeSession(len(self.created))
+        self.created.append(vim)
+        return vim
+
+    def _pool(self, **kwargs):
+        return session_pool.VimSessionPool(self._create,
+                                           self.destroyed.append,
+                                           lambda vim: vim.active, **kwargs)
+
+    def test_reuse(self):
+        pool = self._pool()
+        vim = pool.get()
+        pool.put(vim)
+        self.assertTrue(pool.get() is vim)
+        self.assertEqual(len(self.created), 1)
+
+    def test_create_up_to_max_size(self):
+        pool = self._pool(max_size=2)
+        first = pool.get()
+        second = pool.get()
+        self.assertFalse(first is second)
+        pool.put(first)
+        pool.put(second)
+        pool.get()
+        self.assertEqual(len(self.created), 2)
+
+    def test_discard(self):
+        pool = self._pool()
+        vim = pool.get()
+        pool.put(vim, discard=True)
+        self.assertEqual(self.destroyed, [vim])
+        self.assertFalse(pool.get() is vim)
+
+    def test_inactive_session_replaced(self):
+        pool = self._pool(check_interval=0)
+        vim = pool.get()
+        pool.put(vim)
+        vim.active = False
+        self.assertFalse(pool.get() is vim)
+        self.assertEqual(self.destroyed, [vim])
+
+    def test_idle_timeout(self):
+        pool = self._pool(max_size=2, idle_timeout=0)
+        first = pool.get()
+        second = pool.get()
+        pool.put(first)
+        pool.put(second)
+        # The most recently used session is kept
+        self.assertTrue(pool.get() is second)
+        self.assertEqual(self.destroyed, [first])
+
+    def test_take_preferred(self):
+        pool = self._pool(max_size=2)
+        first = pool.get()
+        second = pool.get()
+        pool.put(first)
+        pool.put(second)
+        self.assertTrue(pool.get(first) is first)
+
+    def test_take_preferred_waits(self):
+        pool = self._pool(max_size=2)
+        vim = pool.get()
+        taken = []
+        thread = threading.Thread(target=lambda: taken.append(pool.get(vim)))
+        thread.setDaemon(True)
+        thread.start()
+        thread.join(0.1)
+        self.assertEqual(taken, [])
+        # Woken up by the return of the session
+        pool.put(vim)
+        thread.join(10)
+        self.assertEqual(taken, [vim])
+
+    def test_take_preferred_discarded(self):
+        pool = self._pool(max_size=2)
+        vim = pool.get()
+        errors = []
+
+        def _take():
+            try:
+                pool.get(vim)
+            except Exception, excep:
+                errors.append(excep)
+
+        thread = threading.Thread(target=_take)
+        thread.setDaemon(True)
+        thread.start()
+        thread.join(0.1)
+        pool.put(vim, discard=True)
+        thread.join(10)
+        self.assertEqual(len(errors), 1)
+
+    def test_take_logged_out(self):
+        pool = self._pool()
+        vim = pool.get()
+        pool.put(vim, discard=True)
+        self.assertRaises(Exception, pool.get, vim)
+
+    def test_close(self):
+        pool = self._pool(max_size=2)
+        first = pool.get()
+        second = pool.get()
+        pool.put(first)
+        pool.put(second)
+        pool.close()
+        self.assertEqual(self.destroyed, [first, second])
+
+
+class DriverSessionTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.addCleanup(executor.set_backend, executor._BACKEND)
+        executor.set_backend("threads")
+        self.sim = simulator.Simulator(num_vms=2)
+        self.conn = self.sim.driver(watch_tasks=False)
+
+    def tearDown(self):
+        self.conn.close()
+
+    def test_sessions_reused(self):
+        for index in range(5):
+            self.conn.list_instances()
+        self.assertEqual(self.sim.call_counts["Login"], 1)
+        self.assertEqual(self.sim.call_counts.get("Logout"), None)
+
+    def test_close_logs_out(self):
+        self.conn.list_instances()
+        self.conn.close()
+        self.assertEqual(self.sim.call_counts["Logout"],
+                         self.sim.call_counts["Login"])
+        self.assertEqual(self.sim._sessions, {})
+        # Sessions are created again as they are needed
+        self.assertEqual(len(self.conn.list_instances()), 2)
+
+    def test_expired_session_replaced(self):
+        self.sim.inject_fault("RetrievePropertiesEx")
+        self.assertEqual(len(self.conn.list_instances()), 2)
+        self.assertEqual(self.sim.call_counts["Login"], 2)
+        self.assertEqual(self.sim.call_counts["Logout"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,95 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+"""
+Tests of the property collector of the simulator: the versions and the
+truncation of the UpdateSets of WaitForUpdatesEx.
+"""
+
+import unittest
+
+from pyvmwareapi import error_util
+from pyvmwareapi import executor
+from pyvmwareapi import simulator
+from pyvmwareapi import vim_util
+
+NUM_VMS = 5
+
+
+class WaitForUpdatesTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.addCleanup(executor.set_backend, executor._BACKEND)
+        executor.set_backend("threads")
+        self.sim = simulator.Simulator(num_vms=NUM_VMS)
+        self.conn = self.sim.driver(watch_tasks=False)
+        self.vim = self.conn._session._get_vim()
+        service_content = self.vim.get_service_content()
+        self.collector = self.vim.CreatePropertyCollector(
+                                    service_content.propertyCollector)
+        spec = vim_util.get_spec_cache(
+                    self.vim.client.factory).get_objects_filter_spec(
+                        service_content.rootFolder, "VirtualMachine",
+                        ["name"])
+        self.vim.CreateFilter(self.collector, spec=spec,
+                              partialUpdates=False)
+
+    def tearDown(self):
+        self.conn.close()
+
+    def _wait(self, version="", max_updates=None):
+        options = self.vim.client.factory.create('ns0:WaitOptions')
+        options.maxWaitSeconds = 0
+        options.maxObjectUpdates = max_updates
+        return self.vim.WaitForUpdatesEx(self.collector, version=version,
+                                         options=options)
+
+    def _updates(self, update_set):
+        return [(object_update.kind, object_update.obj.value)
+                for filter_update in update_set.filterSet
+                for object_update in filter_update.objectSet]
+
+    def test_version(self):
+        first = self._wait()
+        self.assertEqual(len(self._updates(first)), NUM_VMS)
+        self.assertEqual(self._wait(first.version), None)
+        self.conn.destroy({'name': "vm-000001"})
+        update_set = self._wait(first.version)
+        self.assertEqual([kind for kind, value in
+                          self._updates(update_set)], ["leave"])
+
+    def test_older_version_replayed(self):
+        first = self._wait()
+        self.conn.destroy({'name': "vm-000001"})
+        self._wait(first.version)
+        # The updates since the first version are sent again
+        self.assertEqual(len(self._updates(self._wait(first.version))), 1)
+        # And all the objects for an empty version
+        self.assertEqual(len(self._updates(self._wait())), NUM_VMS - 1)
+
+    def test_unknown_version(self):
+        try:
+            self._wait("unknown")
+        except error_util.VimFaultException, excep:
+            self.assertEqual(excep.fault_list,
+                             [simulator.FAULT_INVALID_COLLECTOR_VERSION])
+        else:
+            self.fail("WaitForUpdatesEx accepted an unknown version")
+
+    def test_truncated(self):
+        values = []
+        version = ""
+        while True:
+            update_set = self._wait(version, max_updates=2)
+            updates = self._updates(update_set)
+            self.assertTrue(len(updates) <= 2)
+            values.extend([value for kind, value in updates])
+            version = update_set.version
+            if not update_set.truncated:
+                break
+        self.assertEqual(len(values), NUM_VMS)
+        self.assertEqual(len(set(values)), NUM_VMS)
+        self.assertEqual(self._wait(version), None)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,76 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+"""
+Tests of the calls made by spawn, with the disk created inline in the
+CreateVM spec or apart from it, against the simulator.
+"""
+
+import unittest
+
+from pyvmwareapi import executor
+from pyvmwareapi import simulator
+
+DISK_CALLS = ["CreateVirtualDisk_Task", "ReconfigVM_Task",
+              "CopyVirtualDisk_Task", "DeleteDatastoreFile_Task"]
+
+
+class SpawnTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.addCleanup(executor.set_backend, executor._BACKEND)
+        executor.set_backend("threads")
+        self.sim = simulator.Simulator(num_vms=1)
+        # method -> kwargs of each call
+        self.calls = {}
+        invoke = self.sim.invoke
+
+        def _invoke(vim_obj, method, managed_object, kwargs):
+            self.calls.setdefault(method, []).append(kwargs)
+            return invoke(vim_obj, method, managed_object, kwargs)
+        self.sim.invoke = _invoke
+
+    def _spawn(self, disk_size, **kwargs):
+        conn = self.sim.driver(watch_tasks=False, **kwargs)
+        try:
+            conn.spawn({'name': "new", 'vcpus': 1, 'memory_mb': 128},
+                       disk_size)
+            self.assertTrue("new" in conn.list_instances())
+        finally:
+            conn.close()
+
+    def _inline_disk(self):
+        config = self.calls["CreateVM_Task"][0]['config']
+        disks = [device_change.device
+                 for device_change in config.deviceChange
+                 if device_change.device.__class__.__name__ == "VirtualDisk"]
+        self.assertEqual(len(disks), 1)
+        return disks[0]
+
+    def test_inline_disk(self):
+        self._spawn(1024 * 1024, inline_disk=True)
+        self.assertEqual(len(self.calls["CreateVM_Task"]), 1)
+        for method in DISK_CALLS:
+            self.assertFalse(method in self.calls, method)
+        self.assertEqual(self._inline_disk().capacityInKB, 1024)
+
+    def test_disk_apart(self):
+        self._spawn(1024 * 1024)
+        self.assertEqual(len(self.calls["CreateVM_Task"]), 1)
+        self.assertEqual(len(self.calls["CreateVirtualDisk_Task"]), 1)
+        self.assertEqual(len(self.calls["ReconfigVM_Task"]), 1)
+        self.assertEqual(
+            self.calls["CreateVirtualDisk_Task"][0]['spec'].capacityKb, 1024)
+
+    def test_size_rounded_up_inline(self):
+        # Never smaller than asked, a partial KB is a whole one
+        self._spawn(1024 * 1024 + 1, inline_disk=True)
+        self.assertEqual(self._inline_disk().capacityInKB, 1025)
+
+    def test_size_rounded_up(self):
+        self._spawn(1)
+        self.assertEqual(
+            self.calls["CreateVirtualDisk_Task"][0]['spec'].capacityKb, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
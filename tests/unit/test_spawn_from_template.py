@@ -0,0 +1,152 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+"""
+Tests of the spawn of a VM as a linked or full clone of a template VM,
+against the simulator.
+"""
+
+import copy
+import unittest
+
+from pyvmwareapi import executor
+from pyvmwareapi import simulator
+from pyvmwareapi import vm_util
+
+
+class SpawnFromTemplateTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.addCleanup(executor.set_backend, executor._BACKEND)
+        executor.set_backend("threads")
+        self.sim = simulator.Simulator(num_vms=1)
+        # method -> kwargs of each call, as sent: the simulator sets the
+        # keys of the devices added
+        self.calls = {}
+        invoke = self.sim.invoke
+
+        def _invoke(vim_obj, method, managed_object, kwargs):
+            self.calls.setdefault(method, []).append(copy.deepcopy(kwargs))
+            return invoke(vim_obj, method, managed_object, kwargs)
+        self.sim.invoke = _invoke
+        self.conn = self.sim.driver(watch_tasks=False)
+        self.session = self.conn._session
+        self.conn.spawn({'name': "template", 'vcpus': 1, 'memory_mb': 128},
+                        1024 * 1024, [self._vif(simulator.NETWORK_NAME, 0)])
+
+    def tearDown(self):
+        self.conn.close()
+
+    def _vif(self, pg, index):
+        return {'pg': pg, 'vlan': 0,
+                'address': "00:50:56:00:00:%02x" % index}
+
+    def _snapshot(self):
+        template_ref = vm_util.get_vm_ref(self.session, {'name': "template"})
+        task = self.session._call_method(self.session._get_vim(),
+                                         "CreateSnapshot_Task", template_ref,
+                                         name="base", memory=False,
+                                         quiesce=False)
+        self.session._wait_for_task("template", task)
+        return self._vm("template").props["snapshot"].currentSnapshot
+
+    def _vm(self, name):
+        vm_ref = vm_util.get_vm_ref(self.session, {'name': name})
+        self.assertTrue(vm_ref is not None, name)
+        return self.sim._objects[vm_ref.value]
+
+    def _devices(self, name, class_name):
+        return [device for device in
+                self._vm(name).props["config"].hardware.device
+                if device.__class__.__name__ == class_name]
+
+    def _clone_spec(self):
+        self.assertEqual(len(self.calls["CloneVM_Task"]), 1)
+        return self.calls["CloneVM_Task"][0]['spec']
+
+    def test_linked_clone(self):
+        snapshot_ref = self._snapshot()
+        self.conn.spawn_from_template("template",
+                                      {'name': "new", 'vcpus': 2,
+                                       'memory_mb': 256})
+        clone_spec = self._clone_spec()
+        self.assertEqual(clone_spec.location.diskMoveType,
+                         "createNewChildDiskBacking")
+        self.assertEqual(clone_spec.snapshot.value, snapshot_ref.value)
+        self.assertTrue(clone_spec.powerOn)
+        vm = self._vm("new")
+        self.assertEqual(vm.props["runtime"].powerState, "poweredOn")
+        self.assertEqual(vm.props["config"].hardware.numCPU, 2)
+        self.assertEqual(vm.props["config"].hardware.memoryMB, 256)
+        # A child disk of the one of the template
+        disks = self._devices("new", "VirtualDisk")
+        self.assertEqual(len(disks), 1)
+        parent = disks[0].backing.parent
+        self.assertTrue(parent is not None)
+        self.assertEqual(parent.fileName,
+                         self._devices("template",
+                                       "VirtualDisk")[0].backing.fileName)
+
+    def test_full_clone(self):
+        # No snapshot is needed to copy the disks
+        self.conn.spawn_from_template("template",
+                                      {'name': "new", 'vcpus': 1,
+                                       'memory_mb': 128}, linked=False)
+        clone_spec = self._clone_spec()
+        self.assertEqual(clone_spec.location.diskMoveType,
+                         "moveAllDiskBackingsAndDisallowSharing")
+        self.assertEqual(clone_spec.snapshot, None)
+        disks = self._devices("new", "VirtualDisk")
+        self.assertEqual(len(disks), 1)
+        self.assertEqual(disks[0].backing.parent, None)
+
+    def test_full_clone_snapshot_unused(self):
+        self._snapshot()
+        self.conn.spawn_from_template("template",
+                                      {'name': "new", 'vcpus': 1,
+                                       'memory_mb': 128}, linked=False)
+        self.assertEqual(self._clone_spec().snapshot, None)
+
+    def test_linked_clone_no_snapshot(self):
+        try:
+            self.conn.spawn_from_template("template",
+                                          {'name': "new", 'vcpus': 1,
+                                           'memory_mb': 128})
+        except Exception, excep:
+            self.assertTrue("has no snapshot" in str(excep), str(excep))
+        else:
+            self.fail("A linked clone was made without a snapshot")
+        self.assertFalse("CloneVM_Task" in self.calls)
+
+    def test_template_not_found(self):
+        self.assertRaises(Exception, self.conn.spawn_from_template,
+                          "missing", {'name': "new", 'vcpus': 1,
+                                      'memory_mb': 128})
+        self.assertFalse("CloneVM_Task" in self.calls)
+
+    def test_nics_replaced(self):
+        self._snapshot()
+        template_nic = self._devices("template", "VirtualPCNet32")[0]
+        network_info = [self._vif(simulator.NETWORK_NAME, index)
+                        for index in range(1, 3)]
+        self.conn.spawn_from_template("template",
+                                      {'name': "new", 'vcpus': 1,
+                                       'memory_mb': 128},
+                                      network_info=network_info)
+        device_change = self._clone_spec().config.deviceChange
+        removed = [spec.device for spec in device_change
+                   if spec.operation == "remove"]
+        self.assertEqual([device.key for device in removed],
+                         [template_nic.key])
+        added = [spec.device for spec in device_change
+                 if spec.operation == "add"]
+        self.assertEqual([device.key for device in added], [-47, -48])
+        self.assertEqual([device.macAddress for device in added],
+                         [vif['address'] for vif in network_info])
+        # The clone has the NICs of the instance only
+        self.assertEqual(sorted(device.macAddress for device in
+                                self._devices("new", "VirtualPCNet32")),
+                         [vif['address'] for vif in network_info])
+
+
+if __name__ == "__main__":
+    unittest.main()
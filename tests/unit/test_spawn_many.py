@@ -0,0 +1,81 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+"""
+Tests of the parallel spawn of many instances, against the simulator,
+under the default eventlet backend.
+"""
+
+import unittest
+
+from pyvmwareapi import executor
+from pyvmwareapi import simulator
+
+try:
+    import eventlet
+except ImportError:
+    eventlet = None
+
+NUM_INSTANCES = 4
+LATENCY = 0.02
+
+
+@unittest.skipIf(eventlet is None, "eventlet is not installed")
+class SpawnManyTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.addCleanup(executor.set_backend, executor._BACKEND)
+        executor.set_backend("eventlet")
+        self.sim = simulator.Simulator(num_vms=1, latency=LATENCY)
+        self.conn = self.sim.driver()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        invoke = self.sim.invoke
+
+        def _invoke(vim_obj, method, managed_object, kwargs):
+            # The watcher waits for the task updates all along
+            if method == "WaitForUpdatesEx":
+                return invoke(vim_obj, method, managed_object, kwargs)
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            try:
+                return invoke(vim_obj, method, managed_object, kwargs)
+            finally:
+                self.in_flight -= 1
+        self.sim.invoke = _invoke
+
+    def tearDown(self):
+        self.conn.close()
+
+    def _instances(self):
+        return [({'name': "new-%d" % index, 'vcpus': 1, 'memory_mb': 128},
+                 1024 * 1024, None) for index in range(NUM_INSTANCES)]
+
+    def test_calls_overlap(self):
+        results = self.conn.spawn_many(self._instances(),
+                                       concurrency=NUM_INSTANCES)
+        self.assertEqual([result['state'] for result in results],
+                         ["success"] * NUM_INSTANCES)
+        self.assertTrue(self.max_in_flight > 1)
+        self.assertEqual(len(self.conn.list_instances()), NUM_INSTANCES + 1)
+
+    def test_errors_reported(self):
+        instances = self._instances()
+        instances[1][0]['name'] = "vm-000000"
+        results = self.conn.spawn_many(instances, concurrency=NUM_INSTANCES)
+        self.assertEqual([result['state'] for result in results],
+                         ["success", "error", "success", "success"])
+        self.assertTrue('exists' in results[1]['error'])
+
+    def test_async_driver(self):
+        conn = self.sim.async_driver()
+        try:
+            handle = conn.spawn_many(self._instances(),
+                                     concurrency=NUM_INSTANCES)
+            self.assertEqual([result['state'] for result in handle.wait()],
+                             ["success"] * NUM_INSTANCES)
+        finally:
+            conn.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,97 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+"""
+Tests of the waits for the tasks, followed by the task watcher or
+polled, against the simulator.
+"""
+
+import unittest
+
+from pyvmwareapi import driver
+from pyvmwareapi import executor
+from pyvmwareapi import simulator
+from pyvmwareapi import vm_util
+
+
+try:
+    import eventlet
+except ImportError:
+    eventlet = None
+
+
+class TaskWaitTests(object):
+    """The tests of both ways of waiting for the tasks."""
+
+    backend = "threads"
+
+    def setUp(self):
+        self.addCleanup(executor.set_backend, executor._BACKEND)
+        executor.set_backend(self.backend)
+        self.poll_interval = driver.TASK_POLL_INTERVAL
+        driver.TASK_POLL_INTERVAL = 0.01
+        self.sim = simulator.Simulator(num_vms=1, task_duration=0.1)
+        self.conn = self.sim.driver(watch_tasks=self.watch_tasks)
+        self.session = self.conn._session
+        self.vm_ref = vm_util.get_vm_ref_from_name(self.session,
+                                                   "vm-000000")
+        self.sim.reset_call_counts()
+
+    def tearDown(self):
+        self.conn.close()
+        driver.TASK_POLL_INTERVAL = self.poll_interval
+
+    def _power_off(self):
+        task_ref = self.session._call_method(self.session._get_vim(),
+                                             "PowerOffVM_Task", self.vm_ref)
+        return self.session._wait_for_task("vm-000000", task_ref)
+
+    def _assert_waited(self):
+        raise NotImplementedError()
+
+    def test_success(self):
+        self.assertEqual(self._power_off(), "success")
+        self._assert_waited()
+        self.assertEqual(self.conn.get_info({'name': "vm-000000"})['state'],
+                         "poweredOff")
+
+    def test_error(self):
+        self._power_off()
+        self.assertRaises(Exception, self._power_off)
+
+
+class TaskWatcherTestCase(TaskWaitTests, unittest.TestCase):
+
+    watch_tasks = True
+
+    def _assert_waited(self):
+        self.assertTrue(self.sim.call_counts["WaitForUpdatesEx"] > 0)
+        self.assertEqual(self.sim.call_counts.get("RetrieveProperties"),
+                         None)
+
+    def test_watcher_failure_polled(self):
+        self.sim.inject_fault("CreateFilter")
+        self.assertEqual(self._power_off(), "success")
+        self.assertEqual(self.sim.call_counts.get("WaitForUpdatesEx"), None)
+        # The watcher connects again for the next task
+        self.sim.reset_call_counts()
+        self.assertRaises(Exception, self._power_off)
+        self.assertTrue(self.sim.call_counts["WaitForUpdatesEx"] > 0)
+
+
+@unittest.skipIf(eventlet is None, "eventlet is not installed")
+class EventletTaskWatcherTestCase(TaskWatcherTestCase):
+
+    backend = "eventlet"
+
+
+class TaskPollTestCase(TaskWaitTests, unittest.TestCase):
+
+    watch_tasks = False
+
+    def _assert_waited(self):
+        self.assertEqual(self.sim.call_counts.get("WaitForUpdatesEx"), None)
+        self.assertTrue(self.sim.call_counts["RetrieveProperties"] > 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
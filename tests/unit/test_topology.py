@@ -0,0 +1,93 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+"""
+Tests of the cache of the topology references, against the simulator.
+"""
+
+import time
+import unittest
+
+from pyvmwareapi import error_util
+from pyvmwareapi import executor
+from pyvmwareapi import simulator
+from pyvmwareapi import topology
+from pyvmwareapi import vim_util
+
+
+class TopologyCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.addCleanup(executor.set_backend, executor._BACKEND)
+        executor.set_backend("threads")
+        self.sim = simulator.Simulator(num_vms=1)
+        self.conn = self.sim.driver(watch_tasks=False)
+        self.session = self.conn._session
+        self.topology = self.session._topology
+        self.topology.invalidate()
+        # Names of the references looked up, not read from the cache
+        self.lookups = []
+        for name in ["datacenter_ref_and_name", "vmfolder_ref",
+                     "res_pool_ref", "host_ref", "cluster_ref"]:
+            self._count_lookups(self.topology, name)
+
+    def tearDown(self):
+        self.conn.close()
+
+    def _count_lookups(self, cache, name):
+        lookup_func = getattr(cache, "_lookup_" + name)
+
+        def _lookup(*args):
+            self.lookups.append(name)
+            return lookup_func(*args)
+        setattr(cache, "_lookup_" + name, _lookup)
+
+    def test_cached(self):
+        host = self.topology.get_host_ref()
+        self.assertEqual(self.topology.get_host_ref().value, host.value)
+        self.assertEqual(self.lookups, ["host_ref"])
+
+    def test_ttl_expiry(self):
+        cache = topology.TopologyCache(self.session, ttl=0.05)
+        self._count_lookups(cache, "host_ref")
+        cache.get_host_ref()
+        cache.get_host_ref()
+        self.assertEqual(self.lookups, ["host_ref"])
+        time.sleep(0.1)
+        cache.get_host_ref()
+        self.assertEqual(self.lookups, ["host_ref", "host_ref"])
+
+    def test_invalidate(self):
+        self.topology.get_vmfolder_ref()
+        self.conn.invalidate_topology()
+        self.topology.get_vmfolder_ref()
+        self.assertEqual(self.lookups, ["vmfolder_ref", "vmfolder_ref"])
+
+    def test_none_not_cached(self):
+        self.assertEqual(self.topology.get_cluster_ref("missing"), None)
+        self.assertEqual(self.topology.get_cluster_ref("missing"), None)
+        self.assertEqual(self.lookups, ["cluster_ref", "cluster_ref"])
+
+    def test_invalidated_on_object_not_found(self):
+        self.topology.get_res_pool_ref()
+        gone = simulator.ManagedObjectReference("HostSystem", "host-gone")
+        self.assertRaises(error_util.VimFaultException,
+                          self.session._call_method, vim_util,
+                          "get_dynamic_property", gone, "HostSystem", "name")
+        self.topology.get_res_pool_ref()
+        self.assertEqual(self.lookups, ["res_pool_ref", "res_pool_ref"])
+
+    def test_spawn_lookups(self):
+        self.conn.spawn({'name': "new-0", 'vcpus': 1, 'memory_mb': 128},
+                        1024 * 1024)
+        self.assertEqual(sorted(self.lookups), ["datacenter_ref_and_name",
+                                                "res_pool_ref",
+                                                "vmfolder_ref"])
+        # The next spawns read them all from the cache
+        del self.lookups[:]
+        self.conn.spawn({'name': "new-1", 'vcpus': 1, 'memory_mb': 128},
+                        1024 * 1024)
+        self.assertEqual(self.lookups, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
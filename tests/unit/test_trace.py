@@ -0,0 +1,134 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+"""
+Tests of the spans and call counters of the VM operations, against the
+simulator.
+"""
+
+import unittest
+
+from pyvmwareapi import driver
+from pyvmwareapi import error_util
+from pyvmwareapi import executor
+from pyvmwareapi import simulator
+from pyvmwareapi import trace
+
+
+class TraceTestCase(unittest.TestCase):
+
+    watch_tasks = True
+    task_duration = 0.01
+
+    def setUp(self):
+        self.addCleanup(executor.set_backend, executor._BACKEND)
+        executor.set_backend("threads")
+        self.sim = simulator.Simulator(num_vms=3,
+                                       task_duration=self.task_duration)
+        self.conn = self.sim.driver(watch_tasks=self.watch_tasks)
+
+    def tearDown(self):
+        trace.set_sink(None)
+        self.conn.close()
+
+    def _instance(self, name):
+        return {'name': name, 'vcpus': 1, 'memory_mb': 128}
+
+    def _spawn(self, name):
+        self.conn.spawn(self._instance(name), 1024 * 1024)
+
+    def test_count_calls(self):
+        with trace.count_calls() as counter:
+            self._spawn("new")
+        self.assertEqual(counter.counts["CreateVM_Task"], 1)
+        self.assertEqual(counter.total, sum(counter.counts.values()))
+
+    def test_counts_deterministic(self):
+        # Warms up the topology and the task watcher
+        self._spawn("first")
+        counters = []
+        for name in ["second", "third", "fourth"]:
+            with trace.count_calls() as counter:
+                self._spawn(name)
+            counters.append(counter.counts)
+        self.assertEqual(counters[1], counters[0])
+        self.assertEqual(counters[2], counters[0])
+        self.assertFalse("WaitForUpdatesEx" in counters[0])
+        self.assertFalse("CreateFilter" in counters[0])
+
+    def test_budget_exceeded(self):
+        def _spawn_within_budget():
+            with trace.count_calls(1):
+                self._spawn("new")
+        self.assertRaises(error_util.CallBudgetExceeded,
+                          _spawn_within_budget)
+
+    def test_method_budget_exceeded(self):
+        def _list_within_budget():
+            with trace.count_calls(RetrievePropertiesEx=0):
+                self.conn.list_instances()
+        self.assertRaises(error_util.CallBudgetExceeded,
+                          _list_within_budget)
+
+    def test_within_budget(self):
+        with trace.count_calls(10, RetrievePropertiesEx=1) as counter:
+            self.conn.list_instances()
+        self.assertEqual(counter.counts, {"RetrievePropertiesEx": 1})
+
+    def test_spawn_many_counted(self):
+        with trace.count_calls() as counter:
+            self.conn.spawn_many([(self._instance("a"), 1024 * 1024, None),
+                                  (self._instance("b"), 1024 * 1024, None)])
+        self.assertEqual(counter.counts["CreateVM_Task"], 2)
+
+    def test_spans(self):
+        sink = trace.ListSink()
+        trace.set_sink(sink)
+        with trace.count_calls() as counter:
+            self._spawn("new")
+        spans = dict((span['id'], span) for span in sink.spans)
+        spawn = [span for span in sink.spans if span['name'] == "spawn"][0]
+        self.assertEqual(spawn['instance'], "new")
+        self.assertEqual(spawn['parent'], None)
+        self.assertEqual(spawn['error'], None)
+        self.assertEqual(spawn['soap_calls'], counter.total)
+        for span in sink.spans:
+            if span is not spawn:
+                self.assertTrue(span['parent'] in spans)
+        waits = [span for span in sink.spans
+                 if span['name'] == "wait_for_task"]
+        self.assertTrue(waits)
+        for span in waits:
+            self.assertTrue(span['task'])
+
+    def test_span_error(self):
+        sink = trace.ListSink()
+        trace.set_sink(sink)
+        self.assertRaises(Exception, self._spawn, "vm-000000")
+        spawn = [span for span in sink.spans if span['name'] == "spawn"][0]
+        self.assertTrue(spawn['error'])
+
+
+class PolledTraceTestCase(TraceTestCase):
+
+    watch_tasks = False
+    # The tasks complete before their first poll, for the same number of
+    # polls every time
+    task_duration = 0.0
+
+    def setUp(self):
+        self.poll_interval = driver.TASK_POLL_INTERVAL
+        driver.TASK_POLL_INTERVAL = 0.01
+        TraceTestCase.setUp(self)
+
+    def tearDown(self):
+        TraceTestCase.tearDown(self)
+        driver.TASK_POLL_INTERVAL = self.poll_interval
+
+    def test_polls_counted(self):
+        with trace.count_calls() as counter:
+            self._spawn("new")
+        self.assertTrue(counter.counts["RetrieveProperties"] > 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
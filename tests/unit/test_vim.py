@@ -0,0 +1,208 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+"""
+Tests of the API version key of the WSDL cache and of the transports of
+the VIM Objects, against a local HTTP server standing in for the host.
+"""
+
+import BaseHTTPServer
+import os
+import shutil
+import SocketServer
+import tempfile
+import threading
+import time
+import unittest
+
+from pyvmwareapi import executor
+from pyvmwareapi import simulator
+from pyvmwareapi import vim
+
+try:
+    import suds.transport.https
+except ImportError:
+    suds = None
+
+try:
+    import eventlet
+except ImportError:
+    eventlet = None
+
+VERSIONS = "<namespaces><namespace>urn:vim25</namespace></namespaces>"
+WSDL = """<?xml version="1.0"?>
+<definitions xmlns="http://schemas.xmlsoap.org/wsdl/"
+             xmlns:soap="http://schemas.xmlsoap.org/wsdl/soap/"
+             xmlns:tns="urn:test" targetNamespace="urn:test">
+  <portType name="TestPortType"/>
+  <binding name="TestBinding" type="tns:TestPortType">
+    <soap:binding style="document"
+                  transport="http://schemas.xmlsoap.org/soap/http"/>
+  </binding>
+  <service name="TestService">
+    <port name="TestPort" binding="tns:TestBinding">
+      <soap:address location="http://localhost/sdk"/>
+    </port>
+  </service>
+</definitions>
+"""
+
+
+class VersionsHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Serves the versions of the host."""
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.server.lock.acquire()
+        self.server.paths.append(self.path)
+        self.server.in_flight += 1
+        self.server.max_in_flight = max(self.server.max_in_flight,
+                                        self.server.in_flight)
+        self.server.lock.release()
+        time.sleep(self.server.delay)
+        self.server.lock.acquire()
+        self.server.in_flight -= 1
+        self.server.lock.release()
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(VERSIONS)))
+        self.end_headers()
+        self.wfile.write(VERSIONS)
+
+
+class VersionsServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+
+    daemon_threads = True
+
+    def __init__(self):
+        BaseHTTPServer.HTTPServer.__init__(self, ("127.0.0.1", 0),
+                                           VersionsHandler)
+        self.lock = threading.Lock()
+        # Paths of the GETs served
+        self.paths = []
+        # Seconds each GET takes
+        self.delay = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def host(self):
+        return "127.0.0.1:%d" % self.server_port
+
+
+@unittest.skipIf(suds is None, "suds is not installed")
+class VersionKeyTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.server = VersionsServer()
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.setDaemon(True)
+        thread.start()
+        self.wsdl_loc = "http://%s/sdk/vimService.wsdl" % self.server.host()
+        vim._VERSION_KEYS.clear()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        vim._VERSION_KEYS.clear()
+
+    def _vim(self, protocol="http"):
+        # Only the attributes the version key needs, no client is built
+        vim_obj = simulator.FakeVim(simulator.Simulator())
+        vim_obj._protocol = protocol
+        vim_obj._host_name = self.server.host()
+        vim_obj._transport_factory = suds.transport.https.HttpAuthenticated
+        return vim_obj
+
+    def test_scheme(self):
+        self._vim()._get_api_version_key(self.wsdl_loc)
+        self.assertEqual(self.server.paths, ["/sdk/vimServiceVersions.xml"])
+
+    def test_fetched_once(self):
+        key = self._vim()._get_api_version_key(self.wsdl_loc)
+        self.assertEqual(self._vim()._get_api_version_key(self.wsdl_loc),
+                         key)
+        self.assertEqual(len(self.server.paths), 1)
+
+    def test_versions_in_key(self):
+        key = self._vim()._get_api_version_key(self.wsdl_loc)
+        vim._VERSION_KEYS.clear()
+        # Without the versions, the key only digests the location
+        self.server.shutdown()
+        self.server.server_close()
+        self.assertNotEqual(self._vim()._get_api_version_key(self.wsdl_loc),
+                            key)
+
+
+@unittest.skipIf(suds is None, "suds is not installed")
+class SchemaCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.wsdl_loc = "file://" + os.path.join(self.dir, "vimService.wsdl")
+        wsdl_file = open(self.wsdl_loc[len("file://"):], "w")
+        wsdl_file.write(WSDL)
+        wsdl_file.close()
+        self.cache_dir = os.path.join(self.dir, "cache")
+        vim._CLIENTS.clear()
+        vim._VERSION_KEYS.clear()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+        vim._CLIENTS.clear()
+        vim._VERSION_KEYS.clear()
+
+    def test_parsed_wsdl_cached(self):
+        vim_obj = simulator.FakeVim(simulator.Simulator())
+        vim_obj._protocol = "http"
+        vim_obj._host_name = "localhost"
+        vim_obj._transport_factory = suds.transport.https.HttpAuthenticated
+        vim_obj._get_client(self.wsdl_loc, "http://localhost/sdk",
+                            self.cache_dir)
+        names = []
+        for path, dirs, files in os.walk(self.cache_dir):
+            names.extend(files)
+        # The pickled Definitions, for a new process not to parse them
+        self.assertTrue([name for name in names if name.endswith("-wsdl.px")],
+                        names)
+
+
+@unittest.skipIf(suds is None or eventlet is None,
+                 "suds or eventlet is not installed")
+class TransportTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.addCleanup(executor.set_backend, executor._BACKEND)
+        executor.set_backend("eventlet")
+        self.server = VersionsServer()
+        self.server.delay = 0.2
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.setDaemon(True)
+        thread.start()
+        self.url = "http://%s/sdk/vimServiceVersions.xml" % (
+                                                        self.server.host())
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_default(self):
+        self.assertTrue(vim.get_transport_factory() is
+                        vim.GreenHttpsTransport)
+        executor.set_backend("threads")
+        self.assertTrue(vim.get_transport_factory() is
+                        suds.transport.https.HttpAuthenticated)
+
+    def test_calls_overlap(self):
+        # The calls of the greenthreads wait on the network together,
+        # instead of blocking the hub one after the other
+        def _open(index):
+            transport = vim.get_transport_factory()()
+            return transport.open(suds.transport.Request(self.url)).read()
+
+        pool = executor.get_backend().pool(2)
+        self.assertEqual(list(pool.imap(_open, range(2))), [VERSIONS] * 2)
+        self.assertEqual(self.server.max_in_flight, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,98 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+"""
+Tests of the specs cached per client factory, built with the factory of
+the simulator.
+"""
+
+import unittest
+
+from pyvmwareapi import simulator
+from pyvmwareapi import vim_util
+
+
+class SpecCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.factory = simulator.FakeFactory()
+        self.spec_cache = vim_util.get_spec_cache(self.factory)
+        self.root_folder = simulator.ManagedObjectReference("Folder",
+                                                            "group-d1")
+
+    def test_per_client_factory(self):
+        self.assertTrue(vim_util.get_spec_cache(self.factory) is
+                        self.spec_cache)
+        # Kept alive, the cache only holds a weak reference to it
+        other_factory = simulator.FakeFactory()
+        other = vim_util.get_spec_cache(other_factory)
+        self.assertFalse(other is self.spec_cache)
+        self.assertFalse(other.get_property_spec("VirtualMachine") is
+                         self.spec_cache.get_property_spec("VirtualMachine"))
+
+    def test_property_spec_key(self):
+        spec = self.spec_cache.get_property_spec("VirtualMachine",
+                                                 ["name", "runtime"])
+        self.assertTrue(self.spec_cache.get_property_spec("VirtualMachine",
+                            ("name", "runtime")) is spec)
+        self.assertTrue(self.spec_cache.get_property_spec("VirtualMachine",
+                                                          ["name"]) is
+                        self.spec_cache.get_property_spec("VirtualMachine"))
+        self.assertFalse(self.spec_cache.get_property_spec("VirtualMachine",
+                             ["runtime", "name"]) is spec)
+        self.assertFalse(self.spec_cache.get_property_spec("HostSystem",
+                             ["name", "runtime"]) is spec)
+        self.assertEqual(spec.type, "VirtualMachine")
+        self.assertEqual(list(spec.pathSet), ["name", "runtime"])
+
+    def test_traversal_spec_reused(self):
+        traversal_spec = self.spec_cache.get_recursive_traversal_spec()
+        self.assertTrue(self.spec_cache.get_recursive_traversal_spec() is
+                        traversal_spec)
+        filter_spec = self.spec_cache.get_objects_filter_spec(
+                                    self.root_folder, "VirtualMachine")
+        self.assertTrue(filter_spec.objectSet[0].selectSet[0] is
+                        traversal_spec)
+        self.assertTrue(self.spec_cache.get_objects_filter_spec(
+                            self.root_folder, "VirtualMachine") is
+                        filter_spec)
+
+    def test_cached_specs_read_only(self):
+        property_spec = self.spec_cache.get_property_spec("VirtualMachine")
+        self.assertRaises(TypeError, setattr, property_spec, "type",
+                          "HostSystem")
+        self.assertRaises(TypeError, delattr, property_spec, "pathSet")
+        # The arrays are tuples, they cannot be added to
+        self.assertFalse(hasattr(property_spec.pathSet, "append"))
+        filter_spec = self.spec_cache.get_objects_filter_spec(
+                                    self.root_folder, "VirtualMachine")
+        object_spec = filter_spec.objectSet[0]
+        self.assertRaises(TypeError, setattr, object_spec, "skip", True)
+        traversal_spec = object_spec.selectSet[0]
+        self.assertRaises(TypeError, setattr, traversal_spec, "path", "vm")
+        self.assertRaises(TypeError, setattr,
+                          traversal_spec.selectSet[0], "name", "other")
+        # Unchanged for the next callers
+        self.assertEqual(property_spec.type, "VirtualMachine")
+        self.assertEqual(traversal_spec.path, "childEntity")
+        self.assertFalse(object_spec.skip)
+        # The references held are not made read-only
+        self.assertTrue(object_spec.obj is self.root_folder)
+        self.root_folder.value = "group-d1"
+
+    def test_built_specs_writable(self):
+        property_spec = vim_util.build_property_spec(self.factory,
+                                                     "VirtualMachine")
+        property_spec.type = "HostSystem"
+        property_spec.pathSet.append("runtime")
+        self.assertEqual(property_spec.pathSet, ["name", "runtime"])
+        # A cached spec can be combined with new ones
+        filter_spec = vim_util.get_prop_filter_spec(self.factory,
+                        [vim_util.get_obj_spec(self.factory,
+                                               self.root_folder)],
+                        [self.spec_cache.get_property_spec("Network")])
+        filter_spec.propSet.append(property_spec)
+        self.assertEqual(len(filter_spec.propSet), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,84 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+"""
+Tests of the lookup of the VMs by instance UUID and by name.
+"""
+
+import unittest
+import uuid
+
+from pyvmwareapi import executor
+from pyvmwareapi import simulator
+from pyvmwareapi import vm_util
+
+
+class VMLookupTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.addCleanup(executor.set_backend, executor._BACKEND)
+        executor.set_backend("threads")
+        self.sim = simulator.Simulator(num_vms=3)
+        self.conn = self.sim.driver()
+
+    def tearDown(self):
+        self.conn.close()
+
+    def _instance(self, name, instance_uuid=None):
+        instance = {'name': name, 'vcpus': 1, 'memory_mb': 128}
+        if instance_uuid is not None:
+            instance['uuid'] = instance_uuid
+        return instance
+
+    def test_get_info_by_uuid(self):
+        instance = self._instance("new", str(uuid.uuid4()))
+        self.conn.spawn(instance, 1024 * 1024)
+        self.sim.reset_call_counts()
+        self.assertEqual(self.conn.get_info(instance)['num_cpu'], 1)
+        self.assertEqual(self.sim.call_counts["FindByUuid"], 1)
+        self.assertEqual(self.sim.call_counts.get("RetrievePropertiesEx"),
+                         None)
+
+    def test_unknown_uuid(self):
+        instance = self._instance("vm-000000", str(uuid.uuid4()))
+        self.assertRaises(Exception, self.conn.get_info, instance)
+
+    def test_destroy_by_uuid(self):
+        instance = self._instance("new", str(uuid.uuid4()))
+        self.conn.spawn(instance, 1024 * 1024)
+        self.conn.destroy(instance)
+        self.assertFalse("new" in self.conn.list_instances())
+
+    def test_spawn_duplicate_uuid(self):
+        instance_uuid = str(uuid.uuid4())
+        self.conn.spawn(self._instance("new", instance_uuid), 1024 * 1024)
+        self.assertRaises(Exception, self.conn.spawn,
+                          self._instance("other", instance_uuid),
+                          1024 * 1024)
+
+    def test_spawn_duplicate_name_with_uuid(self):
+        self.assertRaises(Exception, self.conn.spawn,
+                          self._instance("vm-000000", str(uuid.uuid4())),
+                          1024 * 1024)
+        self.assertEqual(self.conn.list_instances().count("vm-000000"), 1)
+
+    def test_spawn_duplicate_name(self):
+        self.assertRaises(Exception, self.conn.spawn,
+                          self._instance("vm-000000"), 1024 * 1024)
+
+    def test_check_absent_without_scan(self):
+        self.sim.reset_call_counts()
+        self.conn._vmops._check_vm_absent(
+                            self._instance("new", str(uuid.uuid4())),
+                            simulator.DATACENTER_NAME)
+        self.assertEqual(self.sim.call_counts["FindByUuid"], 1)
+        self.assertEqual(self.sim.call_counts["FindByInventoryPath"], 1)
+        self.assertEqual(self.sim.call_counts.get("RetrievePropertiesEx"),
+                         None)
+
+    def test_inventory_path_escaped(self):
+        self.assertEqual(vm_util.build_vm_inventory_path("dc", "a/b%c"),
+                         "dc/vm/a%2fb%25c")
+
+
+if __name__ == "__main__":
+    unittest.main()